@@ -8,8 +8,6 @@ import os
 import sys
 import csv
 import json
-import requests
-import time
 from datetime import datetime
 
 # Add Django to path
@@ -22,6 +20,8 @@ django.setup()
 from apps.inscriptions.models import Inscription
 from django.db.models import Q
 
+from download_annotations import download_annotations
+
 
 def export_inscriptions():
     """Export inscriptions with transcription data to CSV."""
@@ -82,70 +82,12 @@ def export_inscriptions():
     return csv_filename
 
 
-def download_annotation(surface_id):
-    """Download annotation for a single surface."""
-    url = f"https://saintsophia.dh.gu.se/api/inscriptions/annotation/?surface={surface_id}"
-    
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 404:
-            return None  # No annotation found
-        else:
-            print(f"Error {response.status_code} for surface {surface_id}")
-            return None
-    except Exception as e:
-        print(f"Request failed for {surface_id}: {e}")
-        return None
-
-
 def download_all_annotations(csv_filename):
     """Download annotations for all inscriptions in CSV."""
     print("\nDownloading annotations.")
-    
-    # Create output directory
-    output_dir = 'annotations'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    successful = 0
-    failed = 0
-    
-    with open(csv_filename, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        
-        for row in reader:
-            inscription_id = row['id']
-            panel_title = row['panel_title']
-            
-            if not panel_title:
-                print(f"No panel title for inscription {inscription_id}")
-                failed += 1
-                continue
 
-            print(f"Downloading annotation for inscription {inscription_id} (surface {panel_title})")
-
-            annotation_data = download_annotation(panel_title)
-            
-            if annotation_data:
-                # Save to file
-                filename = f"annotation_{inscription_id}.json"
-                filepath = os.path.join(output_dir, filename)
-                
-                with open(filepath, 'w', encoding='utf-8') as af:
-                    json.dump(annotation_data, af, indent=2, ensure_ascii=False)
-                
-                print(f"Saved {filename}")
-                successful += 1
-            else:
-                print(f"No annotation found")
-                failed += 1
-            
-            time.sleep(0.5)  # Be nice to the server
-    
-    print(f"\nDownload complete: {successful} successful, {failed} failed")
-    print(f"Annotation files saved in '{output_dir}' folder")
+    # Concurrent, deduplicated per surface and resumable, see download_annotations.py
+    download_annotations(csv_filename, output_dir='annotations')
 
 
 def create_simple_dataset(csv_filename):
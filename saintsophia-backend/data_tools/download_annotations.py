@@ -1,106 +1,281 @@
 #!/usr/bin/env python3
 """
 Download annotation data for inscriptions from CSV file.
+
+Each surface (panel title) is downloaded once, however many inscriptions are on it, by a pool of
+worker threads sharing keep-alive connections and a request rate limit. A manifest in the output
+folder remembers the ETag and Last-Modified of every surface, so that reruns after an interruption
+only download the surfaces which are missing or changed.
 """
 
 import os
 import csv
 import json
+import random
 import requests
+import threading
 import time
-import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
 
 
-def download_annotation(surface_id):
-    """Download annotation for a single surface."""
-    url = f"https://saintsophia.dh.gu.se/api/inscriptions/annotation/?surface={surface_id}"
-    
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 404:
-            return None  # No annotation found
+BASE_URL = "https://saintsophia.dh.gu.se"
+ANNOTATION_PATH = "/api/inscriptions/annotation/"
+
+MANIFEST_FILENAME = "manifest.json"
+SURFACES_DIRNAME = "surfaces"
+
+# Statuses worth retrying, the server is busy or temporarily failing
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest wait in seconds before a retry, whatever the Retry-After of the server
+MAX_RETRY_DELAY = 60
+
+
+class TokenBucket:
+    """Rate limit shared by the worker threads, allowing short bursts up to the capacity."""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def create_session(workers):
+    """Session with a connection pool large enough to keep a connection alive per worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def surface_path(output_dir, surface_id):
+    return os.path.join(output_dir, SURFACES_DIRNAME, f"{quote(surface_id, safe='')}.json")
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(path, data, **kwargs):
+    """Writes through a temporary file, so that an interruption never leaves a truncated file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def download_annotation(session, bucket, base_url, surface_id, entry, retries=5, timeout=10):
+    """Download annotation for a single surface, unless unchanged since the manifest entry.
+
+    Returns a tuple of status and data. The status is 'changed' with the annotation data,
+    'unchanged' if the server answered 304, 'missing' if there is no annotation, or 'failed'.
+    """
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    url = f"{base_url.rstrip('/')}{ANNOTATION_PATH}"
+
+    for attempt in range(retries + 1):
+        bucket.acquire()
+
+        try:
+            response = session.get(url, params={'surface': surface_id}, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            error = f"Request failed for {surface_id}: {e}"
+            retry_after = None
         else:
-            print(f"Error {response.status_code} for surface {surface_id}")
-            return None
-    except Exception as e:
-        print(f"Request failed for {surface_id}: {e}")
-        return None
+            if response.status_code == 304:
+                return 'unchanged', None
+            if response.status_code == 404:
+                return 'missing', None
+            if response.status_code == 200:
+                try:
+                    return 'changed', (response.json(), response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                except ValueError:
+                    print(f"Invalid JSON for surface {surface_id}")
+                    return 'failed', None
+
+            error = f"Error {response.status_code} for surface {surface_id}"
+            if response.status_code not in RETRY_STATUSES:
+                break
+            retry_after = response.headers.get('Retry-After')
 
+        if attempt < retries:
+            # Exponential backoff with jitter, or as long as the server asks within bounds
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt * (0.5 + random.random())
+            time.sleep(min(delay, MAX_RETRY_DELAY))
 
-def download_annotations(csv_filename):
+    print(error)
+    return 'failed', None
+
+
+def download_annotations(csv_filename, output_dir='annotations', base_url=BASE_URL, workers=8, rate=10.0):
     """Download annotations for all inscriptions in CSV."""
     if not os.path.exists(csv_filename):
         print(f"Error: File {csv_filename} not found")
         return False
-    
+
     print(f"Downloading annotations from {csv_filename}...")
-    
+
     # Create output directory
-    output_dir = 'annotations'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        print(f"Created {output_dir}/ directory")
-    
-    successful = 0
-    failed = 0
+    os.makedirs(os.path.join(output_dir, SURFACES_DIRNAME), exist_ok=True)
+
+    # Inscriptions per surface, each surface is downloaded once
+    surfaces = {}
     no_panel = 0
-    
+
     with open(csv_filename, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
-        
+
         for row in reader:
             inscription_id = row['id']
             panel_title = row['panel_title']
-            
+
             if not panel_title:
                 print(f"Inscription {inscription_id}: No panel title")
                 no_panel += 1
                 continue
-            
-            # print(f"Inscription {inscription_id} → Surface {panel_title}", end="")
-            
-            annotation_data = download_annotation(panel_title)
-            
-            if annotation_data:
-                # Save to file
-                filename = f"annotation_{inscription_id}.json"
-                filepath = os.path.join(output_dir, filename)
-                
-                with open(filepath, 'w', encoding='utf-8') as af:
-                    json.dump(annotation_data, af, indent=2, ensure_ascii=False)
-                
-                num_items = len(annotation_data) if isinstance(annotation_data, list) else 1
-                # print(f"({num_items} annotation(s))")
-                successful += 1
-            else:
-                print("(no annotation)")
-                failed += 1
-            
-            time.sleep(0.5)  # Be nice to the server
-    
+
+            surfaces.setdefault(panel_title, []).append(inscription_id)
+
+    manifest = load_manifest(output_dir)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+
+    print(f"{sum(map(len, surfaces.values()))} inscriptions on {len(surfaces)} surfaces, {workers} workers at {rate:g} requests/s")
+
+    session = create_session(workers)
+    bucket = TokenBucket(rate)
+    counts = {'changed': 0, 'unchanged': 0, 'missing': 0, 'failed': 0}
+    successful = 0
+    start = time.perf_counter()
+
+    def process(surface_id):
+        # A surface known to have data but whose file is gone is downloaded again
+        entry = manifest.get(surface_id, {})
+        if entry.get('status') in ('changed', 'unchanged') and not os.path.exists(surface_path(output_dir, surface_id)):
+            entry = {}
+
+        status, result = download_annotation(session, bucket, base_url, surface_id, entry)
+        written = 0
+
+        try:
+            data = None
+            if status == 'changed':
+                data, etag, last_modified = result
+                save_json(surface_path(output_dir, surface_id), data)
+                entry = {'etag': etag, 'last_modified': last_modified}
+
+            elif status == 'unchanged':
+                with open(surface_path(output_dir, surface_id), 'r', encoding='utf-8') as sf:
+                    data = json.load(sf)
+
+            # One file per inscription, as used by create_dataset.py
+            if data:
+                for inscription_id in surfaces[surface_id]:
+                    filepath = os.path.join(output_dir, f"annotation_{inscription_id}.json")
+                    save_json(filepath, data, indent=2)
+                    written += 1
+
+        except (OSError, ValueError) as e:
+            print(f"Could not save surface {surface_id}: {e}")
+            status = 'failed'
+
+        return surface_id, status, entry, written
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    try:
+        futures = [executor.submit(process, surface_id) for surface_id in surfaces]
+
+        for done, future in enumerate(as_completed(futures), 1):
+            surface_id, status, entry, written = future.result()
+            counts[status] += 1
+            successful += written
+
+            if status == 'failed':
+                continue
+
+            manifest[surface_id] = {**entry, 'status': status, 'inscriptions': surfaces[surface_id], 'checked_at': datetime.now().isoformat()}
+
+            # Saved regularly as well, so that even a killed run resumes close to where it stopped
+            if done % 50 == 0:
+                save_json(manifest_path, manifest, indent=2)
+
+    except KeyboardInterrupt:
+        print("\nInterrupted, rerun to resume the remaining surfaces")
+        raise
+
+    finally:
+        # Queued surfaces are dropped, the running ones finish their writes
+        executor.shutdown(wait=True, cancel_futures=True)
+        save_json(manifest_path, manifest, indent=2)
+
+    duration = time.perf_counter() - start
+
     print(f"\nDownload summary:")
-    print(f"Successful: {successful}")
-    print(f"Failed/No annotation: {failed}")
+    print(f"Surfaces downloaded: {counts['changed']}")
+    print(f"Surfaces unchanged: {counts['unchanged']}")
+    print(f"Surfaces without annotation: {counts['missing']}")
+    print(f"Surfaces failed: {counts['failed']}")
+    print(f"Inscriptions with annotation: {successful}")
     print(f"No panel title: {no_panel}")
+    print(f"Took {duration:.1f}s ({len(surfaces) / max(duration, 1e-9):.1f} surfaces/s)")
     print(f"Files saved in '{output_dir}/' folder")
-    
+
     return successful > 0
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python download_annotations.py <inscriptions_csv_file>")
-        print("Example: python download_annotations.py inscriptions_20240812_123456.csv")
-        sys.exit(1)
-    
-    csv_file = sys.argv[1]
-    success = download_annotations(csv_file)
-    
+    parser = argparse.ArgumentParser(description="Download annotation data for inscriptions from CSV file.")
+    parser.add_argument('csv_file', help="Inscriptions CSV, e.g. inscriptions_20240812_123456.csv")
+    parser.add_argument('--output-dir', default='annotations', help="Folder of the annotation files and manifest (default: annotations)")
+    parser.add_argument('--base-url', default=BASE_URL, help=f"API server, e.g. a local stand-in like http://localhost:8000 (default: {BASE_URL})")
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent downloads (default: 8)")
+    parser.add_argument('--rate', type=float, default=10.0, help="Maximal requests per second (default: 10)")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    success = download_annotations(args.csv_file, args.output_dir, args.base_url, args.workers, args.rate)
+
     if success:
         print(f"\nNext step: Create combined dataset:")
-        # print(f"python create_dataset.py {csv_file}")
+        # print(f"python create_dataset.py {args.csv_file}")
     else:
         print("\nNo annotations downloaded.")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests of download_annotations.py against a local stand-in of the annotation API.
+
+**Usage:**
+    python -m unittest test_download_annotations
+"""
+
+import csv
+import json
+import os
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from download_annotations import MANIFEST_FILENAME, download_annotations
+
+
+class AnnotationServer(ThreadingHTTPServer):
+    """Serves an annotation per surface with an ETag, answering conditional requests with a 304.
+    Surfaces listed in failures answer with the given statuses first, those in broken always with a 500."""
+
+    daemon_threads = True
+
+    def __init__(self, annotations):
+        super().__init__(('127.0.0.1', 0), AnnotationHandler)
+        self.annotations = annotations
+        self.failures = {}
+        self.broken = set()
+        self.requests = Counter()
+        self.not_modified = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class AnnotationHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        surface = parse_qs(urlparse(self.path).query).get('surface', [''])[0]
+
+        with server.lock:
+            server.requests[surface] += 1
+            failures = server.failures.get(surface)
+            status = failures.pop(0) if failures else None
+
+        if status is not None or surface in server.broken:
+            self.send_response(status or 500)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+
+        if surface not in server.annotations:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = f'"{surface}-v1"'
+        if self.headers.get('If-None-Match') == etag:
+            with server.lock:
+                server.not_modified[surface] += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        body = json.dumps(server.annotations[surface]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadAnnotationsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AnnotationServer({
+            '208-02': [{'id': 1, 'surface': '208-02'}],
+            '208-03': [{'id': 2, 'surface': '208-03'}],
+        })
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.output_dir = os.path.join(self.directory.name, 'annotations')
+        self.csv_filename = os.path.join(self.directory.name, 'inscriptions.csv')
+
+        with open(self.csv_filename, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['id', 'panel_title'])
+            writer.writeheader()
+            writer.writerows([
+                {'id': '10', 'panel_title': '208-02'},
+                {'id': '11', 'panel_title': '208-02'},
+                {'id': '12', 'panel_title': '208-03'},
+                {'id': '13', 'panel_title': '999-99'},
+                {'id': '14', 'panel_title': ''},
+            ])
+
+    def download(self):
+        return download_annotations(self.csv_filename, self.output_dir, self.server.base_url, workers=4, rate=1000)
+
+    def read_annotation(self, inscription_id):
+        with open(os.path.join(self.output_dir, f"annotation_{inscription_id}.json"), encoding='utf-8') as f:
+            return json.load(f)
+
+    def read_manifest(self):
+        with open(os.path.join(self.output_dir, MANIFEST_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_surfaces_downloaded_once(self):
+        self.assertTrue(self.download())
+
+        self.assertEqual(self.server.requests, Counter({'208-02': 1, '208-03': 1, '999-99': 1}))
+        self.assertEqual(self.read_annotation(10), self.read_annotation(11))
+        self.assertEqual(self.read_annotation(12), [{'id': 2, 'surface': '208-03'}])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "annotation_13.json")))
+        self.assertEqual(self.read_manifest()['999-99']['status'], 'missing')
+
+    def test_unchanged_surfaces_not_downloaded_again(self):
+        self.download()
+        os.remove(os.path.join(self.output_dir, "annotation_10.json"))
+
+        self.assertTrue(self.download())
+
+        self.assertEqual(self.server.not_modified, Counter({'208-02': 1, '208-03': 1}))
+        self.assertEqual(self.read_annotation(10), [{'id': 1, 'surface': '208-02'}])
+        self.assertEqual(self.read_manifest()['208-02']['status'], 'unchanged')
+
+    def test_busy_server_retried(self):
+        self.server.failures['208-02'] = [503, 429]
+
+        self.assertTrue(self.download())
+
+        self.assertEqual(self.server.requests['208-02'], 3)
+        self.assertEqual(self.read_annotation(10), [{'id': 1, 'surface': '208-02'}])
+
+    def test_failed_surfaces_resumed(self):
+        self.server.broken.add('208-03')
+        self.download()
+
+        self.assertNotIn('208-03', self.read_manifest())
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "annotation_12.json")))
+
+        # Only the failed surface is downloaded again, the others are checked with conditional requests
+        self.server.broken.clear()
+        self.server.requests.clear()
+        self.download()
+
+        self.assertEqual(self.server.requests, Counter({'208-02': 1, '208-03': 1, '999-99': 1}))
+        self.assertEqual(self.server.not_modified, Counter({'208-02': 1}))
+        self.assertEqual(self.read_annotation(12), [{'id': 2, 'surface': '208-03'}])
+        self.assertEqual(self.read_manifest()['208-03']['status'], 'changed')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import TilingJob
 
 # Register your models here.
+
+@admin.register(TilingJob)
+class TilingJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'app_label', 'model_name', 'object_id', 'status', 'progress', 'attempts', 'duration', 'created_at', 'finished_at']
+    list_filter = ['status', 'app_label', 'model_name']
+    readonly_fields = [field.name for field in TilingJob._meta.fields]
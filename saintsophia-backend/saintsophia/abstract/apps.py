@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, m2m_changed
 
 
 class AbstractConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "saintsophia.abstract"
+
+    def ready(self):
+        from .caching import invalidate_model
+        from .pooling import count_connection
+
+        # Invalidate cached counts and responses on every write
+        post_save.connect(invalidate_model, dispatch_uid="abstract_invalidate_post_save")
+        post_delete.connect(invalidate_model, dispatch_uid="abstract_invalidate_post_delete")
+        m2m_changed.connect(invalidate_model, dispatch_uid="abstract_invalidate_m2m_changed")
+
+        # Connection metrics for the pool statistics view
+        connection_created.connect(count_connection, dispatch_uid="abstract_count_connection")
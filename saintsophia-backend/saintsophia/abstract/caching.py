@@ -0,0 +1,415 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections, models
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.translation import get_language
+from rest_framework.response import Response
+
+from typing import *
+import hashlib
+import json
+import time
+
+# Query parameters which select a page or a representation, but do not filter the rows
+NON_FILTER_PARAMS = {'limit', 'offset', 'page', 'page_size', 'cursor', 'pagination', 'format', 'estimate', 'depth', 'facets'}
+
+# Sizes of the values of the BoundedLocMemCache instances, shared like the values by the instances of a name
+_sizes: Dict[str, Dict[str, int]] = {}
+_totals: Dict[str, int] = {}
+
+
+class BoundedLocMemCache(LocMemCache):
+    """
+    LocMemCache bounded by the total size of its pickled values as well as their number, evicting the
+    least recently used values once the MAX_BYTES option is exceeded. Values of responses vary widely
+    in size, so that a bound on their number alone bounds the memory of a process poorly.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._name = name
+        self._sizes = _sizes.setdefault(name, {})
+        self._max_bytes = int(params.get('OPTIONS', {}).get('MAX_BYTES', 64 * 1024 * 1024))
+        _totals.setdefault(name, 0)
+
+    def _forget(self, key: str) -> None:
+        _totals[self._name] -= self._sizes.pop(key, 0)
+
+    def _evict(self, count: int) -> None:
+        # The values are ordered from the most to the least recently used
+        for _ in range(min(count, len(self._cache))):
+            key, _ = self._cache.popitem()
+            self._expire_info.pop(key, None)
+            self._forget(key)
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._forget(key)
+        super()._set(key, value, timeout)
+
+        self._sizes[key] = len(value)
+        _totals[self._name] += len(value)
+
+        while _totals[self._name] > self._max_bytes and len(self._cache) > 1:
+            self._evict(1)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._evict(len(self._cache))
+        else:
+            self._evict(len(self._cache) // self._cull_frequency)
+
+    def _delete(self, key):
+        self._forget(key)
+        return super()._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._evict(len(self._cache))
+
+
+class CachedResponseHit(Exception):
+    """Ends the handling of a request answered from the response cache, see CachedResponseMixin."""
+
+    def __init__(self, response: HttpResponse):
+        super().__init__()
+        self.response = response
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def get_version_cache():
+    return caches[settings.API_VERSION_CACHE_ALIAS]
+
+
+def new_version() -> int:
+    # Counters start at a value unique in time, so that a counter lost by the cache never repeats an old version
+    return time.time_ns()
+
+
+def get_version_key(model: Type[models.Model]) -> str:
+    return f"version:{model._meta.label_lower}"
+
+
+def get_written_key(model: Type[models.Model]) -> str:
+    return f"written:{model._meta.label_lower}"
+
+
+def get_related_models(model: Type[models.Model], depth: int = 1) -> List[Type[models.Model]]:
+    """The model itself and all models related to it, in either direction, up to a number of relations away.
+    Responses and counts for a model may depend on any of them, through nested serialization or filters across relations.
+
+    Args:
+        model (Type[models.Model]): A Django model
+        depth (int, optional): The number of relations to follow. Defaults to 1.
+
+    Returns:
+        List[Type[models.Model]]: The models, sorted by label
+    """
+
+    related = {model}
+    current = {model}
+
+    for _ in range(depth):
+        current = {
+            field.related_model
+            for current_model in current
+            for field in current_model._meta.get_fields()
+            if field.is_relation and field.related_model is not None and field.related_model not in related
+        }
+        related |= current
+
+    return sorted(related, key=lambda related_model: related_model._meta.label_lower)
+
+
+def get_model_versions(model: Type[models.Model], depth: int = 1) -> str:
+    """The combined version counters of a model and its related models. Any write to one of them
+    changes the result, which invalidates every cache entry keyed on it.
+
+    Args:
+        model (Type[models.Model]): A Django model
+        depth (int, optional): The number of relations to follow. Defaults to 1.
+
+    Returns:
+        str: The versions, joined by colons
+    """
+
+    cache = get_version_cache()
+    related = get_related_models(model, depth)
+    keys = [get_version_key(related_model) for related_model in related]
+
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Another process may start the same counters meanwhile, whichever is added first is kept
+        for key in missing:
+            cache.add(key, new_version(), None)
+        versions.update(cache.get_many(missing))
+
+    return ":".join(str(versions[key]) for key in keys)
+
+
+def bump_model_version(model: Type[models.Model]) -> None:
+    cache = get_version_cache()
+    key = get_version_key(model)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Never read before, or lost by the cache, start a new counter
+        cache.add(key, new_version(), None)
+
+    cache.set(get_written_key(model), time.time(), None)
+
+
+def is_cacheable_read(model: Type[models.Model], depth: int = 1) -> bool:
+    """Whether values read for a model in the current request may be cached. Reads from a replica shortly
+    after a write to the model or its related models may miss the write, and would otherwise be cached
+    under the new versions until they expire.
+
+    Args:
+        model (Type[models.Model]): A Django model
+        depth (int, optional): The number of relations to follow. Defaults to 1.
+
+    Returns:
+        bool: False if the request read from a replica within the lag window of a write
+    """
+
+    from saintsophia import routers
+
+    if not routers.is_reading_replica():
+        return True
+
+    # Replicas lag by at most REPLICA_MAX_LAG, as of their last check
+    window = settings.REPLICA_MAX_LAG + settings.REPLICA_LAG_CHECK_INTERVAL
+    written = get_version_cache().get_many([get_written_key(related_model) for related_model in get_related_models(model, depth)])
+
+    return all(time.time() - written_at > window for written_at in written.values())
+
+
+def get_or_set(key: str, model: Type[models.Model], default: Callable[[], Any], timeout: Optional[int] = DEFAULT_TIMEOUT, depth: int = 1) -> Any:
+    """Like cache.get_or_set, leaving out values which may be stale, see is_cacheable_read.
+
+    Args:
+        key (str): The cache key
+        model (Type[models.Model]): The model the value was read for
+        default (Callable[[], Any]): Computes the value if not cached
+        timeout (Optional[int], optional): The timeout of the value. Defaults to that of the cache.
+        depth (int, optional): The number of relations the value depends on. Defaults to 1.
+
+    Returns:
+        Any: The cached or computed value
+    """
+
+    cache = get_cache()
+
+    value = cache.get(key)
+    if value is None:
+        value = default()
+        if is_cacheable_read(model, depth):
+            cache.set(key, value, timeout)
+
+    return value
+
+
+def invalidate_model(sender, instance=None, model=None, **kwargs) -> None:
+    """Signal receiver for post_save, post_delete and m2m_changed, bumping the versions of the
+    written models."""
+
+    if instance is not None:
+        bump_model_version(type(instance))
+
+    # The other side of a many-to-many change
+    if model is not None:
+        bump_model_version(model)
+
+    # Writes to an auto-created through table, e.g. with bulk operations
+    if sender is not None and sender._meta.auto_created:
+        bump_model_version(sender)
+
+
+def get_filter_signature(request) -> Dict[str, List[str]]:
+    """The filtering query parameters of a request, normalized so that equivalent
+    requests get the same signature regardless of parameter order.
+
+    Args:
+        request (Request): A DRF request
+
+    Returns:
+        Dict[str, List[str]]: The sorted parameters and their sorted values
+    """
+
+    params = request.query_params
+
+    return {key: sorted(params.getlist(key)) for key in sorted(params) if key not in NON_FILTER_PARAMS}
+
+
+def make_cache_key(prefix: str, model: Type[models.Model], *parts: Any, depth: int = 1) -> str:
+    """Builds a cache key for a model from arbitrary JSON serializable parts,
+    including the current versions of the model and its related models.
+
+    Args:
+        prefix (str): The kind of cached value, e.g. 'count'
+        model (Type[models.Model]): A Django model
+        depth (int, optional): The number of relations to follow for the versions. Defaults to 1.
+
+    Returns:
+        str: The cache key
+    """
+
+    content = json.dumps([get_model_versions(model, depth), *parts], sort_keys=True, default=str)
+    digest = hashlib.sha1(content.encode()).hexdigest()
+
+    return f"{prefix}:{model._meta.label_lower}:{digest}"
+
+
+def get_cached_count(queryset: models.QuerySet, request) -> int:
+    """Exact count of a filtered queryset, cached per path and filter signature until one
+    of the involved models is written to. The path tells apart the views of the same model,
+    whose querysets may differ.
+
+    Args:
+        queryset (models.QuerySet): The filtered queryset
+        request (Request): The DRF request which filtered it
+
+    Returns:
+        int: The number of rows
+    """
+
+    key = make_cache_key('count', queryset.model, request.path, get_filter_signature(request))
+
+    return get_or_set(key, queryset.model, queryset.count, settings.COUNT_CACHE_TIMEOUT)
+
+
+def estimate_count(queryset: models.QuerySet) -> int:
+    """Estimated count of a queryset from the PostgreSQL statistics, avoiding a scan of the table.
+    Unfiltered querysets use the row estimate of the table in pg_class, filtered ones the row
+    estimate of the query plan. Falls back to an exact count on other databases.
+
+    Args:
+        queryset (models.QuerySet): A queryset
+
+    Returns:
+        int: The estimated number of rows
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    with connection.cursor() as cursor:
+
+        if not queryset.query.has_filters() and not queryset.query.distinct:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+
+            # Tables which were never analyzed have no estimate
+            if row and row[0] >= 0:
+                return row[0]
+
+            return queryset.count()
+
+        sql, params = queryset.order_by().query.get_compiler(using=queryset.db).as_sql()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+
+        # Depending on the driver the plan is returned parsed or as text
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CachedResponseMixin:
+    """
+    Caches the rendered responses of anonymous GET requests, keyed on scheme, host, path, normalized query parameters,
+    language and media type, together with the versions of the model and its related models, so that any
+    write invalidates them. Responses carry an ETag, and conditional requests are answered with a 304,
+    cached ones without touching the database.
+    """
+
+    cache_responses = True
+    cached_actions = ('list', 'retrieve', 'count', 'facets')
+
+    # Headers of the responses restored with them from the cache
+    cached_headers = ('X-Count-Estimate',)
+
+    response_cache_key = None
+
+    def is_response_cacheable(self, request) -> bool:
+        return (
+            self.cache_responses
+            and settings.API_CACHE_RESPONSES
+            and request.method in ('GET', 'HEAD')
+            and self.action in self.cached_actions
+            and request.query_params.get('stream', '').lower() not in ('true', '1')
+            and not request.user.is_authenticated
+        )
+
+    def get_response_cache_key(self, request) -> str:
+        params = {key: sorted(request.query_params.getlist(key)) for key in sorted(request.query_params)}
+        depth = max(1, getattr(self, 'get_depth', lambda: 1)())
+
+        # Bodies hold absolute URLs, e.g. of pagination links
+        return make_cache_key(
+            'response', self.queryset.model, request.scheme, request.get_host(), request.path, params, get_language(), request.accepted_media_type, depth=depth,
+        )
+
+    def get_etag(self, content: bytes) -> str:
+        return f'"{hashlib.sha1(content).hexdigest()}"'
+
+    def build_cached_response(self, request, content: bytes, content_type: str, etag: str, headers: Dict[str, str]) -> HttpResponse:
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+
+        response['ETag'] = etag
+        for name, value in headers.items():
+            response[name] = value
+
+        return response
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self.response_cache_key = None
+        if not self.is_response_cacheable(request):
+            return
+
+        self.response_cache_key = self.get_response_cache_key(request)
+        cached = get_cache().get(self.response_cache_key)
+
+        # Answer from the cache instead of running the action
+        if cached is not None:
+            raise CachedResponseHit(self.build_cached_response(request, *cached))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CachedResponseHit):
+            return exc.response
+
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        if self.response_cache_key is None or not isinstance(response, Response) or response.status_code != 200:
+            return response
+
+        response.render()
+        etag = self.get_etag(response.content)
+
+        depth = max(1, getattr(self, 'get_depth', lambda: 1)())
+        if len(response.content) <= settings.API_CACHE_MAX_RESPONSE_SIZE and is_cacheable_read(self.queryset.model, depth):
+            headers = {name: response[name] for name in self.cached_headers if response.has_header(name)}
+            get_cache().set(self.response_cache_key, (response.content, response['Content-Type'], etag, headers))
+
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+
+        response['ETag'] = etag
+
+        return response
@@ -0,0 +1,240 @@
+"""
+Compiled serialization for read-only list endpoints. The fields of a serializer class are compiled
+once into a flat extraction plan, which reads rows with values() and builds the representation
+directly, skipping model instantiation and DRF's per-object field traversal. The output is identical
+to that of the serializer. Serializers with nested, computed or custom fields are not compiled,
+and are served by DRF as before.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+from collections import defaultdict
+from functools import lru_cache
+from typing import *
+
+# Fields whose representation of a non-null value is a plain type conversion
+CONVERTERS = {
+    serializers.BooleanField: bool,
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+    serializers.CharField: str,
+}
+
+# Fields whose representation is delegated to the field itself, with the value from values()
+DELEGATED = (
+    serializers.ChoiceField,
+    serializers.DateTimeField,
+    serializers.DateField,
+    serializers.TimeField,
+    serializers.DecimalField,
+    serializers.JSONField,
+    serializers.UUIDField,
+    serializers.FileField,
+    serializers.ImageField,
+)
+
+
+class CompiledField(NamedTuple):
+    name: str
+    source: str
+    kind: str
+    convert: Optional[Callable[[Any], Any]] = None
+
+
+def compile_field(model: Type[models.Model], name: str, field: serializers.Field) -> Optional[CompiledField]:
+    """Compiles a serializer field into the column it reads and the conversion it applies,
+    or returns None if the field cannot be compiled."""
+
+    from rest_framework_gis.fields import GeometryField
+
+    if field.source == '*' or '.' in field.source:
+        return None
+
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+
+    if not model_field.concrete:
+        return None
+
+    field_type = type(field)
+
+    if model_field.many_to_many:
+        if isinstance(field, ManyRelatedField) and type(field.child_relation) is PrimaryKeyRelatedField and field.child_relation.pk_field is None:
+            return CompiledField(name, field.source, 'many')
+        return None
+
+    if model_field.is_relation:
+        if field_type is PrimaryKeyRelatedField and field.pk_field is None:
+            return CompiledField(name, field.source, 'value')
+        return None
+
+    if field_type in CONVERTERS:
+        return CompiledField(name, field.source, 'value', CONVERTERS[field_type])
+
+    if field_type in DELEGATED or field_type is GeometryField:
+        # Files are represented from a FieldFile, rebuilt from the stored name
+        kind = 'file' if issubclass(field_type, serializers.FileField) else 'delegate'
+        return CompiledField(name, field.source, kind)
+
+    return None
+
+
+class SerializationPlan:
+    """
+    The compiled representation of a model serializer class.
+    """
+
+    def __init__(self, serializer_class: Type[serializers.ModelSerializer], fields: List[CompiledField], geo_field: str = None, id_field: str = None) -> None:
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.fields = fields
+        self.geo_field = geo_field
+        self.id_field = id_field
+
+        self.columns = sorted({self.model._meta.pk.name} | {field.source for field in fields if field.kind != 'many'})
+
+    def values(self, queryset: models.QuerySet) -> models.QuerySet:
+        """The queryset as rows of the compiled columns, to be paginated like the queryset itself."""
+
+        return queryset.select_related(None).prefetch_related(None).values(*self.columns)
+
+    def get_many(self, rows: List[Dict], source: str, db: str) -> Dict[Any, List]:
+        """Fetches the primary keys of a many-to-many relation for all rows in one query, in the
+        order the related manager would return them."""
+
+        pk = self.model._meta.pk.name
+        related = self.model._meta.get_field(source).related_model
+
+        ordering = [
+            f"-{source}__{order[1:]}" if order.startswith('-') else f"{source}__{order}"
+            for order in related._meta.ordering if isinstance(order, str)
+        ]
+
+        pairs = (
+            self.model._base_manager.using(db)
+            .filter(pk__in=[row[pk] for row in rows])
+            .order_by(pk, *ordering)
+            .values_list(pk, source)
+        )
+
+        related_keys = defaultdict(list)
+        for key, related_key in pairs:
+            if related_key is not None:
+                related_keys[key].append(related_key)
+
+        return related_keys
+
+    def represent(self, rows: Iterable[Dict], context: Dict, db: str = 'default') -> Union[List, Dict]:
+        """Builds the representation of the rows, as the serializer would with many=True.
+
+        Args:
+            rows (Iterable[Dict]): Rows from values(), e.g. a page
+            context (Dict): The serializer context
+            db (str, optional): The database of the rows. Defaults to 'default'.
+
+        Returns:
+            Union[List, Dict]: A list of objects, or a FeatureCollection for GeoJSON serializers
+        """
+
+        rows = list(rows)
+        pk = self.model._meta.pk.name
+
+        # Bound fields of a serializer in the current context, for delegated conversions
+        bound = self.serializer_class(context=context).fields
+
+        many = {field.source: self.get_many(rows, field.source, db) for field in self.fields if field.kind == 'many'}
+
+        def convert(field: CompiledField, row: Dict):
+            if field.kind == 'many':
+                return many[field.source].get(row[pk], [])
+
+            value = row[field.source]
+            if value is None:
+                return None
+
+            if field.kind == 'value':
+                return field.convert(value) if field.convert else value
+
+            if field.kind == 'file':
+                model_field = self.model._meta.get_field(field.source)
+                value = model_field.attr_class(None, model_field, value)
+
+            return bound[field.name].to_representation(value)
+
+        if self.geo_field is None:
+            return [{field.name: convert(field, row) for field in self.fields} for row in rows]
+
+        features = []
+        for row in rows:
+            feature = {}
+            properties = {}
+
+            for field in self.fields:
+                if field.name == self.id_field:
+                    feature['id'] = convert(field, row)
+                elif field.name != self.geo_field:
+                    properties[field.name] = convert(field, row)
+
+            feature['type'] = "Feature"
+            feature['geometry'] = convert(next(field for field in self.fields if field.name == self.geo_field), row)
+            feature['properties'] = properties
+
+            # Keep the key order of GeoFeatureModelSerializer
+            features.append({key: feature[key] for key in ('id', 'type', 'geometry', 'properties') if key in feature})
+
+        return {"type": "FeatureCollection", "features": features}
+
+
+@lru_cache(maxsize=256)
+def compile_serializer(serializer_class: Type[serializers.Serializer]) -> Optional[SerializationPlan]:
+    """Compiles a model serializer class into a SerializationPlan, once per class.
+
+    Args:
+        serializer_class (Type[serializers.Serializer]): A serializer class
+
+    Returns:
+        Optional[SerializationPlan]: The plan, or None if the serializer cannot be compiled
+    """
+
+    from rest_framework_gis.serializers import GeoFeatureModelSerializer
+
+    if not issubclass(serializer_class, serializers.ModelSerializer):
+        return None
+
+    geo = issubclass(serializer_class, GeoFeatureModelSerializer)
+    base = GeoFeatureModelSerializer if geo else serializers.Serializer
+
+    # Custom representations cannot be compiled
+    if serializer_class.to_representation is not base.to_representation:
+        return None
+
+    if geo and serializer_class.get_properties is not GeoFeatureModelSerializer.get_properties:
+        return None
+
+    serializer = serializer_class(context={})
+    model = serializer_class.Meta.model
+    fields = []
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        compiled = compile_field(model, name, field)
+        if compiled is None:
+            return None
+
+        fields.append(compiled)
+
+    if not geo:
+        return SerializationPlan(serializer_class, fields)
+
+    meta = serializer.Meta
+    if getattr(meta, 'auto_bbox', False) or getattr(meta, 'bbox_geo_field', None):
+        return None
+
+    return SerializationPlan(serializer_class, fields, geo_field=meta.geo_field, id_field=meta.id_field)
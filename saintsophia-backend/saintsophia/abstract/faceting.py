@@ -0,0 +1,169 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models
+from django.db.models.functions import Cast, Floor
+from rest_framework.exceptions import ValidationError
+
+from typing import *
+
+# Fields which cannot be grouped by meaningfully
+UNSUPPORTED_TYPES = {'GeometryField', 'PointField', 'LineStringField', 'PolygonField', 'MultiPointField', 'MultiLineStringField',
+                     'MultiPolygonField', 'GeometryCollectionField', 'SearchVectorField', 'JSONField', 'FileField', 'ImageField', 'BinaryField'}
+
+NUMERIC_TYPES = {'IntegerField', 'SmallIntegerField', 'BigIntegerField', 'PositiveIntegerField', 'PositiveSmallIntegerField',
+                 'PositiveBigIntegerField', 'FloatField', 'DecimalField'}
+
+
+class Facet(NamedTuple):
+    """A field path to count the distinct values of, optionally in numeric buckets of a size."""
+    name: str
+    path: str
+    bucket: Optional[float] = None
+
+    def get_expression(self) -> models.Expression:
+        if self.bucket is None:
+            return models.F(self.path)
+
+        return Floor(Cast(self.path, models.FloatField()) / self.bucket) * self.bucket
+
+
+def resolve_field(model: Type[models.Model], path: str) -> models.Field:
+    """Resolves a field path across relations, e.g. 'panel__room'.
+
+    Args:
+        model (Type[models.Model]): The model the path starts from
+        path (str): The field path
+
+    Raises:
+        FieldDoesNotExist: If a part of the path is not a field, or not a relation before the last part
+
+    Returns:
+        models.Field: The field at the end of the path
+    """
+
+    parts = path.split('__')
+
+    for index, part in enumerate(parts):
+        field = model._meta.get_field(part)
+
+        if index < len(parts) - 1:
+            if not field.is_relation:
+                raise FieldDoesNotExist(f"{part} is not a relation")
+            model = field.related_model
+
+    return field
+
+
+def parse_facets(model: Type[models.Model], spec: str, allowed: Optional[Iterable[str]] = None, limit: int = 10) -> List[Facet]:
+    """Parses the facets of a request, given as comma separated field paths, each optionally followed by
+    a bucket size for numeric fields, e.g. 'language,panel__room,min_year:50'.
+
+    Args:
+        model (Type[models.Model]): The model of the view
+        spec (str): The value of the facets parameter
+        allowed (Optional[Iterable[str]], optional): The field paths which may be used. None allows any field path of the model.
+        limit (int, optional): The maximal number of facets. Defaults to 10.
+
+    Raises:
+        ValidationError: If a facet is not a valid field path or bucket size, or there are too many
+
+    Returns:
+        List[Facet]: The facets, in the order given
+    """
+
+    facets = []
+
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        path, _, bucket = item.partition(':')
+
+        try:
+            field = resolve_field(model, path)
+        except FieldDoesNotExist:
+            raise ValidationError({'facets': f"{path} is not a field."})
+
+        if (allowed is not None and path not in allowed) or field.get_internal_type() in UNSUPPORTED_TYPES:
+            raise ValidationError({'facets': f"{path} cannot be used as a facet."})
+
+        if bucket:
+            try:
+                bucket = float(bucket)
+            except ValueError:
+                raise ValidationError({'facets': f"The bucket size of {path} must be a number."})
+
+            if bucket <= 0 or field.get_internal_type() not in NUMERIC_TYPES:
+                raise ValidationError({'facets': f"{path} cannot be counted in buckets of {bucket:g}."})
+
+        facets.append(Facet(item, path, bucket or None))
+
+    if len(facets) > limit:
+        raise ValidationError({'facets': f"At most {limit} facets can be requested at once."})
+
+    return facets
+
+
+def get_depth(facets: List[Facet]) -> int:
+    """The number of relations the facets follow at most, for the model versions their counts depend on."""
+
+    return max((facet.path.count('__') + 1 for facet in facets), default=1)
+
+
+def format_value(facet: Facet, value: Any) -> Any:
+    # Whole bucket bounds read better as integers, e.g. years
+    if facet.bucket is not None and value is not None and float(value).is_integer():
+        return int(value)
+
+    return value
+
+
+def count_facets(queryset: models.QuerySet, facets: List[Facet], limit: Optional[int] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Counts the distinct objects of a filtered queryset per value of each facet. On PostgreSQL all facets
+    are counted in a single query grouping by GROUPING SETS, other databases use a query per facet.
+
+    Args:
+        queryset (models.QuerySet): The filtered queryset
+        facets (List[Facet]): The facets to count
+        limit (Optional[int], optional): The maximal number of values per facet. Defaults to all values.
+
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: The values and counts per facet, the most frequent values first
+    """
+
+    columns = {f"facet_{index}": facet.get_expression() for index, facet in enumerate(facets)}
+    results = {facet.name: [] for facet in facets}
+
+    connection = connections[queryset.db]
+
+    if connection.vendor != 'postgresql':
+        for name, facet in zip(columns, facets):
+            rows = queryset.order_by().values(**{name: columns[name]}).annotate(facet_count=models.Count('pk', distinct=True)).order_by('-facet_count')
+            if limit is not None:
+                rows = rows[:limit]
+
+            results[facet.name] = [{'value': format_value(facet, row[name]), 'count': row['facet_count']} for row in rows]
+
+    else:
+        # Objects appear once per joined row of to-many relations, hence the distinct count of the primary keys
+        sql, params = queryset.order_by().values(facet_pk=models.F('pk'), **columns).query.get_compiler(using=queryset.db).as_sql()
+
+        names = list(columns)
+        grouping = ", ".join(f"GROUPING({name})" for name in names)
+        sets = ", ".join(f"({name})" for name in names)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(names)}, {grouping}, COUNT(DISTINCT facet_pk) "
+                f"FROM ({sql}) AS facets GROUP BY GROUPING SETS ({sets})",
+                params,
+            )
+
+            for row in cursor.fetchall():
+                values, groupings, count = row[:len(names)], row[len(names):-1], row[-1]
+
+                # The column of the grouping set of the row is the one not aggregated away
+                index = groupings.index(0)
+                results[facets[index].name].append({'value': format_value(facets[index], values[index]), 'count': count})
+
+    for name, buckets in results.items():
+        buckets.sort(key=lambda bucket: -bucket['count'])
+        results[name] = buckets[:limit]
+
+    return results
@@ -0,0 +1,339 @@
+from django.conf import settings
+from django.contrib.gis.db.models.functions import GeometryDistance
+from django.contrib.gis.geos import GEOSException, GEOSGeometry, Point
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models
+from django.db.models.functions import Greatest
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from functools import reduce
+from typing import *
+import operator
+
+from .folding import FOLD_FUNCTION, fold
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    Full-text search over the text_vector of AbstractDocumentModel subclasses, as maintained by the
+    SearchVectorTrigger migration operation. Matches are found through the GIN index of the vector and ordered
+    by rank, annotated with the rank as search_rank and highlighted snippets of the text as search_headline.
+    Models without a text_vector are left unfiltered.
+    """
+
+    search_param = 'q'
+    vector_field = 'text_vector'
+    headline_field = 'text'
+
+    @classmethod
+    def get_search_queries(cls, request, model: Type[models.Model]) -> Dict[str, SearchQuery]:
+        terms = request.query_params.get(cls.search_param, '').strip()
+        if not terms:
+            return {}
+
+        try:
+            model._meta.get_field(cls.vector_field)
+        except FieldDoesNotExist:
+            return {}
+
+        # Parsed with every configuration of the trigger, so that stemmed and unstemmed lexemes match
+        return {config: SearchQuery(terms, config=config, search_type='websearch') for config in settings.SEARCH_CONFIGS}
+
+    @classmethod
+    def get_search_query(cls, request, model: Type[models.Model]) -> Optional[SearchQuery]:
+        queries = cls.get_search_queries(request, model)
+        if not queries:
+            return None
+
+        return reduce(operator.or_, queries.values())
+
+    def get_headline(self, query: SearchQuery, queries: Dict[str, SearchQuery]) -> models.Expression:
+        """Highlights the terms with the configuration of a query which matched, so that the text is parsed into the same lexemes.
+        Stemming configurations are tried first, as they highlight every inflection of the terms, 'simple' only the exact words."""
+
+        headlines = {
+            config: SearchHeadline(
+                self.headline_field,
+                query,
+                config=config,
+                start_sel='<mark>',
+                stop_sel='</mark>',
+                max_fragments=settings.SEARCH_HEADLINE_FRAGMENTS,
+            )
+            for config in sorted(queries, key=lambda config: config == 'simple')
+        }
+
+        return models.Case(
+            *(models.When(models.Q(**{self.vector_field: queries[config]}), then=headline) for config, headline in headlines.items()),
+            default=next(iter(headlines.values())),
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        queries = self.get_search_queries(request, queryset.model)
+        if not queries:
+            return queryset
+
+        query = reduce(operator.or_, queries.values())
+        headline = self.get_headline(query, queries)
+
+        return (
+            queryset
+            .filter(**{self.vector_field: query})
+            .annotate(search_rank=SearchRank(models.F(self.vector_field), query), search_headline=headline)
+            .order_by('-search_rank', 'pk')
+        )
+
+    def get_schema_operation_parameters(self, view):
+        try:
+            view.queryset.model._meta.get_field(self.vector_field)
+        except (AttributeError, FieldDoesNotExist):
+            return []
+
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': "Full-text search terms, supporting quoted phrases, OR and -exclusions. Results are ordered by rank.",
+                'schema': {'type': 'string'},
+            },
+        ]
+
+
+class Fold(models.Func):
+    function = FOLD_FUNCTION
+    output_field = models.TextField()
+
+
+class TrigramWordMatch(models.Func):
+    """Whether the words of a term are similar to a part of a text by at least the pg_trgm.word_similarity_threshold,
+    with the <% operator, which is supported by trigram GIN indexes."""
+    template = '%(expressions)s'
+    arg_joiner = ' <%% '
+    output_field = models.BooleanField()
+
+
+class FuzzySearchFilter(BaseFilterBackend):
+    """
+    Fuzzy search tolerating spelling variants, abbreviations and damaged letters, comparing the trigrams of
+    the folded search terms with the folded text of the fuzzy_search_fields of the view. Matches are found
+    through the indexes of the FuzzySearchIndex migration operation, and ordered by their word similarity,
+    which is annotated as fuzzy_similarity. The minimal similarity is given by ?similarity=, between 0 and 1.
+
+    Opt in by adding the backend to the filter_backends of a view, and listing the fields:
+
+        fuzzy_search_fields = ['transcription', 'interpretative_edition', 'romanisation']
+
+    Requires the FuzzySearchResetMiddleware.
+    """
+
+    search_param = 'fuzzy'
+    similarity_param = 'similarity'
+
+    def get_fuzzy_search_fields(self, view) -> List[str]:
+        return getattr(view, 'fuzzy_search_fields', [])
+
+    def get_similarity(self, request) -> float:
+        similarity = request.query_params.get(self.similarity_param)
+        if similarity is None:
+            return settings.FUZZY_SIMILARITY_THRESHOLD
+
+        try:
+            similarity = float(similarity)
+        except ValueError:
+            raise ValidationError({self.similarity_param: "Must be a number between 0 and 1."})
+
+        if not 0 <= similarity <= 1:
+            raise ValidationError({self.similarity_param: "Must be a number between 0 and 1."})
+
+        return similarity
+
+    def filter_queryset(self, request, queryset, view):
+        terms = fold(request.query_params.get(self.search_param, '').strip())
+        fields = self.get_fuzzy_search_fields(view)
+
+        if not terms or not fields:
+            return queryset
+
+        # The threshold of the <% operator is a setting of the session, which outlasts the request on pooled and
+        # persistent connections. The FuzzySearchResetMiddleware resets it once the response is rendered
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)", [str(self.get_similarity(request))])
+
+        http_request = getattr(request, '_request', request)
+        http_request.trigram_threshold_aliases = {*getattr(http_request, 'trigram_threshold_aliases', ()), queryset.db}
+
+        term = models.Value(terms, output_field=models.TextField())
+        matches = reduce(operator.or_, (models.Q(TrigramWordMatch(term, Fold(field))) for field in fields))
+        similarities = [models.Func(term, Fold(field), function='word_similarity', output_field=models.FloatField()) for field in fields]
+
+        return (
+            queryset
+            .filter(matches)
+            .annotate(fuzzy_similarity=Greatest(*similarities) if len(similarities) > 1 else similarities[0])
+            .order_by('-fuzzy_similarity', 'pk')
+        )
+
+    def get_schema_operation_parameters(self, view):
+        if not self.get_fuzzy_search_fields(view):
+            return []
+
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': f"Fuzzy search terms, matched against {', '.join(self.get_fuzzy_search_fields(view))} regardless of diacritics and variant letters.",
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.similarity_param,
+                'required': False,
+                'in': 'query',
+                'description': f"Minimal similarity of fuzzy search matches, between 0 and 1. Defaults to {settings.FUZZY_SIMILARITY_THRESHOLD}.",
+                'schema': {'type': 'number', 'minimum': 0, 'maximum': 1},
+            },
+        ]
+
+
+class SpatialFilter(BaseFilterBackend):
+    """
+    Spatial queries on the geometry field of a GeoViewSet, in the coordinates of the field, answered through its GiST index:
+
+        ?near=x,y&k=N           the N geometries closest to a point, nearest first, with the KNN <-> operator
+        ?near=x,y&within_distance=D
+                                the geometries within a distance of a point, in the units of the field
+        ?intersects=<WKT>       the geometries intersecting a geometry, e.g. a polygon
+
+    The distances to the point are annotated as _knn_distance, which cannot clash with a field of the model.
+    """
+
+    near_param = 'near'
+    k_param = 'k'
+    distance_param = 'within_distance'
+    intersects_param = 'intersects'
+
+    # Bounds of ?k= and of the length of ?intersects=
+    max_k = 1000
+    max_wkt_length = 100000
+
+    distance_annotation = '_knn_distance'
+
+    def get_spatial_params(self) -> Tuple[str, ...]:
+        return (self.near_param, self.k_param, self.distance_param, self.intersects_param)
+
+    def get_geometry_field(self, queryset, view):
+        return queryset.model._meta.get_field(getattr(view, 'bbox_filter_field', 'geometry'))
+
+    def get_point(self, request, srid: int) -> Optional[Point]:
+        near = request.query_params.get(self.near_param)
+        if not near:
+            return None
+
+        try:
+            x, y = (float(value) for value in near.split(','))
+        except ValueError:
+            raise ValidationError({self.near_param: "Must be two numbers separated by a comma, x,y."})
+
+        return Point(x, y, srid=srid)
+
+    def get_number(self, request, param: str, cast: Callable, minimum: float, maximum: float = None):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+
+        try:
+            value = cast(value)
+        except ValueError:
+            raise ValidationError({param: "Must be a number."})
+
+        if value < minimum or (maximum is not None and value > maximum):
+            raise ValidationError({param: f"Must be between {minimum} and {maximum}." if maximum is not None else f"Must be at least {minimum}."})
+
+        return value
+
+    def get_intersects(self, request, srid: int) -> Optional[GEOSGeometry]:
+        wkt = request.query_params.get(self.intersects_param)
+        if not wkt:
+            return None
+
+        if len(wkt) > self.max_wkt_length:
+            raise ValidationError({self.intersects_param: f"Must be at most {self.max_wkt_length} characters."})
+
+        try:
+            geometry = GEOSGeometry(wkt)
+        except (GEOSException, ValueError):
+            raise ValidationError({self.intersects_param: "Must be a WKT geometry."})
+
+        # Coordinates are in those of the field unless given as EWKT
+        if not geometry.srid:
+            geometry.srid = srid
+
+        return geometry
+
+    def filter_queryset(self, request, queryset, view):
+        # Views of models without the geometry field are left alone unless spatial parameters are given
+        if not any(param in request.query_params for param in (*self.get_spatial_params(), 'in_bbox')):
+            return queryset
+
+        field = self.get_geometry_field(queryset, view)
+
+        point = self.get_point(request, field.srid)
+        k = self.get_number(request, self.k_param, int, 1, self.max_k)
+        distance = self.get_number(request, self.distance_param, float, 0)
+        intersects = self.get_intersects(request, field.srid)
+
+        if point is None and (k is not None or distance is not None):
+            raise ValidationError({self.near_param: f"Required by {self.k_param} and {self.distance_param}."})
+
+        if intersects is not None:
+            queryset = queryset.filter(**{f"{field.name}__intersects": intersects})
+
+        if point is None:
+            return queryset
+
+        if distance is not None:
+            queryset = queryset.filter(**{f"{field.name}__dwithin": (point, distance)})
+
+        queryset = queryset.annotate(**{self.distance_annotation: GeometryDistance(field.name, point)})
+
+        # The k nearest are found by an index scan ordered by <->, as a subquery so that later filters and pagination still apply
+        if k is not None:
+            nearest = queryset.order_by(self.distance_annotation).values('pk')[:k]
+            queryset = queryset.filter(pk__in=models.Subquery(nearest))
+
+        return queryset.order_by(self.distance_annotation, 'pk')
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.near_param,
+                'required': False,
+                'in': 'query',
+                'description': "A point as x,y, ordering the results by distance to it.",
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.k_param,
+                'required': False,
+                'in': 'query',
+                'description': f"The number of nearest results to the point given by {self.near_param}.",
+                'schema': {'type': 'integer', 'minimum': 1, 'maximum': self.max_k},
+            },
+            {
+                'name': self.distance_param,
+                'required': False,
+                'in': 'query',
+                'description': f"The maximal distance to the point given by {self.near_param}, in the units of the geometries.",
+                'schema': {'type': 'number', 'minimum': 0},
+            },
+            {
+                'name': self.intersects_param,
+                'required': False,
+                'in': 'query',
+                'description': "A WKT geometry, e.g. a polygon, the results intersect.",
+                'schema': {'type': 'string'},
+            },
+        ]
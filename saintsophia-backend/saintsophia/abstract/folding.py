@@ -0,0 +1,105 @@
+from typing import *
+import unicodedata
+
+# Name of the SQL function folding text like fold, created by the FuzzySearchIndex migration operation
+FOLD_FUNCTION = 'saintsophia_fold'
+
+# Combining marks removed after canonical decomposition: accents and breathings, the Cyrillic titlo,
+# pokrytie and pneumata, and the Cyrillic combining signs of the Extended-B block
+REMOVED = [
+    *map(chr, range(0x0300, 0x0370)),
+    *map(chr, range(0x0483, 0x048A)),
+    *map(chr, range(0xA66F, 0xA680)),
+]
+
+# Letters replaced by the plain letters they are searched as, including superscript letters
+# of abbreviations, which are written above the line in the inscriptions, and ligatures
+REPLACED = {
+    # Cyrillic
+    'ѣ': 'е', 'є': 'е', 'ѥ': 'е', 'ꙗ': 'я', 'ѧ': 'я', 'ѩ': 'я', 'ѫ': 'у', 'ѭ': 'ю', 'ѹ': 'у', 'ꙋ': 'у',
+    'ѡ': 'о', 'ѻ': 'о', 'ꙩ': 'о', 'ꙫ': 'о', 'ꙭ': 'о', 'ѽ': 'о', 'ѿ': 'от', 'ѳ': 'ф', 'ѵ': 'и', 'і': 'и',
+    'ї': 'и', 'ѕ': 'з', 'ꙃ': 'з', 'ꙁ': 'з', 'ѯ': 'к', 'ѱ': 'п', 'ꙑ': 'ы', 'ꙇ': 'и',
+    # Cyrillic superscript letters
+    'ⷠ': 'б', 'ⷡ': 'в', 'ⷢ': 'г', 'ⷣ': 'д', 'ⷤ': 'ж', 'ⷥ': 'з', 'ⷦ': 'к',
+    'ⷧ': 'л', 'ⷨ': 'м', 'ⷩ': 'н', 'ⷪ': 'о', 'ⷫ': 'п', 'ⷬ': 'р', 'ⷭ': 'с',
+    'ⷮ': 'т', 'ⷯ': 'х', 'ⷰ': 'ц', 'ⷱ': 'ч', 'ⷲ': 'ш', 'ⷳ': 'щ', 'ⷴ': 'ф',
+    'ⷶ': 'а', 'ⷷ': 'е', 'ⷺ': 'е', 'ⷻ': 'ю', 'ⷼ': 'я', 'ⷽ': 'я', 'ⷾ': 'у',
+    # Greek
+    'ς': 'σ', 'ϲ': 'σ', 'ϐ': 'β', 'ϑ': 'θ', 'ϕ': 'φ', 'ϱ': 'ρ', 'ϰ': 'κ', 'ϖ': 'π', 'ϝ': 'ϛ',
+}
+
+FOLD_TABLE = str.maketrans({**dict.fromkeys(REMOVED, None), **REPLACED})
+
+# Blocks of the scripts of the inscriptions, Latin, Greek and Cyrillic, whose case the SQL function folds itself.
+# lower() in the database follows its ctype, which e.g. under C leaves Greek and Cyrillic capitals untouched
+FOLDED_BLOCKS = [(0x0041, 0x024F), (0x0370, 0x03FF), (0x0400, 0x052F), (0x1C80, 0x1C8F), (0x2DE0, 0x2DFF), (0xA640, 0xA69F)]
+
+
+def fold(text: str) -> str:
+    """Folds text for fuzzy matching of spelling variants. Decomposes it, lowercases it, removes
+    diacritics, titlos and other combining marks, and replaces variant letters by their plain forms.
+    Equivalent to the SQL function FOLD_FUNCTION.
+
+    Args:
+        text (str): The text to fold
+
+    Returns:
+        str: The folded text
+    """
+
+    return unicodedata.normalize('NFD', text).lower().translate(FOLD_TABLE)
+
+
+def get_fold_mapping() -> Dict[str, str]:
+    """The folded form of every character of FOLDED_BLOCKS and REMOVED which fold changes, among
+    the characters left by canonical decomposition. These are folded by the SQL function without
+    relying on the case mapping of the database.
+
+    Returns:
+        Dict[str, str]: The folded forms, which may be empty or longer than a character
+    """
+
+    characters = {*REMOVED, *(chr(code) for start, end in FOLDED_BLOCKS for code in range(start, end + 1))}
+    mapping = {}
+
+    for character in sorted(characters):
+        # Decomposable characters never reach the mapping, their parts do
+        if unicodedata.normalize('NFD', character) != character:
+            continue
+
+        folded = fold(character)
+        if folded != character:
+            mapping[character] = folded
+
+    return mapping
+
+
+def get_fold_function_sql() -> str:
+    """The statement creating the SQL function FOLD_FUNCTION, built from the same tables as fold.
+    Characters folded to several are replaced first, then translate() maps the others, removing
+    those of its second argument without counterpart in the third. Characters outside of
+    FOLDED_BLOCKS are lowercased by lower(), according to the ctype of the database.
+
+    Returns:
+        str: The CREATE FUNCTION statement
+    """
+
+    mapping = get_fold_mapping()
+
+    # Mapped characters come first in the source, the removed ones after the end of the target
+    mapped = {character: folded for character, folded in mapping.items() if len(folded) == 1}
+    removed = [character for character, folded in mapping.items() if not folded]
+    replaced = {character: folded for character, folded in mapping.items() if len(folded) > 1}
+
+    expression = "normalize($1, NFD)"
+    for character, folded in replaced.items():
+        expression = f"replace({expression}, '{character}', '{folded}')"
+
+    source = ''.join(mapped) + ''.join(removed)
+    target = ''.join(mapped.values())
+
+    return (
+        f"CREATE OR REPLACE FUNCTION {FOLD_FUNCTION}(text) RETURNS text AS $$ "
+        f"SELECT lower(translate({expression}, '{source}', '{target}')) "
+        f"$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE"
+    )
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsGeoJSON, GeoFunc
+from django.db import models
+
+from typing import *
+
+
+class SimplifyPreserveTopology(GeoFunc):
+    function = 'ST_SimplifyPreserveTopology'
+    geom_param_pos = (0,)
+
+
+def get_zoom_tolerance(zoom: int) -> float:
+    """The simplification tolerance at a zoom level, one pixel of a 256 pixel map tile
+    in the units of the geometries, see SIMPLIFY_ZOOM0_TOLERANCE.
+
+    Args:
+        zoom (int): The zoom level
+
+    Returns:
+        float: The tolerance
+    """
+
+    return settings.SIMPLIFY_ZOOM0_TOLERANCE / 2 ** zoom
+
+
+def get_simplified_column(column: str, zoom: int) -> str:
+    """The name of the precomputed column of a geometry column for a zoom band,
+    as added by the SimplifiedGeometryColumns migration operation."""
+
+    return f"{column}_z{zoom}"
+
+
+def get_geojson_expression(model: Type[models.Model], geometry_field: str, tolerance: Optional[float] = None, zoom: Optional[int] = None,
+                           precision: Optional[int] = None, zoom_bands: Sequence[int] = ()) -> models.Expression:
+    """Builds the expression rendering a geometry field as GeoJSON text in the database, simplified by a tolerance
+    or for a zoom level, and rounded to a number of decimal digits. Zoom levels use the precomputed column of the
+    closest zoom band at least as detailed, if any, and simplify on the fly otherwise.
+
+    Args:
+        model (Type[models.Model]): The model of the geometry field
+        geometry_field (str): The name of the geometry field
+        tolerance (Optional[float], optional): The simplification tolerance. Defaults to None.
+        zoom (Optional[int], optional): The zoom level to simplify for, if no tolerance is given. Defaults to None.
+        precision (Optional[int], optional): The number of decimal digits. Defaults to settings.GEOJSON_PRECISION.
+        zoom_bands (Sequence[int], optional): The zoom levels of the precomputed columns. Defaults to ().
+
+    Returns:
+        models.Expression: The GeoJSON expression
+    """
+
+    field = model._meta.get_field(geometry_field)
+    geometry = models.F(geometry_field)
+
+    if tolerance is None and zoom is not None:
+        bands = [band for band in zoom_bands if band >= zoom]
+
+        if bands:
+            # The columns are unknown to the model, and are read from its table
+            column = get_simplified_column(field.column, min(bands))
+            geometry = models.expressions.RawSQL(f'"{model._meta.db_table}"."{column}"', [], output_field=field)
+        else:
+            tolerance = get_zoom_tolerance(zoom)
+
+    if tolerance is not None:
+        geometry = SimplifyPreserveTopology(geometry, models.Value(tolerance))
+
+    return AsGeoJSON(geometry, precision=settings.GEOJSON_PRECISION if precision is None else precision)
@@ -0,0 +1,377 @@
+"""
+A minimal IIIF Image API 3.0 server for the pyramid TIFFs generated by AbstractTIFFImageModel.
+It reads regions straight from the most suitable pyramid level with pyvips, keeps the opened
+files and the encoded responses in bounded LRU caches, and answers conditional requests.
+Meant for local development and small deployments, larger ones should use a dedicated IIIF server.
+"""
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse
+from django.shortcuts import redirect
+from django.urls import re_path
+from django.views.decorators.http import require_safe
+
+from PIL import Image
+from collections import OrderedDict
+from typing import *
+import hashlib
+import math
+import os
+import threading
+import pyvips
+
+FORMATS = {
+    'jpg': ('.jpg', 'image/jpeg'),
+    'png': ('.png', 'image/png'),
+    'webp': ('.webp', 'image/webp'),
+    'tif': ('.tif', 'image/tiff'),
+}
+
+QUALITIES = ('default', 'color', 'gray', 'bitonal')
+
+
+class IIIFError(ValueError):
+    """Raised for image requests which do not follow the IIIF Image API syntax."""
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache, bounded by the total size of its values."""
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = lambda value: 1) -> None:
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value) -> None:
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.items:
+                self.size -= self.sizeof(self.items.pop(key))
+
+            self.items[key] = value
+            self.size += size
+
+            while self.size > self.max_size:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+
+# Opened pyramids, keyed on path, and encoded responses, bounded by their size in bytes
+pyramid_cache = LRUCache(settings.IIIF_HANDLE_CACHE_SIZE)
+response_cache = LRUCache(settings.IIIF_RESPONSE_CACHE_SIZE, sizeof=len)
+
+
+class Pyramid:
+    """The levels of a pyramid TIFF, each opened once for random access."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+
+        pages = pyvips.Image.new_from_file(path).get('n-pages')
+        self.levels = [pyvips.Image.new_from_file(path, page=page) for page in range(pages)]
+
+        # The tile size is read from the TIFF header, without decoding anything
+        with Image.open(path) as image:
+            self.tile_width = image.tag_v2.get(322, 256)
+            self.tile_height = image.tag_v2.get(323, self.tile_width)
+
+    @property
+    def width(self) -> int:
+        return self.levels[0].width
+
+    @property
+    def height(self) -> int:
+        return self.levels[0].height
+
+    def get_level(self, scale: float) -> Tuple[int, pyvips.Image]:
+        """Returns the smallest level which still has at least the requested resolution."""
+
+        factor = 0
+        while factor + 1 < len(self.levels) and 2 ** (factor + 1) <= 1 / scale:
+            factor += 1
+
+        return 2 ** factor, self.levels[factor]
+
+
+def find_pyramid_path(identifier: str) -> str:
+    """Locates the pyramid of an image uuid in the IIIF directories of the apps."""
+
+    filename = f"{identifier}.tif"
+
+    for app in settings.APPS_LOCAL:
+        path = os.path.join(settings.MEDIA_ROOT, app['name'], 'iiif', filename)
+        if os.path.isfile(path):
+            return path
+
+    raise Http404(f"No image with identifier {identifier}")
+
+
+def get_pyramid(identifier: str) -> Pyramid:
+    path = find_pyramid_path(identifier)
+    pyramid = pyramid_cache.get(path)
+
+    # Reopen pyramids which have been regenerated since
+    if pyramid is None or pyramid.mtime != os.path.getmtime(path):
+        pyramid = Pyramid(path)
+        pyramid_cache.set(path, pyramid)
+
+    return pyramid
+
+
+def parse_region(region: str, width: int, height: int) -> Tuple[int, int, int, int]:
+
+    if region == 'full':
+        return 0, 0, width, height
+
+    if region == 'square':
+        side = min(width, height)
+        return (width - side) // 2, (height - side) // 2, side, side
+
+    if region.startswith('pct:'):
+        try:
+            x, y, w, h = (float(value) for value in region[4:].split(','))
+        except ValueError:
+            raise IIIFError(f"Invalid region: {region}")
+
+        x, y, w, h = round(x * width / 100), round(y * height / 100), round(w * width / 100), round(h * height / 100)
+
+    else:
+        try:
+            x, y, w, h = (int(value) for value in region.split(','))
+        except ValueError:
+            raise IIIFError(f"Invalid region: {region}")
+
+    # Regions extending beyond the image are cropped to it
+    w, h = min(w, width - x), min(h, height - y)
+    if x < 0 or y < 0 or w <= 0 or h <= 0:
+        raise IIIFError(f"Region outside of the image: {region}")
+
+    return x, y, w, h
+
+
+def parse_size(size: str, width: int, height: int) -> Tuple[int, int]:
+
+    upscale = size.startswith('^')
+    if upscale:
+        size = size[1:]
+
+    max_area = settings.IIIF_MAX_AREA
+
+    try:
+        if size == 'max':
+            w, h = width, height
+
+            if w * h > max_area:
+                scale = math.sqrt(max_area / (w * h))
+                w, h = int(w * scale), int(h * scale)
+
+            return w, h
+
+        if size.startswith('pct:'):
+            scale = float(size[4:]) / 100
+            if scale <= 0:
+                raise IIIFError(f"Invalid size: {size}")
+
+            w, h = round(width * scale), round(height * scale)
+
+        elif size.startswith('!'):
+            max_w, max_h = (int(value) for value in size[1:].split(','))
+            if max_w <= 0 or max_h <= 0:
+                raise IIIFError(f"Invalid size: {size}")
+
+            # The largest size within the box keeping the aspect ratio, never above the region size unless upscaling
+            scale = min(max_w / width, max_h / height)
+            if not upscale:
+                scale = min(scale, 1)
+
+            w, h = round(width * scale), round(height * scale)
+
+        else:
+            w, h = size.split(',')
+
+            if w and h:
+                w, h = int(w), int(h)
+            elif w:
+                w = int(w)
+                h = round(height * w / width)
+            elif h:
+                h = int(h)
+                w = round(width * h / height)
+            else:
+                raise IIIFError(f"Invalid size: {size}")
+
+            if w <= 0 or h <= 0:
+                raise IIIFError(f"Invalid size: {size}")
+
+    except ValueError:
+        raise IIIFError(f"Invalid size: {size}")
+
+    w, h = max(w, 1), max(h, 1)
+
+    if not upscale and (w > width or h > height):
+        raise IIIFError(f"Size {size} requires upscaling, use ^{size}")
+
+    if w * h > max_area:
+        raise IIIFError(f"Size {size} exceeds the maximum area of {max_area} pixels")
+
+    return w, h
+
+
+def parse_rotation(rotation: str) -> Tuple[bool, float]:
+
+    mirror = rotation.startswith('!')
+
+    try:
+        degrees = float(rotation[1:] if mirror else rotation)
+    except ValueError:
+        raise IIIFError(f"Invalid rotation: {rotation}")
+
+    if not 0 <= degrees <= 360:
+        raise IIIFError(f"Invalid rotation: {rotation}")
+
+    return mirror, degrees % 360
+
+
+def render(pyramid: Pyramid, region: str, size: str, rotation: str, quality: str, format: str) -> bytes:
+    """Renders an image request according to the IIIF Image API 3.0."""
+
+    if quality not in QUALITIES:
+        raise IIIFError(f"Invalid quality: {quality}")
+
+    if format not in FORMATS:
+        raise IIIFError(f"Unsupported format: {format}")
+
+    x, y, w, h = parse_region(region, pyramid.width, pyramid.height)
+    target_w, target_h = parse_size(size, w, h)
+    mirror, degrees = parse_rotation(rotation)
+
+    # Read the region from the smallest sufficient level instead of the full image
+    factor, level = pyramid.get_level(min(target_w / w, target_h / h))
+
+    left, top = x // factor, y // factor
+    width = max(1, min(math.ceil(w / factor), level.width - left))
+    height = max(1, min(math.ceil(h / factor), level.height - top))
+
+    image = level.crop(left, top, width, height)
+    image = image.resize(target_w / width, vscale=target_h / height)
+
+    if mirror:
+        image = image.fliphor()
+
+    if degrees in (90, 180, 270):
+        image = image.rot(f"d{int(degrees)}")
+    elif degrees:
+        image = image.rotate(degrees)
+
+    if quality in ('gray', 'bitonal'):
+        image = image.colourspace('b-w')
+
+    if quality == 'bitonal':
+        image = image >= 128
+
+    # JPEG has no alpha channel
+    if format == 'jpg' and image.hasalpha():
+        image = image.flatten(background=255)
+
+    suffix, _ = FORMATS[format]
+    options = {'Q': settings.IIIF_JPEG_QUALITY} if format in ('jpg', 'webp') else {}
+
+    return image.write_to_buffer(suffix, **options)
+
+
+def get_etag(pyramid: Pyramid, *params: str) -> str:
+    key = ":".join((pyramid.path, str(pyramid.mtime), *params))
+    return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+
+def add_cache_headers(response: HttpResponse, etag: str) -> HttpResponse:
+    response['ETag'] = etag
+    response['Cache-Control'] = f"public, max-age={settings.IIIF_CACHE_MAX_AGE}"
+    return response
+
+
+def get_base_uri(request, identifier: str) -> str:
+    return request.build_absolute_uri(f"{settings.IIIF_SERVER_PREFIX}{identifier}")
+
+
+@require_safe
+def base_view(request, identifier):
+    return redirect(f"{get_base_uri(request, identifier)}/info.json", permanent=False)
+
+
+@require_safe
+def info_view(request, identifier):
+    pyramid = get_pyramid(identifier)
+    etag = get_etag(pyramid, 'info.json', get_base_uri(request, identifier))
+
+    if request.headers.get('If-None-Match') == etag:
+        return add_cache_headers(HttpResponseNotModified(), etag)
+
+    info = {
+        "@context": "http://iiif.io/api/image/3/context.json",
+        "id": get_base_uri(request, identifier),
+        "type": "ImageService3",
+        "protocol": "http://iiif.io/api/image",
+        "profile": "level2",
+        "width": pyramid.width,
+        "height": pyramid.height,
+        "maxArea": settings.IIIF_MAX_AREA,
+        "sizes": [{"width": level.width, "height": level.height} for level in reversed(pyramid.levels)],
+        "tiles": [{
+            "width": pyramid.tile_width,
+            "height": pyramid.tile_height,
+            "scaleFactors": [2 ** factor for factor in range(len(pyramid.levels))],
+        }],
+        "extraQualities": ["color", "gray", "bitonal"],
+        "extraFormats": ["png", "webp", "tif"],
+        "extraFeatures": ["mirroring", "rotationArbitrary", "sizeUpscaling"],
+    }
+
+    response = JsonResponse(info, content_type="application/ld+json;profile=\"http://iiif.io/api/image/3/context.json\"")
+    return add_cache_headers(response, etag)
+
+
+@require_safe
+def image_view(request, identifier, region, size, rotation, quality, format):
+    pyramid = get_pyramid(identifier)
+    etag = get_etag(pyramid, region, size, rotation, quality, format)
+
+    if request.headers.get('If-None-Match') == etag:
+        return add_cache_headers(HttpResponseNotModified(), etag)
+
+    content = response_cache.get(etag)
+
+    if content is None:
+        try:
+            content = render(pyramid, region, size, rotation, quality, format)
+        except IIIFError as e:
+            return HttpResponseBadRequest(str(e))
+
+        response_cache.set(etag, content)
+
+    _, content_type = FORMATS[format]
+
+    return add_cache_headers(HttpResponse(content, content_type=content_type), etag)
+
+
+UUID_PATTERN = r'(?P<identifier>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})'
+
+urlpatterns = [
+    re_path(rf'^{UUID_PATTERN}/?$', base_view, name='iiif-base'),
+    re_path(rf'^{UUID_PATTERN}/info\.json$', info_view, name='iiif-info'),
+    re_path(rf'^{UUID_PATTERN}/(?P<region>[^/]+)/(?P<size>[^/]+)/(?P<rotation>[^/]+)/(?P<quality>[a-z]+)\.(?P<format>[a-z]+)$', image_view, name='iiif-image'),
+]
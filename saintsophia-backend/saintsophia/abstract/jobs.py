@@ -0,0 +1,232 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.db import models, transaction
+from django.utils import timezone
+
+from saintsophia.abstract.models import TilingJob, get_derivative_format, get_derivative_path, get_iiif_path, pyramid_is_current, save_tiled_pyramid_tif, update_file_fingerprint
+from saintsophia.storages import DerivativeFileStorage
+
+from datetime import timedelta
+from typing import *
+import os
+import socket
+import time
+import traceback
+
+# Minimum number of seconds between two progress updates of a job
+PROGRESS_INTERVAL = 2.0
+
+
+def get_worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_tiling_jobs(limit: int) -> List[int]:
+    """Marks up to `limit` pending jobs as running and returns their ids. Rows locked by
+    another worker are skipped, so several worker commands may share the same queue.
+
+    Args:
+        limit (int): The maximum number of jobs to claim
+
+    Returns:
+        List[int]: The ids of the claimed jobs
+    """
+
+    with transaction.atomic():
+        jobs = list(
+            TilingJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=TilingJob.PENDING)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:limit]
+        )
+
+        now = timezone.now()
+        TilingJob.objects.filter(id__in=jobs).update(
+            status=TilingJob.RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+            worker=get_worker_name(),
+            progress=0,
+        )
+
+    return jobs
+
+
+def beat_tiling_jobs(jobs: Iterable[int]) -> int:
+    """Refreshes the heartbeat of running jobs, telling other worker commands that they are not lost.
+
+    Args:
+        jobs (Iterable[int]): The ids of the jobs running in this worker command
+
+    Returns:
+        int: The number of refreshed jobs
+    """
+
+    return TilingJob.objects.filter(id__in=list(jobs), status=TilingJob.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_jobs(timeout: float, exclude: Iterable[int] = ()) -> int:
+    """Returns running jobs whose heartbeat has not been refreshed within `timeout` seconds to the queue,
+    e.g. after a worker command was killed. Long running jobs of live worker commands keep their heartbeat.
+
+    Args:
+        timeout (float): The number of seconds after which a running job without heartbeat is considered lost
+        exclude (Iterable[int], optional): The ids of jobs known to be still running. Defaults to ().
+
+    Returns:
+        int: The number of requeued jobs
+    """
+
+    beat_before = timezone.now() - timedelta(seconds=timeout)
+
+    return (
+        TilingJob.objects
+        .filter(status=TilingJob.RUNNING)
+        .filter(models.Q(heartbeat_at__lt=beat_before) | models.Q(heartbeat_at__isnull=True, started_at__lt=beat_before))
+        .exclude(id__in=list(exclude))
+        .update(status=TilingJob.PENDING)
+    )
+
+
+def fail_crashed_job(job_id: int, error: str, max_attempts: int = 3) -> str:
+    """Records a failed attempt of a job whose worker process died, returning it to the queue
+    until it has been attempted `max_attempts` times.
+
+    Args:
+        job_id (int): The id of a running job
+        error (str): The cause of the crash
+        max_attempts (int, optional): The number of attempts before a job is marked as failed. Defaults to 3.
+
+    Returns:
+        str: The resulting status of the job
+    """
+
+    with transaction.atomic():
+        job = TilingJob.objects.select_for_update().get(pk=job_id)
+
+        job.attempts += 1
+        job.error = error
+        job.status = TilingJob.FAILED if job.attempts >= max_attempts else TilingJob.PENDING
+        job.finished_at = timezone.now()
+        job.save(update_fields=['attempts', 'error', 'status', 'finished_at'])
+
+    return job.status
+
+
+def run_tiling_job(job_id: int, max_attempts: int = 3) -> str:
+    """Generates the pyramid of a claimed job and records its progress, timing and outcome.
+    Failed jobs are returned to the queue until they have been attempted `max_attempts` times.
+
+    Args:
+        job_id (int): The id of a running job
+        max_attempts (int, optional): The number of attempts before a job is marked as failed. Defaults to 3.
+
+    Returns:
+        str: The resulting status of the job
+    """
+
+    job = TilingJob.objects.get(pk=job_id)
+    job.worker = get_worker_name()
+
+    start = time.monotonic()
+    last_update = start
+
+    def report_progress(percent: int):
+        nonlocal last_update
+
+        # Throttle the writes, libvips reports progress very often
+        now = time.monotonic()
+        if now - last_update >= PROGRESS_INTERVAL:
+            TilingJob.objects.filter(pk=job_id).update(progress=percent, heartbeat_at=timezone.now())
+            last_update = now
+
+    # Only the fields of the outcome are saved, the progress is written by report_progress meanwhile
+    update_fields = ['worker', 'attempts', 'error', 'status', 'finished_at', 'duration']
+
+    try:
+        obj = job.get_object()
+
+        # The original is hashed here rather than in the request which queued the job
+        if not pyramid_is_current(obj):
+            save_tiled_pyramid_tif(obj, progress=report_progress)
+
+        obj.save(update_fields=['file_hash', 'file_size', 'file_mtime', 'iiif_file', 'iiif_signature', 'derivative_sizes', 'derivative_format'], generate_pyramid=False)
+
+    except Exception:
+        job.attempts += 1
+        job.error = traceback.format_exc()
+        job.status = TilingJob.FAILED if job.attempts >= max_attempts else TilingJob.PENDING
+
+    else:
+        job.error = ""
+        job.progress = 100
+        job.status = TilingJob.DONE
+        update_fields.append('progress')
+
+    job.finished_at = timezone.now()
+    job.duration = time.monotonic() - start
+    job.save(update_fields=update_fields)
+
+    return job.status
+
+
+def ingest_image(source: str, model_label: str, uuid: str, copied: Callable[[str], None] = None) -> Dict[str, Any]:
+    """Copies an image file into the OriginalFileStorage and generates its pyramid, without
+    saving a row. Used by the ingest_images command, which writes the rows in batches.
+    On failure the files written so far are removed again.
+
+    Args:
+        source (str): The path of the image file
+        model_label (str): The label of an AbstractTIFFImageModel subclass, e.g. 'inscriptions.image'
+        uuid (str): The uuid of the row to be created
+        copied (Callable[[str], None], optional): Called with the name the original was stored under. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: The field values of the row
+    """
+
+    model = apps.get_model(model_label)
+    obj = model(uuid=uuid)
+
+    with open(source, 'rb') as f:
+        obj.file.save(os.path.basename(source), File(f), save=False)
+
+    # The storage may have stored it under another name than the source, e.g. with a suffix
+    if copied:
+        copied(obj.file.name)
+
+    try:
+        update_file_fingerprint(obj)
+        save_tiled_pyramid_tif(obj)
+    except Exception:
+        remove_image_files(obj)
+        raise
+
+    return {
+        'uuid': obj.uuid,
+        'file': obj.file.name,
+        'iiif_file': obj.iiif_file.name,
+        'file_hash': obj.file_hash,
+        'file_size': obj.file_size,
+        'file_mtime': obj.file_mtime,
+        'iiif_signature': obj.iiif_signature,
+        'derivative_sizes': obj.derivative_sizes,
+        'derivative_format': obj.derivative_format,
+    }
+
+
+def remove_image_files(obj) -> None:
+    """Removes the files of an image object without a row, its original as stored
+    under obj.file.name, and its pyramid and derivatives named by its uuid."""
+
+    files = [(obj.iiif_file.storage, get_iiif_path(obj, f"{obj.uuid}.tif"))]
+    files += [(DerivativeFileStorage(), get_derivative_path(obj, size, get_derivative_format(obj))) for size in {*settings.DERIVATIVE_SIZES, *obj.derivative_sizes}]
+
+    if obj.file:
+        files.append((obj.file.storage, obj.file.name))
+
+    for storage, name in files:
+        if storage.exists(name):
+            storage.delete(name)
@@ -0,0 +1,61 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from rest_framework.test import APIRequestFactory
+from rest_framework.request import Request
+
+from saintsophia.abstract.filters import FuzzySearchFilter
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Compares the query latency of icontains search and fuzzy trigram search over fields of a model."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help="The model to search, e.g. 'inscriptions.inscription'.")
+        parser.add_argument('terms', nargs='+', help="The search terms, each one benchmarked separately.")
+        parser.add_argument('--fields', nargs='+', default=['transcription', 'interpretative_edition', 'romanisation'], help="The fields to search.")
+        parser.add_argument('--similarity', type=float, help="Minimal similarity of the fuzzy matches.")
+        parser.add_argument('--limit', type=int, default=25, help="Number of results per query, like a page.")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs, the best one is reported.")
+        parser.add_argument('--explain', action='store_true', help="Print the query plans of the fuzzy searches.")
+
+    def handle(self, *args, **options):
+        model = apps.get_model(options['model'])
+        queryset = model.objects.all()
+        self.stdout.write(f"{queryset.count()} rows in {model._meta.label}")
+
+        # A view opting into the filter, as the API would
+        view = type('View', (), {'fuzzy_search_fields': options['fields']})()
+        backend = FuzzySearchFilter()
+        factory = APIRequestFactory()
+
+        for term in options['terms']:
+            params = {'fuzzy': term}
+            if options['similarity'] is not None:
+                params['similarity'] = options['similarity']
+
+            request = Request(factory.get('/', params))
+
+            def icontains():
+                condition = Q()
+                for field in options['fields']:
+                    condition |= Q(**{f"{field}__icontains": term})
+                return list(queryset.filter(condition).order_by('pk')[:options['limit']])
+
+            def fuzzy():
+                return list(backend.filter_queryset(request, queryset, view)[:options['limit']])
+
+            for name, run in (('icontains', icontains), ('fuzzy', fuzzy)):
+                timings = []
+
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    results = run()
+                    timings.append(time.perf_counter() - start)
+
+                self.stdout.write(f"{term!r:<24} {name:<10} {min(timings) * 1000:8.1f} ms {len(results):>5} results")
+
+            if options['explain']:
+                self.stdout.write(backend.filter_queryset(request, queryset, view)[:options['limit']].explain(analyze=True))
@@ -0,0 +1,51 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+from rest_framework_xml.renderers import XMLRenderer
+
+from saintsophia.abstract.renderers import ORJSONRenderer, MessagePackRenderer, msgpack, orjson
+from saintsophia.utils import get_serializer
+
+import gzip
+import time
+
+
+class Command(BaseCommand):
+    help = "Compares rendering time and payload size of the API response formats on a page of a model."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help="The model to serialize, e.g. 'inscriptions.inscription'.")
+        parser.add_argument('--serializer', help="Dotted path of the serializer class. Defaults to the one generated by get_serializer.")
+        parser.add_argument('--rows', type=int, default=2000, help="Number of rows per page.")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs, the best one is reported.")
+
+    def handle(self, *args, **options):
+        model = apps.get_model(options['model'])
+        serializer_class = import_string(options['serializer']) if options['serializer'] else get_serializer(model)
+
+        queryset = model.objects.order_by('pk')[:options['rows']]
+
+        start = time.perf_counter()
+        data = serializer_class(queryset, many=True).data
+        self.stdout.write(f"serialization of {len(data)} rows: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        renderers = [('json (drf)', JSONRenderer()), ('xml', XMLRenderer())]
+        if orjson is not None:
+            renderers.append(('json (orjson)', ORJSONRenderer()))
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+
+        for name, renderer in renderers:
+            timings = []
+
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                content = renderer.render(data, renderer.media_type, {})
+                timings.append(time.perf_counter() - start)
+
+            # The XML renderer returns text
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+
+            self.stdout.write(f"{name:<14} {min(timings) * 1000:8.1f} ms {len(content):>10} bytes {len(gzip.compress(content)):>10} bytes gzipped")
@@ -0,0 +1,51 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+from saintsophia.abstract.compiled import compile_serializer
+from saintsophia.utils import get_serializer
+
+import time
+
+
+class Command(BaseCommand):
+    help = "Compares the rows per second of DRF serialization and compiled serialization for a model."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help="The model to serialize, e.g. 'inscriptions.inscription'.")
+        parser.add_argument('--serializer', help="Dotted path of the serializer class. Defaults to the one generated by get_serializer.")
+        parser.add_argument('--rows', type=int, default=2000, help="Number of rows per page.")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs, the best one is reported.")
+
+    def handle(self, *args, **options):
+        model = apps.get_model(options['model'])
+        serializer_class = import_string(options['serializer']) if options['serializer'] else get_serializer(model)
+
+        plan = compile_serializer(serializer_class)
+        if plan is None:
+            raise CommandError(f"{serializer_class.__name__} cannot be compiled, it has nested, computed or custom fields.")
+
+        queryset = model.objects.order_by('pk')[:options['rows']]
+        renderer = JSONRenderer()
+
+        def drf():
+            return renderer.render(serializer_class(queryset.all(), many=True).data)
+
+        def fast():
+            return renderer.render(plan.represent(plan.values(queryset.all()), {}, queryset.db))
+
+        if drf() != fast():
+            raise CommandError("The compiled output differs from the serializer output.")
+
+        for name, run in (('drf', drf), ('compiled', fast)):
+            timings = []
+
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                content = run()
+                timings.append(time.perf_counter() - start)
+
+            rows = queryset.count()
+            best = min(timings)
+            self.stdout.write(f"{name:<10} {rows} rows in {best * 1000:.1f} ms: {rows / best:.0f} rows/s, {len(content)} bytes")
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from saintsophia.abstract.models import TIFF_PROFILES, open_vips_image
+
+import os
+import random
+import statistics
+import tempfile
+import time
+import pyvips
+
+
+class Command(BaseCommand):
+    help = "Measures encode time, output size and random tile decode latency of the pyramid encoding profiles on sample images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', help="Sample images to encode.")
+        parser.add_argument('--profiles', nargs='+', default=list(TIFF_PROFILES), help="Profiles to compare. Defaults to all.")
+        parser.add_argument('--samples', type=int, default=200, help="Number of random tiles decoded per pyramid.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the random tile positions.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['profiles']) - set(TIFF_PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profile(s): {', '.join(sorted(unknown))}")
+
+        rows = []
+
+        with tempfile.TemporaryDirectory() as directory:
+            for path in options['images']:
+                for profile in options['profiles']:
+                    out_path = os.path.join(directory, f"{profile}.tif")
+
+                    start = time.perf_counter()
+                    open_vips_image(path).tiffsave(out_path, **TIFF_PROFILES[profile])
+                    encode_time = time.perf_counter() - start
+
+                    latencies = self.decode_tiles(out_path, TIFF_PROFILES[profile]['tile_width'], options['samples'], random.Random(options['seed']))
+
+                    rows.append((
+                        os.path.basename(path),
+                        profile,
+                        f"{encode_time:.2f}",
+                        f"{os.path.getsize(out_path) / 1e6:.1f}",
+                        f"{statistics.median(latencies):.2f}",
+                        f"{self.percentile(latencies, 95):.2f}",
+                    ))
+
+                    os.remove(out_path)
+
+        self.print_table(('image', 'profile', 'encode s', 'size MB', 'tile p50 ms', 'tile p95 ms'), rows)
+
+    def decode_tiles(self, path, tile_size, samples, rng):
+        """Decodes tiles at random positions and pyramid levels, the way a IIIF server would. Every tile is read from
+        a freshly opened level with the libvips operation cache disabled, so that no sample reuses decoded pixels."""
+
+        pages = pyvips.Image.new_from_file(path).get('n-pages')
+        levels = [pyvips.Image.new_from_file(path, page=page) for page in range(pages)]
+        sizes = [(page, level.width, level.height) for page, level in enumerate(levels)]
+
+        cache_max = pyvips.cache_get_max()
+        pyvips.cache_set_max(0)
+
+        latencies = []
+        try:
+            for _ in range(samples):
+                page, level_width, level_height = rng.choice(sizes)
+                x = rng.randrange(0, max(1, level_width - tile_size + 1), tile_size) if level_width > tile_size else 0
+                y = rng.randrange(0, max(1, level_height - tile_size + 1), tile_size) if level_height > tile_size else 0
+                width, height = min(tile_size, level_width - x), min(tile_size, level_height - y)
+
+                level = pyvips.Image.new_from_file(path, page=page, access='random')
+
+                start = time.perf_counter()
+                level.crop(x, y, width, height).write_to_memory()
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            pyvips.cache_set_max(cache_max)
+
+        return latencies
+
+    def percentile(self, values, percent):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def print_table(self, header, rows):
+        widths = [max(len(str(row[i])) for row in (header, *rows)) for i in range(len(header))]
+
+        for row in (header, *rows):
+            self.stdout.write("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
@@ -0,0 +1,90 @@
+from django.apps import apps
+from django.contrib.gis.db.models import GeometryField
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from saintsophia.abstract.views import GeoViewSet
+
+from typing import *
+
+
+def get_geo_view_models(patterns) -> Set[Type]:
+    """The models of the GeoViewSet views among URL patterns, including the included ones."""
+
+    models = set()
+
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            models |= get_geo_view_models(pattern.url_patterns)
+
+        elif isinstance(pattern, URLPattern):
+            cls = getattr(pattern.callback, 'cls', None)
+            if cls is None or not issubclass(cls, GeoViewSet):
+                continue
+
+            # Views generated with as_view(queryset=...) carry it in their initkwargs
+            queryset = getattr(pattern.callback, 'initkwargs', {}).get('queryset', cls.queryset)
+            if queryset is not None:
+                models.add(queryset.model)
+
+    return models
+
+
+class Command(BaseCommand):
+    help = "Checks that the geometry fields of the GeoViewSet models have a GiST index, and optionally creates the missing ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Check the geometry fields of all models, not only those served by a GeoViewSet.")
+        parser.add_argument('--create', action='store_true', help="Create the missing indexes, concurrently.")
+
+    def has_gist_index(self, connection, table: str, column: str) -> bool:
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+
+        return any(
+            constraint['index'] and constraint['type'] == 'gist' and constraint['columns'] == [column]
+            for constraint in constraints.values()
+        )
+
+    def handle(self, *args, **options):
+        models = apps.get_models() if options['all'] else get_geo_view_models(get_resolver().url_patterns)
+        missing = 0
+
+        for model in sorted(models, key=lambda model: model._meta.label):
+            # Proxies share the table of their concrete model
+            if model._meta.proxy:
+                continue
+
+            connection = connections[router.db_for_write(model)]
+            if connection.vendor != 'postgresql':
+                continue
+
+            table = model._meta.db_table
+
+            for field in model._meta.concrete_fields:
+                if not isinstance(field, GeometryField):
+                    continue
+
+                if self.has_gist_index(connection, table, field.column):
+                    self.stdout.write(f"{model._meta.label}.{field.name}: GiST index found")
+                    continue
+
+                missing += 1
+                self.stdout.write(self.style.WARNING(f"{model._meta.label}.{field.name}: no GiST index"))
+
+                if options['create']:
+                    name = f"{table}_{field.column}_gist"[-63:]
+
+                    # Concurrently, so that the table stays writable on large tables
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {connection.ops.quote_name(name)} "
+                            f"ON {connection.ops.quote_name(table)} USING gist ({connection.ops.quote_name(field.column)})"
+                        )
+                        cursor.execute(f"ANALYZE {connection.ops.quote_name(table)}")
+
+                    self.stdout.write(self.style.SUCCESS(f"{model._meta.label}.{field.name}: created {name}"))
+
+        if missing and not options['create']:
+            raise CommandError(f"{missing} geometry fields without GiST index, run with --create to create them.")
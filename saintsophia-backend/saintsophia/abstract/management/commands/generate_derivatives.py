@@ -0,0 +1,59 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from saintsophia.abstract.models import AbstractImageModel, get_derivative_format, get_derivative_path, save_derivatives
+from saintsophia.storages import DerivativeFileStorage
+
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import os
+
+
+class Command(BaseCommand):
+    help = "Generates the static derivatives (thumbnails and previews) of existing images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='+', help="The image models to backfill, e.g. 'inscriptions.image'.")
+        parser.add_argument('--sizes', nargs='+', type=int, default=settings.DERIVATIVE_SIZES, help="The sizes to generate. Defaults to DERIVATIVE_SIZES.")
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives which already exist.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of threads. Defaults to the number of cores.")
+
+    def handle(self, *args, **options):
+        storage = DerivativeFileStorage()
+
+        for label in options['models']:
+            model = apps.get_model(label)
+            if not issubclass(model, AbstractImageModel):
+                raise CommandError(f"{label} is not an AbstractImageModel.")
+
+            def backfill(obj):
+                # Sizes recorded in a previous format are replaced by those of the current one
+                previous = obj.derivative_sizes if get_derivative_format(obj) == settings.DERIVATIVE_FORMAT else []
+
+                existing = [] if options['force'] else [size for size in options['sizes'] if storage.exists(get_derivative_path(obj, size))]
+                sizes = [size for size in options['sizes'] if size not in existing]
+
+                if sizes:
+                    save_derivatives(obj, sizes)
+
+                # Also records the derivatives generated before their sizes were stored
+                recorded = sorted({*(previous or []), *existing, *sizes})
+                if recorded != obj.derivative_sizes or obj.derivative_format != settings.DERIVATIVE_FORMAT:
+                    obj.derivative_sizes = recorded
+                    obj.derivative_format = settings.DERIVATIVE_FORMAT
+                    obj.save(update_fields=['derivative_sizes', 'derivative_format'])
+
+                return len(sizes)
+
+            workers = max(1, options['workers'])
+            objects = model.objects.all().iterator(chunk_size=500)
+            generated = 0
+
+            # libvips releases the GIL, so threads are enough to use all cores
+            # Submitted a batch at a time, pool.map would read the whole table up front
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                while batch := list(itertools.islice(objects, workers * 4)):
+                    generated += sum(pool.map(backfill, batch))
+
+            self.stdout.write(self.style.SUCCESS(f"{label}: generated {generated} derivative(s)"))
@@ -0,0 +1,218 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import *
+import json
+import multiprocessing
+import os
+import time
+import uuid
+
+DEFAULT_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp']
+
+
+def init_worker():
+    # Spawned workers start from a clean interpreter and set up Django themselves
+    import django
+    django.setup()
+
+
+def append_checkpoint(checkpoint: str, entries: List[Dict[str, Any]]) -> None:
+    # Single line appends, written by the command and its workers alike
+    with open(checkpoint, 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def run_ingest(source: str, model_label: str, uuid: str, checkpoint: str):
+    from saintsophia.abstract.jobs import ingest_image
+
+    # Recorded as soon as the original is stored, so that an interrupted ingest removes exactly that file
+    def copied(name):
+        append_checkpoint(checkpoint, [{'source': source, 'uuid': uuid, 'state': 'copied', 'file': name}])
+
+    return ingest_image(source, model_label, uuid, copied)
+
+
+class Command(BaseCommand):
+    help = "Ingests a directory tree of images into an AbstractTIFFImageModel, generating the pyramids in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="The directory to scan recursively for images.")
+        parser.add_argument('--model', required=True, help="The model to ingest into, e.g. 'inscriptions.image'.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes. Defaults to the number of cores.")
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of rows written per bulk_create.")
+        parser.add_argument('--checkpoint', help="File recording the ingested images. Defaults to .ingest_checkpoint.jsonl in the directory.")
+        parser.add_argument('--extensions', nargs='+', default=DEFAULT_EXTENSIONS, help="File extensions to ingest.")
+        parser.add_argument('--set', nargs='+', default=[], metavar='FIELD=VALUE', help="Values for other fields of every row, e.g. panel_id=12.")
+
+    def handle(self, *args, **options):
+        from saintsophia.abstract import caching
+        from saintsophia.abstract.models import AbstractTIFFImageModel
+
+        model = apps.get_model(options['model'])
+        if not issubclass(model, AbstractTIFFImageModel):
+            raise CommandError(f"{options['model']} is not an AbstractTIFFImageModel.")
+
+        model_label = model._meta.label_lower
+        defaults = dict(value.split('=', 1) for value in options['set'])
+
+        directory = os.path.abspath(options['directory'])
+        checkpoint = options['checkpoint'] or os.path.join(directory, '.ingest_checkpoint.jsonl')
+
+        done, interrupted = self.read_checkpoint(checkpoint)
+        if interrupted:
+            done |= self.resolve_interrupted(model, interrupted, checkpoint)
+
+        sources = [source for source in self.scan(directory, options['extensions']) if source not in done]
+
+        self.stdout.write(f"Found {len(sources)} image(s) to ingest, {len(done)} already ingested")
+
+        # Never share the connections of this process with the workers
+        connections.close_all()
+
+        workers = max(1, options['workers'])
+        context = multiprocessing.get_context('spawn')
+
+        pending = iter(sources)
+        running = {}
+        batch = []
+
+        images, size = 0, 0
+        start = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+            while True:
+
+                # Keep a bounded number of conversions in flight
+                while len(running) < workers * 2:
+                    source = next(pending, None)
+                    if source is None:
+                        break
+
+                    # Recorded before any file is copied, so that the files of an interrupted ingest can be found
+                    image_uuid = str(uuid.uuid4())
+                    self.write_checkpoint(checkpoint, [(source, image_uuid, 'started')])
+
+                    running[pool.submit(run_ingest, source, model_label, image_uuid, checkpoint)] = (source, image_uuid)
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    source, image_uuid = running.pop(future)
+
+                    try:
+                        values = future.result()
+                    except Exception as e:
+                        self.stderr.write(f"Failed to ingest {source}: {e}")
+
+                        # Failing workers remove their own files, those which died left them behind
+                        _, interrupted = self.read_checkpoint(checkpoint)
+                        self.remove_files(model, image_uuid, interrupted.get(image_uuid, {}).get('file'))
+                        self.write_checkpoint(checkpoint, [(source, image_uuid, 'removed')])
+                        continue
+
+                    batch.append((source, values))
+
+                if len(batch) >= options['batch_size'] or (not running and batch):
+                    images += len(batch)
+                    size += sum(values['file_size'] for _, values in batch)
+
+                    self.write_batch(model, batch, defaults, checkpoint)
+                    batch = []
+
+                    # bulk_create sends no post_save, invalidate the cached counts and responses of the model here
+                    caching.bump_model_version(model)
+
+                    self.report(images, size, time.monotonic() - start)
+
+        self.stdout.write(self.style.SUCCESS(f"Ingested {images} image(s)"))
+
+    def scan(self, directory, extensions):
+        extensions = {extension.lower() for extension in extensions}
+
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in extensions:
+                    yield os.path.join(root, name)
+
+    def read_checkpoint(self, checkpoint):
+        """The ingested sources, and the ingests which were started but never finished by uuid,
+        with their source and the name their original was stored under, if it was."""
+
+        if not os.path.exists(checkpoint):
+            return set(), {}
+
+        with open(checkpoint, 'r', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+        done = set()
+        ingests = {}
+
+        for entry in entries:
+            # Entries without a state were written by earlier versions, once ingested
+            state = entry.get('state', 'done')
+            if state == 'done':
+                done.add(entry['source'])
+
+            ingest = ingests.setdefault(entry['uuid'], {'source': entry['source'], 'file': None, 'finished': False})
+            if state == 'copied':
+                ingest['file'] = entry['file']
+            elif state in ('done', 'removed'):
+                ingest['finished'] = True
+
+        interrupted = {image_uuid: ingest for image_uuid, ingest in ingests.items() if not ingest['finished']}
+
+        return done, interrupted
+
+    def write_checkpoint(self, checkpoint, entries):
+        append_checkpoint(checkpoint, [{'source': source, 'uuid': image_uuid, 'state': state} for source, image_uuid, state in entries])
+
+    def resolve_interrupted(self, model, interrupted, checkpoint):
+        """Records the interrupted ingests whose rows were written as done, and removes the files of the others.
+
+        Returns:
+            Set[str]: The sources whose rows were written
+        """
+
+        written = {str(value) for value in model.objects.filter(uuid__in=list(interrupted)).values_list('uuid', flat=True)}
+        entries = []
+
+        for image_uuid, ingest in interrupted.items():
+            if image_uuid in written:
+                entries.append((ingest['source'], image_uuid, 'done'))
+            else:
+                self.remove_files(model, image_uuid, ingest['file'])
+                entries.append((ingest['source'], image_uuid, 'removed'))
+
+        self.write_checkpoint(checkpoint, entries)
+        self.stdout.write(f"Resolved {len(interrupted)} interrupted ingest(s), {len(interrupted) - len(written)} without a row removed")
+
+        return {source for source, _, state in entries if state == 'done'}
+
+    def remove_files(self, model, image_uuid, file_name):
+        """Removes the files an ingest without a row may have left, the original under the name
+        recorded by its worker, if any, and the pyramid and derivatives named by its uuid."""
+
+        from saintsophia.abstract.jobs import remove_image_files
+
+        obj = model(uuid=image_uuid)
+        if file_name:
+            obj.file.name = file_name
+
+        remove_image_files(obj)
+
+    def write_batch(self, model, batch, defaults, checkpoint):
+        model.objects.bulk_create([model(**defaults, **values) for _, values in batch])
+
+        # Only record images once their rows exist
+        self.write_checkpoint(checkpoint, [(source, str(values['uuid']), 'done') for source, values in batch])
+
+    def report(self, images, size, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        self.stdout.write(f"{images} image(s), {size / 1e6:.1f} MB in {elapsed:.1f} s: {images / elapsed:.2f} images/s, {size / 1e6 / elapsed:.2f} MB/s")
@@ -0,0 +1,129 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import time
+
+# Seconds between two checks for stale jobs, e.g. of killed worker commands
+STALE_CHECK_INTERVAL = 60.0
+
+# Seconds between two heartbeats of the running jobs, well below the stale timeout
+HEARTBEAT_INTERVAL = 30.0
+
+
+def init_worker():
+    # Spawned workers start from a clean interpreter and set up Django themselves
+    import django
+    django.setup()
+
+
+def run_job(job_id: int, max_attempts: int) -> str:
+    from saintsophia.abstract.jobs import run_tiling_job
+    return run_tiling_job(job_id, max_attempts)
+
+
+class Command(BaseCommand):
+    help = "Generates the pyramid TIFFs queued by AbstractTIFFImageModel.save in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes. Defaults to the number of cores.")
+        parser.add_argument('--poll-interval', type=float, default=5.0, help="Seconds to wait before polling an empty queue again.")
+        parser.add_argument('--max-attempts', type=int, default=3, help="Attempts before a job is marked as failed.")
+        parser.add_argument('--stale-timeout', type=float, default=300.0, help="Seconds without heartbeat after which a running job is considered lost and requeued.")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty instead of polling.")
+
+    def handle(self, *args, **options):
+        from saintsophia.abstract.jobs import beat_tiling_jobs, claim_tiling_jobs, fail_crashed_job
+
+        workers = max(1, options['workers'])
+
+        self.requeue_stale(options['stale_timeout'])
+        last_stale_check = last_heartbeat = time.monotonic()
+
+        # Never share the connections of this process with the workers
+        connections.close_all()
+
+        context = multiprocessing.get_context('spawn')
+        pool = self.create_pool(workers, context)
+        running = {}
+
+        try:
+            while True:
+
+                if running and time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    beat_tiling_jobs(running.values())
+                    last_heartbeat = time.monotonic()
+
+                if time.monotonic() - last_stale_check >= STALE_CHECK_INTERVAL:
+                    self.requeue_stale(options['stale_timeout'], running.values())
+                    last_stale_check = time.monotonic()
+
+                broken = False
+
+                # Keep every worker busy
+                free = workers - len(running)
+                if free > 0:
+                    for job_id in claim_tiling_jobs(free):
+                        try:
+                            running[pool.submit(run_job, job_id, options['max_attempts'])] = job_id
+                        except BrokenProcessPool as e:
+                            broken = True
+                            self.stdout.write(f"Job {job_id}: {fail_crashed_job(job_id, f'Worker pool broken: {e}', options['max_attempts'])}")
+
+                if not running and not broken:
+                    if options['once']:
+                        break
+
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                broken = self.collect(done, running, options['max_attempts']) or broken
+
+                # A dead worker process fails every job of the pool, and no job can be submitted to it anymore
+                if broken:
+                    done, _ = wait(running)
+                    self.collect(done, running, options['max_attempts'])
+
+                    self.stderr.write("Worker pool broken, starting a new one")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self.create_pool(workers, context)
+
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def collect(self, done, running, max_attempts) -> bool:
+        """Reports the finished jobs, recording those of crashed workers as failed attempts.
+        Returns whether the pool is broken."""
+
+        from saintsophia.abstract.jobs import fail_crashed_job
+
+        broken = False
+
+        for future in done:
+            job_id = running.pop(future)
+
+            try:
+                status = future.result()
+            except BrokenProcessPool as e:
+                broken = True
+                status = fail_crashed_job(job_id, f"Worker process died: {e}", max_attempts)
+            except Exception as e:
+                status = fail_crashed_job(job_id, f"Worker failed: {e}", max_attempts)
+
+            self.stdout.write(f"Job {job_id}: {status}")
+
+        return broken
+
+    def create_pool(self, workers, context):
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker)
+
+    def requeue_stale(self, timeout, running=()):
+        from saintsophia.abstract.jobs import requeue_stale_jobs
+
+        requeued = requeue_stale_jobs(timeout, exclude=running)
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from saintsophia import routers
+
+from contextlib import ExitStack
+import time
+
+
+class QueryCountMiddleware:
+    """
+    Reports the number of database queries of a request, and the time spent in them,
+    in the X-Query-Count and X-Query-Time headers. Enabled by QUERY_COUNT_HEADER.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_COUNT_HEADER:
+            return self.get_response(request)
+
+        count = 0
+        duration = 0.0
+
+        def counter(execute, sql, params, many, context):
+            nonlocal count, duration
+
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                count += 1
+                duration += time.perf_counter() - start
+
+        # Count the queries on every database, the apps have their own
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(count)
+        response['X-Query-Time'] = f"{duration * 1000:.1f}ms"
+
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Scopes the read replica selection of the AppRouter to a request. The apps a request wrote to are
+    remembered in a cookie for REPLICA_MAX_LAG seconds, so that the following requests of the client,
+    e.g. after a redirect in the admin, read its writes from the primary.
+    """
+
+    cookie_name = 'replica_pinned'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        pinned = [app_label for app_label in request.COOKIES.get(self.cookie_name, '').split(',') if app_label]
+
+        token = routers.start_request(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            written = routers.end_request(token)
+
+        if written:
+            response.set_cookie(self.cookie_name, ','.join(sorted(written)), max_age=settings.REPLICA_MAX_LAG, httponly=True, samesite='Lax')
+
+        return response
+
+
+class FuzzySearchResetMiddleware:
+    """
+    Resets the pg_trgm.word_similarity_threshold set by the FuzzySearchFilter on the connections of a request,
+    before they are reused by other requests, e.g. through the connection pool.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            for alias in getattr(request, 'trigram_threshold_aliases', ()):
+                try:
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute("RESET pg_trgm.word_similarity_threshold")
+                except DatabaseError:
+                    # A broken connection is discarded rather than reused
+                    pass
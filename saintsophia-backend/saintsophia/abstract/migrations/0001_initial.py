@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='TilingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_label', models.CharField(max_length=100, verbose_name='abstract.app_label')),
+                ('model_name', models.CharField(max_length=100, verbose_name='abstract.model_name')),
+                ('object_id', models.BigIntegerField(verbose_name='abstract.object_id')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='abstract.status')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='abstract.progress')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='abstract.attempts')),
+                ('worker', models.CharField(blank=True, max_length=256, verbose_name='abstract.worker')),
+                ('error', models.TextField(blank=True, verbose_name='abstract.error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='abstract.created_at')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='abstract.started_at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='abstract.finished_at')),
+                ('duration', models.FloatField(blank=True, null=True, verbose_name='abstract.duration')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='tilingjob_status_idx')],
+            },
+        ),
+    ]
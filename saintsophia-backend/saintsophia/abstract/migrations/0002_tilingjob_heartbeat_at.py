@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abstract', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tilingjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='abstract.heartbeat_at'),
+        ),
+    ]
@@ -1,28 +1,45 @@
 from django.db import models
+from django.conf import settings
+from django.apps import apps
 
-from django.core.files import File
 from django.utils.translation import gettext_lazy as _
 from django.contrib.postgres.search import SearchVectorField
 from django.contrib.postgres.indexes import GinIndex 
-from saintsophia.storages import OriginalFileStorage, IIIFFileStorage
+from saintsophia.storages import OriginalFileStorage, IIIFFileStorage, DerivativeFileStorage
 
 from PIL import Image
 from typing import *
 import uuid
+import hashlib
+import json
 import os
 import pyvips
 
 Image.MAX_IMAGE_PIXELS = None
 
-TIFF_KWARGS = {
-    "tile": True, 
-    "pyramid": True, 
-    "compression": 'jpeg', 
-    "Q": 75, 
-    "tile_width": 256, 
-    "tile_height": 256
+def get_tiff_profile(compression: str, tile_size: int, **kwargs) -> Dict[str, Any]:
+    return {
+        "tile": True, 
+        "pyramid": True, 
+        "compression": compression, 
+        "tile_width": tile_size, 
+        "tile_height": tile_size,
+        **kwargs,
+    }
+
+# Named encoding profiles for the pyramid TIFFs, selectable per model or per upload
+TIFF_PROFILES = {
+    **{f"jpeg-{size}": get_tiff_profile('jpeg', size, Q=75) for size in (256, 512, 1024)},
+    **{f"webp-{size}": get_tiff_profile('webp', size, Q=75) for size in (256, 512, 1024)},
+    **{f"deflate-{size}": get_tiff_profile('deflate', size, predictor='horizontal') for size in (256, 512, 1024)},
+    **{f"lossless-{size}": get_tiff_profile('webp', size, lossless=True) for size in (256, 512, 1024)},
 }
 
+TIFF_PROFILE_CHOICES = [(name, name) for name in TIFF_PROFILES]
+
+# The default profile, kept under its old name
+TIFF_KWARGS = TIFF_PROFILES[settings.DEFAULT_TIFF_PROFILE]
+
 DEFAULT_FIELDS  = ['created_at', 'updated_at', 'published']
 DEFAULT_EXCLUDE = ['created_at', 'updated_at', 'published', 'polymorphic_ctype']
 
@@ -58,51 +75,379 @@ def get_original_path(instance: models.Model, filename):
 
     return get_save_path(instance, filename, "original")
 
+def get_derivative_path(instance: models.Model, size: int, format: str = None):
+
+    # Resulting path is e.g. 'inscriptions/derivatives/<uuid>_400.webp'
+    return get_save_path(instance, f"{instance.uuid}_{size}.{format or settings.DERIVATIVE_FORMAT}", "derivatives")
+
+def get_derivative_format(instance: models.Model) -> str:
+
+    # Derivatives recorded before their format was stored are in the configured one
+    return getattr(instance, 'derivative_format', '') or settings.DERIVATIVE_FORMAT
+
+
+def configure_vips(max_memory: int = settings.PYRAMID_MAX_MEMORY) -> None:
+    """Bounds the memory libvips may hold on to between and during conversions.
+
+    Args:
+        max_memory (int, optional): Memory ceiling in bytes for the libvips operation cache. Defaults to PYRAMID_MAX_MEMORY.
+    """
+
+    # The operation cache is what grows with image size when many
+    # large conversions run one after another in the same worker
+    pyvips.cache_set_max_mem(max_memory)
+    pyvips.cache_set_max(settings.PYRAMID_VIPS_CACHE_MAX)
+
+    if settings.PYRAMID_VIPS_CONCURRENCY:
+        pyvips.concurrency_set(settings.PYRAMID_VIPS_CONCURRENCY)
+
+configure_vips()
+
+
+def get_original_source(obj) -> Union[str, IO]:
+    """Locates the original image of an object without reading it into memory.
+
+    Files already committed to the OriginalFileStorage are referenced by their path on disk,
+    as are large uploads which Django spooled to a temporary file. Only small in-memory uploads
+    are returned as file objects.
+
+    Args:
+        obj (AbstractImageModel): The image object
+
+    Returns:
+        Union[str, IO]: A path or a file-like object of the original image
+    """
+
+    if obj.file._committed:
+        return OriginalFileStorage().path(obj.file.name)
+
+    uploaded = obj.file.file
+    if hasattr(uploaded, 'temporary_file_path'):
+        return uploaded.temporary_file_path()
+
+    return uploaded
+
+
+def open_vips_image(source: Union[str, IO]) -> pyvips.Image:
+    """Opens an image with sequential access, so that pixels are streamed 
+    through the pipeline instead of decoded into memory at once.
+
+    Args:
+        source (Union[str, IO]): A path or a file-like object
+
+    Returns:
+        pyvips.Image: A lazily evaluated image
+    """
+
+    if isinstance(source, str):
+        return pyvips.Image.new_from_file(source, access='sequential')
+
+    source.seek(0)
+    stream = pyvips.SourceCustom()
+    stream.on_read(source.read)
+    stream.on_seek(source.seek)
+
+    return pyvips.Image.new_from_source(stream, "", access='sequential')
+
+
+def open_pillow_image(source: Union[str, IO], max_memory: int = settings.PYRAMID_MAX_MEMORY) -> pyvips.Image:
+    """Fallback for formats libvips cannot read. The image is decoded by Pillow, 
+    which always loads it completely, so it is refused if it would exceed the memory ceiling.
+
+    Args:
+        source (Union[str, IO]): A path or a file-like object
+        max_memory (int, optional): Memory ceiling in bytes. Defaults to PYRAMID_MAX_MEMORY.
+
+    Returns:
+        pyvips.Image: The decoded image
+    """
+
+    if not isinstance(source, str):
+        source.seek(0)
+
+    image_object = Image.open(source)
+    width, height = image_object.size
+
+    # Estimated size of the decoded image, one byte per band
+    decoded_size = width * height * len(image_object.getbands())
+    if decoded_size > max_memory:
+        raise MemoryError(f"Decoding a {width}x{height} image requires {decoded_size} bytes, above the ceiling of {max_memory} bytes.")
+
+    return pyvips.Image.new_from_array(image_object)
+
+
+def open_original_image(obj) -> pyvips.Image:
+    """Opens the original image of an object, streaming with libvips where possible.
+
+    Args:
+        obj (AbstractImageModel): The image object
+
+    Returns:
+        pyvips.Image: The image to be pyramidized
+    """
+
+    source = get_original_source(obj)
+
+    try:
+        return open_vips_image(source)
+    except pyvips.Error:
+        return open_pillow_image(source)
+
+
+def get_file_hash(source: Union[str, IO], chunk_size: int = 1024 * 1024) -> str:
+    """Computes the SHA-256 of a file in chunks, without reading it into memory at once.
+
+    Args:
+        source (Union[str, IO]): A path or a file-like object
+        chunk_size (int, optional): The number of bytes read at a time. Defaults to 1 MB.
+
+    Returns:
+        str: The hexadecimal digest
+    """
+
+    digest = hashlib.sha256()
+
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+        source.seek(0)
+
+    return digest.hexdigest()
+
+
+def get_tiff_kwargs(obj) -> Dict[str, Any]:
+    """Resolves the encoding profile of an object: the profile chosen for the upload, 
+    else the default profile of its model, else DEFAULT_TIFF_PROFILE.
+
+    Args:
+        obj (AbstractTIFFImageModel): The image object
+
+    Returns:
+        Dict[str, Any]: Keyword arguments for pyvips.Image.tiffsave
+    """
+
+    profile = getattr(obj, 'tiff_profile', None) or getattr(obj, 'default_tiff_profile', None) or settings.DEFAULT_TIFF_PROFILE
+
+    return TIFF_PROFILES[profile]
+
+
+def get_pyramid_signature(obj) -> str:
+    """The signature of a pyramid combines the hash of its original with the encoding
+    settings, so that a change to either one calls for a new pyramid.
+
+    Args:
+        obj (AbstractTIFFImageModel): The image object
+
+    Returns:
+        str: The hexadecimal digest
+    """
+
+    encoding = json.dumps(get_tiff_kwargs(obj), sort_keys=True)
+
+    return hashlib.sha256(f"{obj.file_hash}:{encoding}".encode()).hexdigest()
+
+
+def update_file_fingerprint(obj) -> bool:
+    """Updates the hash, size and modification time of the original file of an object.
+    The hash is only recomputed when the size or modification time differ from the stored ones,
+    or when a new file has been uploaded.
+
+    Args:
+        obj (AbstractTIFFImageModel): The image object
+
+    Returns:
+        bool: True if the hash of the original changed
+    """
+
+    if obj.file._committed:
+        stat = os.stat(OriginalFileStorage().path(obj.file.name))
+        size, mtime = stat.st_size, stat.st_mtime
+
+        # Unchanged on disk, trust the stored hash
+        if obj.file_hash and size == obj.file_size and mtime == obj.file_mtime:
+            return False
+    else:
+        size, mtime = obj.file.size, None
+
+    file_hash = get_file_hash(get_original_source(obj))
+    changed = file_hash != obj.file_hash
+
+    obj.file_hash  = file_hash
+    obj.file_size  = size
+    obj.file_mtime = mtime
 
-def save_tiled_pyramid_tif(obj, path=IIIFFileStorage().location):
-    """Uses pyvips to generate a tiled pyramid tiff.
+    return changed
+
+
+def pyramid_is_current(obj) -> bool:
+    """Checks whether the stored pyramid of an object was generated from its current original
+    file with the current encoding settings.
+
+    Args:
+        obj (AbstractTIFFImageModel): The image object
+
+    Returns:
+        bool: True if the pyramid does not have to be regenerated
+    """
+
+    update_file_fingerprint(obj)
+
+    if not obj.iiif_file or not obj.iiif_file.storage.exists(obj.iiif_file.name):
+        return False
+
+    return obj.iiif_signature == get_pyramid_signature(obj)
+
+
+def pyramid_is_unchanged(obj) -> bool:
+    """Checks like pyramid_is_current whether the stored pyramid may be kept, without reading the original.
+    The original must be the stored file, of the size and modification time it was last hashed at.
+
+    Args:
+        obj (AbstractTIFFImageModel): The image object
+
+    Returns:
+        bool: True if the pyramid does not have to be regenerated
+    """
+
+    if not obj.file._committed or not obj.file_hash:
+        return False
+
+    stat = os.stat(OriginalFileStorage().path(obj.file.name))
+    if stat.st_size != obj.file_size or stat.st_mtime != obj.file_mtime:
+        return False
+
+    if not obj.iiif_file or not obj.iiif_file.storage.exists(obj.iiif_file.name):
+        return False
+
+    return obj.iiif_signature == get_pyramid_signature(obj)
+
+
+def get_derivative_source(obj) -> str:
+    """Derivatives are preferably generated from the pyramid, where libvips 
+    can read a small level instead of decoding the full original."""
+
+    iiif_file = getattr(obj, 'iiif_file', None)
+    if iiif_file and iiif_file.storage.exists(iiif_file.name):
+        return iiif_file.path
+
+    return get_original_source(obj)
+
+
+def save_derivatives(obj, sizes: List[int] = None) -> Dict[int, str]:
+    """Generates static downscaled copies of an image, e.g. thumbnails, sized by their longest edge.
+    Images are never upscaled. The sizes and format are recorded in the derivative_sizes and derivative_format
+    of the object, which the caller saves. Sizes recorded in another format are replaced.
+
+    Args:
+        obj (AbstractImageModel): The image object
+        sizes (List[int], optional): The sizes to generate. Defaults to DERIVATIVE_SIZES.
+
+    Returns:
+        Dict[int, str]: The names of the derivatives in the DerivativeFileStorage, by size
+    """
+
+    storage = DerivativeFileStorage()
+    source = get_derivative_source(obj)
+    names = {}
+
+    recorded = obj.derivative_sizes if get_derivative_format(obj) == settings.DERIVATIVE_FORMAT else []
+
+    for size in sizes or settings.DERIVATIVE_SIZES:
+        if isinstance(source, str):
+            image = pyvips.Image.thumbnail(source, size, height=size, size='down')
+        else:
+            source.seek(0)
+            image = pyvips.Image.thumbnail_buffer(source.read(), size, height=size, size='down')
+
+        if image.hasalpha() and settings.DERIVATIVE_FORMAT == 'jpg':
+            image = image.flatten(background=255)
+
+        name = get_derivative_path(obj, size)
+        tmp_path = storage.get_temporary_path(name)
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(image.write_to_buffer(f".{settings.DERIVATIVE_FORMAT}", Q=settings.DERIVATIVE_QUALITY))
+
+            storage.save_from_path(name, tmp_path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+        names[size] = name
+
+    obj.derivative_sizes = sorted({*(recorded or []), *names})
+    obj.derivative_format = settings.DERIVATIVE_FORMAT
+
+    return names
+
+
+def get_derivative_urls(obj) -> Dict[int, str]:
+    """The URLs of the existing derivatives of an image, by size, as recorded by save_derivatives.
+    Read for every object of list views, hence without touching the storage."""
+
+    storage = DerivativeFileStorage()
+    generated = set(getattr(obj, 'derivative_sizes', None) or [])
+    format = get_derivative_format(obj)
+
+    return {size: storage.url(get_derivative_path(obj, size, format)) for size in settings.DERIVATIVE_SIZES if size in generated}
+
+
+def save_tiled_pyramid_tif(obj, progress: Callable[[int], None] = None) -> str:
+    """Uses pyvips to generate a tiled pyramid tiff. The pyramid is written once, to a temporary file 
+    in the IIIF storage, and then renamed into place, replacing any previous pyramid atomically.
 
         Args:
-            path (str, optional): The path to save the images. Defaults to IIIF_PATH.
+            progress (Callable[[int], None], optional): Called with the percentage done while the pyramid is written. Defaults to None.
+
+        Returns:
+            str: The name of the pyramid in the IIIF storage
         """
 
-    # Create directory if it does not exist
-    save_path = os.path.join(path, get_iiif_path(obj, ""))
-    if not os.path.exists(save_path):
-        os.makedirs(save_path) 
+    storage = obj.iiif_file.storage
 
     # The images are saved with their uuid as the key
-    filename = str(obj.uuid) + ".tif"
-    out_path = os.path.join(path, get_iiif_path(obj, filename))
+    name = get_iiif_path(obj, str(obj.uuid) + ".tif")
+
+    # Stream the original straight into the pyramid, 
+    # peak memory no longer grows with the image size
+    image = open_original_image(obj)
+
+    if progress:
+        image.set_progress(True)
+        image.signal_connect('eval', lambda image, status: progress(status.percent))
 
-    tmp_name = get_iiif_path(obj, f"{str(obj.uuid)}_tmp.tif")
-    tmp_path = os.path.join(path, tmp_name)
+    # Classic TIFF cannot address files above 4 GB
+    kwargs = get_tiff_kwargs(obj)
+    if image.width * image.height * image.bands > settings.TIFF_BIGTIFF_THRESHOLD:
+        kwargs = {**kwargs, "bigtiff": True}
 
+    tmp_path = storage.get_temporary_path(name)
 
-    # When updating the file, remove the iiif_file
-    if os.path.isfile(out_path):
-        os.remove(out_path)
+    try:
+        image.tiffsave(tmp_path, **kwargs)
+        storage.save_from_path(name, tmp_path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+    # Remove a previous pyramid stored under another name
+    if obj.iiif_file and obj.iiif_file.name != name:
         obj.iiif_file.delete(False) # Do not yet save the image deletion
 
-    obj_path =os.path.join(path, get_original_path(obj, obj.file.name))
-    # Get the original image as a Pillow object before saving
-    image_object = Image.open(obj.file.open())
-    image = pyvips.Image.new_from_array(image_object)
- 
-    # image = pyvips.Image.new_from_file(obj_path, access='sequential')
-    # Create temporary file
-    image.tiffsave(tmp_path, **TIFF_KWARGS)
+    obj.iiif_file = name
+    obj.iiif_signature = get_pyramid_signature(obj)
 
-    # Prepare saving the new IIIF file
-    with open(tmp_path, 'rb') as f:
-        tiff_image = File(f) 
-        obj.iiif_file.save(filename, tiff_image, save=False)
-        
-    # Remove the temporary path
-    if os.path.isfile(tmp_path):
-        os.remove(tmp_path)
+    # Small static copies for list views, read from the new pyramid
+    if settings.DERIVATIVE_SIZES:
+        save_derivatives(obj)
 
-    return path
+    return name
 
 
 #####################################################
@@ -159,6 +504,10 @@ class AbstractImageModel(AbstractBaseModel):
     # The name of a supplied field is available in file.name
     file = models.ImageField(storage=OriginalFileStorage, upload_to=get_original_path, verbose_name=_("general.file"))
 
+    # Sizes of the generated static derivatives, see save_derivatives
+    derivative_sizes  = models.JSONField(default=list, blank=True, editable=False, verbose_name=_("abstract.derivative_sizes"))
+    derivative_format = models.CharField(max_length=8, blank=True, default="", editable=False, verbose_name=_("abstract.derivative_format"))
+
     class Meta:
         abstract = True
 
@@ -178,12 +527,54 @@ class AbstractTIFFImageModel(AbstractImageModel):
     # The path to the IIIF file
     iiif_file = models.ImageField(storage=IIIFFileStorage, upload_to=get_iiif_path, blank=True, null=True, verbose_name=_("abstract.iiif_file"))
 
-    def save(self, **kwargs) -> None:
+    # Fingerprint of the original file, used to skip regenerating an unchanged pyramid
+    file_hash  = models.CharField(max_length=64, blank=True, default="", editable=False, verbose_name=_("abstract.file_hash"))
+    file_size  = models.BigIntegerField(blank=True, null=True, editable=False, verbose_name=_("abstract.file_size"))
+    file_mtime = models.FloatField(blank=True, null=True, editable=False, verbose_name=_("abstract.file_mtime"))
+
+    # Encoding profile of this upload, overriding the default_tiff_profile of the model
+    tiff_profile = models.CharField(max_length=32, blank=True, default="", choices=TIFF_PROFILE_CHOICES, verbose_name=_("abstract.tiff_profile"))
+
+    # Name of a profile in TIFF_PROFILES, subclasses may override it
+    default_tiff_profile = None
+
+    # Signature of the original and encoding settings the current pyramid was generated from
+    iiif_signature = models.CharField(max_length=64, blank=True, default="", editable=False, verbose_name=_("abstract.iiif_signature"))
 
-        # self._save_tiled_pyramid_tif()
-        save_tiled_pyramid_tif(self)
+    def save(self, generate_pyramid=True, **kwargs) -> None:
 
-        super().save(**kwargs)
+        update_fields = kwargs.get('update_fields')
+
+        # Partial saves which leave the file untouched never need a new pyramid
+        if update_fields is not None and 'file' not in update_fields:
+            generate_pyramid = False
+
+        if generate_pyramid:
+            # Hashing a large original would hold up the request, queued jobs hash it in the worker
+            if settings.TILING_ASYNC:
+                generate_pyramid = not pyramid_is_unchanged(self)
+            else:
+                generate_pyramid = not pyramid_is_current(self)
+
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'file_hash', 'file_size', 'file_mtime', 'iiif_file', 'iiif_signature', 'derivative_sizes', 'derivative_format'}
+
+        if not generate_pyramid:
+            super().save(**kwargs)
+
+        elif settings.TILING_ASYNC:
+            # A new upload invalidates the stored hash, whatever its size and modification time
+            if not self.file._committed:
+                self.file_hash = ""
+
+            # Save the row at once, the original is committed to storage
+            # and picked up from there by the process_tiling_jobs workers
+            super().save(**kwargs)
+            TilingJob.enqueue(self)
+
+        else:
+            save_tiled_pyramid_tif(self)
+            super().save(**kwargs)
 
 
 
@@ -191,7 +582,8 @@ class AbstractDocumentModel(AbstractBaseModel):
     """
     The abstract document model supplies a model with an automatic UUID field, a text field as well as
     a text_vector field. The text_vector may be used as a generated column to hold a tokenized version of
-    the text field. This must be generated for example by means of a PostgreSQL trigger, however
+    the text field. This must be generated for example by means of a PostgreSQL trigger, however,
+    as created by the SearchVectorTrigger migration operation in saintsophia.abstract.operations
     """
 
     # Create an automatic UUID signifier
@@ -212,4 +604,74 @@ class AbstractDocumentModel(AbstractBaseModel):
         indexes = (GinIndex(fields=["text_vector"]),)
 
     def __str__(self) -> str:
-        return f"{self.text[0:50]}"
\ No newline at end of file
+        return f"{self.text[0:50]}"
+
+
+##########################################################
+
+class TilingJob(models.Model):
+    """
+    A queued pyramid generation for an AbstractTIFFImageModel object. The job refers to the image
+    by app label, model name and primary key, since images live in the databases of their apps while
+    the queue lives in the default database. Jobs are processed by the process_tiling_jobs command.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE    = 'done'
+    FAILED  = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    app_label  = models.CharField(max_length=100, verbose_name=_("abstract.app_label"))
+    model_name = models.CharField(max_length=100, verbose_name=_("abstract.model_name"))
+    object_id  = models.BigIntegerField(verbose_name=_("abstract.object_id"))
+
+    status   = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, verbose_name=_("abstract.status"))
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name=_("abstract.progress"))
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_("abstract.attempts"))
+    worker   = models.CharField(max_length=256, blank=True, verbose_name=_("abstract.worker"))
+    error    = models.TextField(blank=True, verbose_name=_("abstract.error"))
+
+    created_at  = models.DateTimeField(auto_now_add=True, verbose_name=_("abstract.created_at"))
+    started_at  = models.DateTimeField(blank=True, null=True, verbose_name=_("abstract.started_at"))
+
+    # Refreshed by the worker command while the job runs, a job whose heartbeat stops is requeued
+    heartbeat_at = models.DateTimeField(blank=True, null=True, verbose_name=_("abstract.heartbeat_at"))
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name=_("abstract.finished_at"))
+    duration    = models.FloatField(blank=True, null=True, verbose_name=_("abstract.duration"))
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = (models.Index(fields=['status', 'created_at'], name='tilingjob_status_idx'),)
+
+    def __str__(self) -> str:
+        return f"{self.app_label}.{self.model_name} {self.object_id} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, obj: models.Model) -> "TilingJob":
+        """Queues pyramid generation for an image, unless it is already waiting in the queue.
+
+        Args:
+            obj (models.Model): A saved AbstractTIFFImageModel object
+
+        Returns:
+            TilingJob: The pending job
+        """
+
+        job, _ = cls.objects.get_or_create(
+            app_label=obj._meta.app_label,
+            model_name=obj._meta.model_name,
+            object_id=obj.pk,
+            status=cls.PENDING,
+        )
+
+        return job
+
+    def get_object(self) -> models.Model:
+        return apps.get_model(self.app_label, self.model_name).objects.get(pk=self.object_id)
@@ -0,0 +1,232 @@
+from django.db.migrations.operations.base import Operation
+
+from typing import *
+
+from .folding import FOLD_FUNCTION, get_fold_function_sql
+from .geometry import get_simplified_column
+
+
+class SearchVectorTrigger(Operation):
+    """
+    Migration operation keeping the text_vector of an AbstractDocumentModel subclass up to date with a
+    PostgreSQL trigger, and filling it for the existing rows. The vector joins the tokens of the given fields
+    for every text search configuration, which must match the SEARCH_CONFIGS used by the FullTextSearchFilter.
+
+    Usage, in a migration of the app:
+
+        operations = [
+            SearchVectorTrigger('inscription', fields=['text', 'title'], configs=['simple', 'english', 'greek']),
+        ]
+    """
+
+    reversible = True
+    reduces_to_sql = True
+
+    def __init__(self, model_name: str, fields: Sequence[str] = ('text',), configs: Sequence[str] = ('simple',), vector_field: str = 'text_vector'):
+        self.model_name = model_name
+        self.fields = list(fields)
+        self.configs = list(configs)
+        self.vector_field = vector_field
+
+    def deconstruct(self):
+        kwargs = {
+            'model_name': self.model_name,
+            'fields': self.fields,
+            'configs': self.configs,
+            'vector_field': self.vector_field,
+        }
+
+        return (self.__class__.__qualname__, [], kwargs)
+
+    def state_forwards(self, app_label, state):
+        # The trigger lives in the database only
+        pass
+
+    def get_names(self, model, schema_editor) -> Dict[str, str]:
+        table = model._meta.db_table
+
+        return {
+            'table': schema_editor.quote_name(table),
+            'function': schema_editor.quote_name(f"{table}_{self.vector_field}_update"),
+            'trigger': schema_editor.quote_name(f"{table}_{self.vector_field}_trigger"),
+            'vector': schema_editor.quote_name(model._meta.get_field(self.vector_field).column),
+        }
+
+    def get_vector_sql(self, model, schema_editor, prefix: str = '') -> str:
+        columns = [schema_editor.quote_name(model._meta.get_field(name).column) for name in self.fields]
+        document = " || ' ' || ".join(f"coalesce({prefix}{column}::text, '')" for column in columns)
+
+        return " || ".join(f"to_tsvector('{config}'::regconfig, {document})" for config in self.configs)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor != 'postgresql' or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+
+        names = self.get_names(model, schema_editor)
+        columns = ", ".join(schema_editor.quote_name(model._meta.get_field(name).column) for name in self.fields)
+
+        schema_editor.execute(
+            f"CREATE OR REPLACE FUNCTION {names['function']}() RETURNS trigger AS $$ "
+            f"BEGIN NEW.{names['vector']} := {self.get_vector_sql(model, schema_editor, 'NEW.')}; RETURN NEW; END "
+            f"$$ LANGUAGE plpgsql"
+        )
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {names['trigger']} ON {names['table']}")
+
+        # Only writes to the searchable fields recompute the vector
+        schema_editor.execute(
+            f"CREATE TRIGGER {names['trigger']} BEFORE INSERT OR UPDATE OF {columns} ON {names['table']} "
+            f"FOR EACH ROW EXECUTE FUNCTION {names['function']}()"
+        )
+        schema_editor.execute(f"UPDATE {names['table']} SET {names['vector']} = {self.get_vector_sql(model, schema_editor)}")
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor != 'postgresql' or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+
+        names = self.get_names(model, schema_editor)
+
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {names['trigger']} ON {names['table']}")
+        schema_editor.execute(f"DROP FUNCTION IF EXISTS {names['function']}()")
+
+    def describe(self):
+        return f"Create trigger maintaining {self.model_name}.{self.vector_field}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"{self.model_name.lower()}_{self.vector_field}_trigger"
+
+
+class FuzzySearchIndex(Operation):
+    """
+    Migration operation creating pg_trgm GIN indexes over the folded text of fields, as searched
+    by the FuzzySearchFilter. Installs the pg_trgm extension and the fold function if needed.
+
+    Usage, in a migration of the app:
+
+        operations = [
+            FuzzySearchIndex('inscription', fields=['transcription', 'interpretative_edition', 'romanisation']),
+        ]
+    """
+
+    reversible = True
+    reduces_to_sql = True
+
+    def __init__(self, model_name: str, fields: Sequence[str]):
+        self.model_name = model_name
+        self.fields = list(fields)
+
+    def deconstruct(self):
+        return (self.__class__.__qualname__, [], {'model_name': self.model_name, 'fields': self.fields})
+
+    def state_forwards(self, app_label, state):
+        # The indexes are expression indexes unknown to the model state
+        pass
+
+    def get_index_name(self, model, field_name: str) -> str:
+        # Within the 63 characters of PostgreSQL identifiers
+        return f"{model._meta.db_table}_{field_name}_trgm"[-63:]
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor != 'postgresql' or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(get_fold_function_sql())
+
+        for name in self.fields:
+            column = schema_editor.quote_name(model._meta.get_field(name).column)
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {schema_editor.quote_name(self.get_index_name(model, name))} "
+                f"ON {schema_editor.quote_name(model._meta.db_table)} USING gin ({FOLD_FUNCTION}({column}) gin_trgm_ops)"
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor != 'postgresql' or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+
+        # The extension and fold function may be used by other indexes, and are kept
+        for name in self.fields:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(self.get_index_name(model, name))}")
+
+    def describe(self):
+        return f"Create trigram indexes on {self.model_name}.{', '.join(self.fields)}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"{self.model_name.lower()}_trigram_indexes"
+
+
+class SimplifiedGeometryColumns(Operation):
+    """
+    Migration operation adding stored generated columns holding simplified versions of a geometry field
+    for zoom bands, as read by GeoViewSet for ?zoom= when listed in its simplified_zoom_bands. The tolerance
+    of a band is one pixel of a 256 pixel tile at its zoom level, zoom0_tolerance / 2 ** zoom.
+
+    Usage, in a migration of the app:
+
+        operations = [
+            SimplifiedGeometryColumns('annotation', field='geometry', zooms=[4, 8, 12], zoom0_tolerance=360 / 256),
+        ]
+    """
+
+    reversible = True
+    reduces_to_sql = True
+
+    def __init__(self, model_name: str, field: str = 'geometry', zooms: Sequence[int] = (), zoom0_tolerance: float = 360 / 256):
+        self.model_name = model_name
+        self.field = field
+        self.zooms = list(zooms)
+        self.zoom0_tolerance = zoom0_tolerance
+
+    def deconstruct(self):
+        kwargs = {
+            'model_name': self.model_name,
+            'field': self.field,
+            'zooms': self.zooms,
+            'zoom0_tolerance': self.zoom0_tolerance,
+        }
+
+        return (self.__class__.__qualname__, [], kwargs)
+
+    def state_forwards(self, app_label, state):
+        # The generated columns are read with raw SQL and are not part of the model
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor != 'postgresql' or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+
+        field = model._meta.get_field(self.field)
+        table = schema_editor.quote_name(model._meta.db_table)
+
+        for zoom in self.zooms:
+            column = schema_editor.quote_name(get_simplified_column(field.column, zoom))
+            tolerance = self.zoom0_tolerance / 2 ** zoom
+
+            schema_editor.execute(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} geometry GENERATED ALWAYS AS "
+                f"(ST_SimplifyPreserveTopology({schema_editor.quote_name(field.column)}, {tolerance!r})) STORED"
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor != 'postgresql' or not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+
+        field = model._meta.get_field(self.field)
+
+        for zoom in self.zooms:
+            column = schema_editor.quote_name(get_simplified_column(field.column, zoom))
+            schema_editor.execute(f"ALTER TABLE {schema_editor.quote_name(model._meta.db_table)} DROP COLUMN IF EXISTS {column}")
+
+    def describe(self):
+        return f"Add simplified {self.model_name}.{self.field} columns for zoom levels {', '.join(map(str, self.zooms))}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"{self.model_name.lower()}_{self.field}_simplified"
@@ -0,0 +1,42 @@
+from django.db import connections
+
+from collections import Counter
+from typing import *
+import threading
+
+# Connections opened per database alias in this process
+connections_created = Counter()
+_lock = threading.Lock()
+
+
+def count_connection(sender, connection, **kwargs) -> None:
+    """Signal receiver for connection_created, counting the new connections per database."""
+
+    with _lock:
+        connections_created[connection.alias] += 1
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Connection metrics of this process for every database. Pooled databases include the statistics
+    of their psycopg pool, e.g. checkouts (requests_num), waits (requests_queued, requests_wait_ms)
+    and timeouts (requests_errors).
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The metrics per database alias
+    """
+
+    stats = {}
+
+    for alias in connections:
+        connection = connections[alias]
+
+        # The PostgreSQL backend keeps the pools per alias, created with the first connection
+        pool = getattr(connection, '_connection_pools', {}).get(alias)
+
+        stats[alias] = {
+            'connections_created': connections_created[alias],
+            'pooled': 'pool' in connection.settings_dict.get('OPTIONS', {}),
+            **(pool.get_stats() if pool is not None else {}),
+        }
+
+    return stats
@@ -0,0 +1,136 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+from functools import lru_cache
+from typing import *
+
+
+class QueryPlan(NamedTuple):
+    select_related: Tuple[str, ...]
+    prefetch_related: Tuple[str, ...]
+    only: Tuple[str, ...]
+
+
+def walk_serializer(serializer: serializers.Serializer, prefix: str, prefetched: bool, select: List[str], prefetch: List[str]) -> None:
+    """Collects the relation paths a serializer will follow when representing an object. Single-valued relations
+    are joined with select_related, unless they are reached through a prefetched relation, and multi-valued relations
+    are prefetched.
+
+    Args:
+        serializer (serializers.Serializer): A serializer instance
+        prefix (str): The lookup path leading to the serializer, e.g. 'panel__'
+        prefetched (bool): Whether the path is reached through a prefetched relation
+        select (List[str]): Collected select_related paths
+        prefetch (List[str]): Collected prefetch_related paths
+    """
+
+    model = serializer.Meta.model
+
+    for field in serializer.fields.values():
+
+        if field.write_only or field.source == '*' or '.' in field.source:
+            continue
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+
+        if not model_field.is_relation or model_field.related_model is None:
+            continue
+
+        path = prefix + field.source
+        single = model_field.many_to_one or model_field.one_to_one
+
+        if isinstance(field, serializers.ListSerializer):
+            prefetch.append(path)
+            walk_serializer(field.child, path + '__', True, select, prefetch)
+
+        elif isinstance(field, serializers.BaseSerializer):
+            (select if single and not prefetched else prefetch).append(path)
+            walk_serializer(field, path + '__', prefetched or not single, select, prefetch)
+
+        elif isinstance(field, ManyRelatedField):
+            prefetch.append(path)
+
+        # Primary key fields read the foreign key column, anything else needs the related object
+        elif isinstance(field, RelatedField) and not field.use_pk_only_optimization():
+            (select if single and not prefetched else prefetch).append(path)
+
+
+def get_only_fields(serializer: serializers.Serializer, select: List[str]) -> Tuple[str, ...]:
+    """The columns to load for the top-level objects, or an empty tuple if the serializer may read
+    attributes which are not model fields, e.g. properties, since those could hit deferred columns."""
+
+    model = serializer.Meta.model
+    only = {model._meta.pk.name}
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return ()
+
+        if model_field.concrete and not model_field.many_to_many:
+            only.add(model_field.name)
+
+    # Joined relations must not be deferred
+    only.update(path.split('__')[0] for path in select)
+
+    return tuple(sorted(only))
+
+
+@lru_cache(maxsize=256)
+def get_query_plan(serializer_class: Type[serializers.Serializer], depth: int) -> QueryPlan:
+    """Derives the select_related, prefetch_related and only() arguments which let a serializer represent
+    a page of objects with a constant number of queries, whatever the depth. Plans are cached per serializer
+    class and depth.
+
+    Args:
+        serializer_class (Type[serializers.Serializer]): A model serializer class
+        depth (int): The requested nesting depth
+
+    Returns:
+        QueryPlan: The arguments for the queryset
+    """
+
+    serializer = serializer_class(context={'depth': depth})
+    select, prefetch = [], []
+
+    walk_serializer(serializer, '', False, select, prefetch)
+
+    return QueryPlan(tuple(select), tuple(prefetch), get_only_fields(serializer, select))
+
+
+def optimize_queryset(queryset: models.QuerySet, serializer_class: Type[serializers.Serializer], depth: int) -> models.QuerySet:
+    """Applies the query plan of a serializer to a queryset.
+
+    Args:
+        queryset (models.QuerySet): The queryset of a view
+        serializer_class (Type[serializers.Serializer]): The model serializer class of the view
+        depth (int): The requested nesting depth
+
+    Returns:
+        models.QuerySet: The optimized queryset
+    """
+
+    if not hasattr(getattr(serializer_class, 'Meta', None), 'model'):
+        return queryset
+
+    plan = get_query_plan(serializer_class, depth)
+
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+
+    if plan.prefetch_related:
+        queryset = queryset.prefetch_related(*plan.prefetch_related)
+
+    if plan.only:
+        queryset = queryset.only(*plan.only)
+
+    return queryset
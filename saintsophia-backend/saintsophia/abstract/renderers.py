@@ -0,0 +1,72 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Conversions for the types orjson and msgpack do not know, e.g. Decimal, lazy translations and geometries
+default_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    return default_encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, producing the same compact UTF-8 output as the DRF JSONRenderer
+    considerably faster. Datetimes are formatted by the DRF encoder, and U+2028 and U+2029 escaped like DRF does.
+    Unlike DRF with STRICT_JSON, NaN and infinite floats are rendered as null instead of raising an error.
+    Falls back to the DRF JSONRenderer if orjson is not installed, for indented output requested through the
+    Accept header, for the non-default UNICODE_JSON and COMPACT_JSON settings, and for integers beyond 64 bits.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if orjson is None or self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(data, default=encode_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Valid JSON, but not valid JavaScript before ES2019
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class GeoJSONRenderer(ORJSONRenderer):
+    """
+    JSON renderer for GeoJSON responses, selected with ?format=geojson or the application/geo+json media type.
+    """
+    media_type = 'application/geo+json'
+    format = 'geojson'
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack renderer for bulk clients, requires the msgpack package.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if msgpack is None:
+            raise RuntimeError("MessagePackRenderer requires the msgpack package.")
+
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
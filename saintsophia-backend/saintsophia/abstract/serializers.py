@@ -1,18 +1,174 @@
 from rest_framework import serializers
+from rest_framework.utils.field_mapping import get_nested_relation_kwargs
 from drf_dynamic_fields import DynamicFieldsMixin
 from django.utils.translation import gettext_lazy as _
+from functools import lru_cache
+from typing import *
+import copy
+import json
 
-class GenericSerializer(serializers.ModelSerializer, DynamicFieldsMixin):
+# Bounds of the nesting depth, as enforced by ModelSerializer
+MAX_DEPTH = 10
+
+# Number of generated serializer classes kept for reuse
+SERIALIZER_CLASS_CACHE_SIZE = 512
+
+
+class CachedFieldsMixin:
+    """
+    Builds the fields of a model serializer once per class and hands out copies, instead of 
+    introspecting the model on every instantiation. Nested serializers generated for `depth` 
+    cache their fields as well. Not suited for serializers whose fields depend on the request.
+    """
+
+    def get_fields(self):
+        cls = type(self)
+
+        # Looked up on the class itself, subclasses have fields of their own
+        fields = cls.__dict__.get('_cached_fields')
+        if fields is None:
+            fields = super().get_fields()
+            cls._cached_fields = fields
+
+        return copy.deepcopy(fields)
+
+    def build_nested_field(self, field_name, relation_info, nested_depth):
+        class NestedSerializer(CachedFieldsMixin, serializers.ModelSerializer):
+            class Meta:
+                model = relation_info.related_model
+                depth = nested_depth - 1
+                fields = '__all__'
+
+        return NestedSerializer, get_nested_relation_kwargs(relation_info)
+
+
+class GenericSerializer(CachedFieldsMixin, serializers.ModelSerializer, DynamicFieldsMixin):
 
     class Meta:
         model = None
         fields = '__all__'
         depth = 1
 
+
+@lru_cache(maxsize=SERIALIZER_CLASS_CACHE_SIZE)
+def get_depth_serializer_class(serializer_class: Type[serializers.ModelSerializer], depth: int, fields: Tuple[str, ...] = None) -> Type[serializers.ModelSerializer]:
+    """Generates a subclass of a model serializer with its own Meta, for a given depth and optionally a subset 
+    of its fields. Classes are generated once per combination and reused across requests, so that no request 
+    modifies a class shared with other threads.
+
+    Args:
+        serializer_class (Type[serializers.ModelSerializer]): A model serializer class
+        depth (int): The nesting depth of related models
+        fields (Tuple[str, ...], optional): The names of the fields to keep. Defaults to all fields.
+
+    Returns:
+        Type[serializers.ModelSerializer]: A serializer class, not instance.
+    """
+
+    attrs = {'depth': max(0, min(depth, MAX_DEPTH))}
+    if fields:
+        attrs['fields'] = fields
+        attrs['exclude'] = None
+
+    Meta = type('Meta', (serializer_class.Meta,), attrs)
+    generated = type(serializer_class.__name__, (serializer_class,), {'Meta': Meta, '_depth_resolved': True, '__module__': serializer_class.__module__})
+
+    # Declared fields outside of the subset would fail the fields assertion of ModelSerializer
+    if fields:
+        generated._declared_fields = {name: field for name, field in generated._declared_fields.items() if name in fields}
+
+    return generated
+
+
+@lru_cache(maxsize=SERIALIZER_CLASS_CACHE_SIZE)
+def get_search_serializer_class(serializer_class: Type[serializers.ModelSerializer]) -> Type[serializers.ModelSerializer]:
+    """Generates a subclass of a model serializer which also represents the search_rank and search_headline
+    annotations of full-text search results.
+
+    Args:
+        serializer_class (Type[serializers.ModelSerializer]): A model serializer class
+
+    Returns:
+        Type[serializers.ModelSerializer]: A serializer class, not instance.
+    """
+
+    attrs = {}
+    if isinstance(serializer_class.Meta.fields, (list, tuple)):
+        attrs['fields'] = [*serializer_class.Meta.fields, 'search_rank', 'search_headline']
+
+    Meta = type('Meta', (serializer_class.Meta,), attrs)
+
+    return type(serializer_class.__name__, (serializer_class,), {
+        'Meta': Meta,
+        'search_rank': serializers.FloatField(read_only=True),
+        'search_headline': serializers.CharField(read_only=True),
+        '_depth_resolved': True,
+        '__module__': serializer_class.__module__,
+    })
+
+
+class GeoJSONTextField(serializers.Field):
+    """
+    Read-only field representing a geometry already rendered as GeoJSON text by the database.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return json.loads(value) if value is not None else None
+
+
+@lru_cache(maxsize=SERIALIZER_CLASS_CACHE_SIZE)
+def get_geojson_serializer_class(serializer_class: Type[serializers.ModelSerializer], geo_field: str) -> Type[serializers.ModelSerializer]:
+    """Generates a subclass of a model serializer which represents its geometry from the geojson_geometry
+    annotation, as simplified and rounded in the database, instead of the geometry field itself.
+
+    Args:
+        serializer_class (Type[serializers.ModelSerializer]): A model serializer class
+        geo_field (str): The name of the geometry field
+
+    Returns:
+        Type[serializers.ModelSerializer]: A serializer class, not instance.
+    """
+
+    return type(serializer_class.__name__, (serializer_class,), {
+        geo_field: GeoJSONTextField(source='geojson_geometry'),
+        '_depth_resolved': True,
+        '__module__': serializer_class.__module__,
+    })
+
+
 class DynamicDepthSerializer(GenericSerializer):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.Meta.depth = self.context.get('depth', 0)
+    """
+    Serializes related models up to the depth given in the serializer context. Instantiating it
+    yields an instance of the generated subclass for that depth.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        if not cls.__dict__.get('_depth_resolved', False):
+            cls = get_depth_serializer_class(cls, kwargs.get('context', {}).get('depth', 0))
+
+        return super().__new__(cls, *args, **kwargs)
+
+class DerivativesField(serializers.Field):
+    """
+    Read-only field exposing the URLs of the static derivatives of an image, keyed by size.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        from saintsophia.abstract.models import get_derivative_urls
+
+        request = self.context.get('request')
+        urls = get_derivative_urls(instance)
+
+        return {str(size): request.build_absolute_uri(url) if request else url for size, url in urls.items()}
 
 class CountSerializer(serializers.Serializer):
 
@@ -1,3 +1,671 @@
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from saintsophia.abstract import caching, pooling, renderers
+from saintsophia.abstract.caching import BoundedLocMemCache
+from saintsophia.abstract.compiled import compile_serializer
+from saintsophia.abstract.faceting import Facet, count_facets, get_depth, parse_facets
+from saintsophia.abstract.filters import SpatialFilter
+from saintsophia.abstract.folding import fold, get_fold_mapping
+from saintsophia.abstract.iiif import IIIFError, parse_size
+from saintsophia.abstract.management.commands.ingest_images import Command as IngestImagesCommand, append_checkpoint
+from saintsophia.abstract.jobs import beat_tiling_jobs, requeue_stale_jobs
+from saintsophia.abstract.models import TilingJob
+from saintsophia.abstract.renderers import ORJSONRenderer
+from saintsophia.abstract.tiles import get_tile_bounds
+from saintsophia.abstract.views import GenericModelViewSet, GeoViewSet
+from saintsophia.routers import AppRouter, DjangoRouter, ReplicaPool
+from saintsophia.utils import get_serializer
+from saintsophia import routers
+
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+from unittest import mock, skipIf
+import json
+import os
+import tempfile
+import unicodedata
+import uuid
 
 # Create your tests here.
+
+def make_request(params=None):
+    return Request(APIRequestFactory().get('/', params or {}))
+
+# Caches of the tests, apart from those of a running server
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'api': {'BACKEND': 'saintsophia.abstract.caching.BoundedLocMemCache', 'LOCATION': 'tests-api'},
+    'api_versions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-api-versions'},
+}
+
+class TilingJobViewSet(GenericModelViewSet):
+    queryset = TilingJob.objects.order_by('id')
+    serializer_class = get_serializer(TilingJob)
+
+class TilingJobGeoViewSet(GeoViewSet):
+    queryset = TilingJob.objects.order_by('id')
+    serializer_class = get_serializer(TilingJob)
+    stream_chunk_size = 2
+
+class CompiledSerializerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        TilingJob.objects.create(app_label='inscriptions', model_name='image', object_id=1)
+        TilingJob.objects.create(app_label='inscriptions', model_name='image', object_id=2, status=TilingJob.DONE, progress=100, duration=1.5)
+        TilingJob.objects.create(app_label='inscriptions', model_name='panel', object_id=3, status=TilingJob.FAILED, error="Traceback ...", attempts=3)
+
+    def assertSameOutput(self, serializer_class, queryset):
+        plan = compile_serializer(serializer_class)
+        self.assertIsNotNone(plan)
+
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        actual = JSONRenderer().render(plan.represent(plan.values(queryset), {}))
+
+        self.assertEqual(expected, actual)
+
+    def test_generated_serializer(self):
+        self.assertSameOutput(get_serializer(TilingJob), TilingJob.objects.order_by('id'))
+
+    def test_field_subset_and_renamed_source(self):
+
+        class JobSerializer(serializers.ModelSerializer):
+            job_status = serializers.CharField(source='status')
+
+            class Meta:
+                model = TilingJob
+                fields = ['id', 'job_status', 'started_at', 'duration']
+
+        self.assertSameOutput(JobSerializer, TilingJob.objects.order_by('-id'))
+
+    def test_empty_queryset(self):
+        self.assertSameOutput(get_serializer(TilingJob), TilingJob.objects.none())
+
+    def test_computed_fields_are_not_compiled(self):
+
+        class JobSerializer(serializers.ModelSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta:
+                model = TilingJob
+                fields = ['id', 'label']
+
+            def get_label(self, obj):
+                return str(obj)
+
+        self.assertIsNone(compile_serializer(JobSerializer))
+
+
+class FoldTests(SimpleTestCase):
+
+    def test_diacritics_and_case(self):
+        self.assertEqual(fold("Ἁγία Σοφία"), "αγια σοφια")
+        self.assertEqual(fold("Kyïv"), "kyiv")
+
+    def test_titlo_and_superscript_letters(self):
+        self.assertEqual(fold("І҃с҃ Хрⷭ҇ъ"), "ис хрсъ")
+
+    def test_variant_letters(self):
+        self.assertEqual(fold("Ѿ СВѦТЫѦ"), fold("от святыя"))
+
+    def test_sql_function_folds_capitals_without_lower(self):
+        # The steps of the SQL function under a C ctype, where lower() leaves Greek and Cyrillic alone
+        mapping = get_fold_mapping()
+        table = str.maketrans({character: folded for character, folded in mapping.items() if len(folded) <= 1})
+
+        def fold_like_sql(text):
+            text = unicodedata.normalize('NFD', text)
+            for character, folded in mapping.items():
+                if len(folded) > 1:
+                    text = text.replace(character, folded)
+            return text.translate(table)
+
+        for text in ("ΑΓΙΑ ΣΟΦΙΑΣ", "Ѿ СВѦТЫѦ", "І҃С҃ ХРⷭ҇Ъ", "ѠТЕЦЪ", "Kyïv"):
+            self.assertEqual(fold_like_sql(text), fold(text))
+
+
+class SpatialFilterTests(SimpleTestCase):
+
+    class View:
+        bbox_filter_field = 'geometry'
+
+    def test_no_spatial_params_on_model_without_geometry(self):
+        queryset = TilingJob.objects.all()
+
+        self.assertIs(SpatialFilter().filter_queryset(make_request({'status': 'done'}), queryset, self.View()), queryset)
+
+    def test_spatial_params_look_up_the_geometry_field(self):
+        with self.assertRaises(FieldDoesNotExist):
+            SpatialFilter().filter_queryset(make_request({'k': '5'}), TilingJob.objects.all(), self.View())
+
+    def test_point(self):
+        point = SpatialFilter().get_point(make_request({'near': '30.5,50.45'}), 4326)
+
+        self.assertEqual((point.x, point.y, point.srid), (30.5, 50.45, 4326))
+        self.assertIsNone(SpatialFilter().get_point(make_request(), 4326))
+
+        for near in ('30.5', '30.5,50.45,1', 'a,b'):
+            with self.subTest(near=near), self.assertRaises(ValidationError):
+                SpatialFilter().get_point(make_request({'near': near}), 4326)
+
+    def test_number(self):
+        spatial_filter = SpatialFilter()
+
+        self.assertEqual(spatial_filter.get_number(make_request({'k': '5'}), 'k', int, 1, spatial_filter.max_k), 5)
+        self.assertIsNone(spatial_filter.get_number(make_request(), 'k', int, 1, spatial_filter.max_k))
+
+        for k in ('0', '1001', 'five', '2.5'):
+            with self.subTest(k=k), self.assertRaises(ValidationError):
+                spatial_filter.get_number(make_request({'k': k}), 'k', int, 1, spatial_filter.max_k)
+
+    def test_intersects(self):
+        geometry = SpatialFilter().get_intersects(make_request({'intersects': 'POLYGON((0 0, 1 0, 1 1, 0 0))'}), 3857)
+        self.assertEqual((geometry.geom_type, geometry.srid), ('Polygon', 3857))
+
+        geometry = SpatialFilter().get_intersects(make_request({'intersects': 'SRID=4326;POINT(30.5 50.45)'}), 3857)
+        self.assertEqual(geometry.srid, 4326)
+
+        with self.assertRaises(ValidationError):
+            SpatialFilter().get_intersects(make_request({'intersects': 'POLYGON((0 0'}), 3857)
+
+        with self.assertRaises(ValidationError):
+            SpatialFilter().get_intersects(make_request({'intersects': 'POINT(0 0)' + ' ' * SpatialFilter.max_wkt_length}), 3857)
+
+
+@override_settings(IIIF_MAX_AREA=4000 * 4000)
+class IIIFSizeTests(SimpleTestCase):
+
+    def test_max(self):
+        self.assertEqual(parse_size('max', 1200, 800), (1200, 800))
+
+    @override_settings(IIIF_MAX_AREA=600 * 400)
+    def test_max_bounded_by_area(self):
+        self.assertEqual(parse_size('max', 1200, 800), (600, 400))
+
+    def test_width_or_height(self):
+        self.assertEqual(parse_size('300,', 1200, 800), (300, 200))
+        self.assertEqual(parse_size(',200', 1200, 800), (300, 200))
+        self.assertEqual(parse_size('300,100', 1200, 800), (300, 100))
+
+    def test_percentage(self):
+        self.assertEqual(parse_size('pct:50', 1200, 800), (600, 400))
+
+    def test_best_fit(self):
+        self.assertEqual(parse_size('!300,300', 1200, 800), (300, 200))
+
+    def test_best_fit_never_upscales(self):
+        self.assertEqual(parse_size('!1000,1000', 120, 80), (120, 80))
+        self.assertEqual(parse_size('^!1000,1000', 120, 80), (1000, 667))
+
+    def test_upscaling(self):
+        self.assertEqual(parse_size('^2400,', 1200, 800), (2400, 1600))
+        self.assertEqual(parse_size('^pct:150', 1200, 800), (1800, 1200))
+
+        with self.assertRaises(IIIFError):
+            parse_size('2400,', 1200, 800)
+
+        with self.assertRaises(IIIFError):
+            parse_size('pct:150', 1200, 800)
+
+    def test_invalid(self):
+        for size in (',', 'full', 'pct:', 'pct:x', 'pct:0', '!300', '!0,300', '0,', 'a,b', '-300,'):
+            with self.subTest(size=size), self.assertRaises(IIIFError):
+                parse_size(size, 1200, 800)
+
+    def test_area_limit(self):
+        with self.assertRaises(IIIFError):
+            parse_size('^5000,5000', 1200, 800)
+
+
+class ParseFacetsTests(SimpleTestCase):
+
+    def test_fields_and_buckets(self):
+        facets = parse_facets(TilingJob, 'status, attempts:2,duration:0.5')
+
+        self.assertEqual(facets, [Facet('status', 'status'), Facet('attempts:2', 'attempts', 2.0), Facet('duration:0.5', 'duration', 0.5)])
+
+    def test_allowed(self):
+        self.assertEqual(parse_facets(TilingJob, 'status', allowed=['status']), [Facet('status', 'status')])
+
+        with self.assertRaises(ValidationError):
+            parse_facets(TilingJob, 'worker', allowed=['status'])
+
+    def test_invalid(self):
+        for spec in ('unknown', 'status__name', 'status:10', 'attempts:x', 'attempts:0', 'attempts:-1'):
+            with self.subTest(spec=spec), self.assertRaises(ValidationError):
+                parse_facets(TilingJob, spec)
+
+    def test_limit(self):
+        with self.assertRaises(ValidationError):
+            parse_facets(TilingJob, 'status,worker,attempts', limit=2)
+
+    def test_depth(self):
+        self.assertEqual(get_depth([]), 1)
+        self.assertEqual(get_depth([Facet('status', 'status'), Facet('panel__room', 'panel__room')]), 2)
+
+
+class CountFacetsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for object_id, (status, attempts) in enumerate([('done', 1), ('done', 2), ('done', 3), ('failed', 3), ('pending', 0)]):
+            TilingJob.objects.create(app_label='inscriptions', model_name='image', object_id=object_id, status=status, attempts=attempts)
+
+    def test_counts(self):
+        results = count_facets(TilingJob.objects.all(), [Facet('status', 'status'), Facet('attempts:2', 'attempts', 2.0)])
+
+        self.assertEqual(results['status'][0], {'value': 'done', 'count': 3})
+        self.assertCountEqual(results['status'][1:], [{'value': 'failed', 'count': 1}, {'value': 'pending', 'count': 1}])
+        self.assertEqual(results['attempts:2'], [{'value': 2, 'count': 3}, {'value': 0, 'count': 2}])
+
+    def test_filtered(self):
+        results = count_facets(TilingJob.objects.filter(attempts__gte=3), [Facet('status', 'status')])
+
+        self.assertCountEqual(results['status'], [{'value': 'done', 'count': 1}, {'value': 'failed', 'count': 1}])
+
+    def test_limit(self):
+        results = count_facets(TilingJob.objects.all(), [Facet('status', 'status')], limit=1)
+
+        self.assertEqual(results['status'], [{'value': 'done', 'count': 3}])
+
+
+class BoundedLocMemCacheTests(SimpleTestCase):
+
+    def make_cache(self, **options):
+        cache = BoundedLocMemCache(f'tests-{self.id()}', {'OPTIONS': options})
+        self.addCleanup(cache.clear)
+        return cache
+
+    def test_byte_budget(self):
+        cache = self.make_cache(MAX_BYTES=3500)
+
+        for key in 'abc':
+            cache.set(key, b'x' * 1000)
+
+        # Reading a value makes it the most recently used
+        cache.get('a')
+        cache.set('d', b'x' * 1000)
+
+        self.assertEqual(cache.get_many('abcd').keys(), {'a', 'c', 'd'})
+
+    def test_replaced_and_deleted_values(self):
+        cache = self.make_cache(MAX_BYTES=3000)
+
+        cache.set('a', b'x' * 2000)
+        cache.set('a', b'x' * 1000)
+        cache.set('b', b'x' * 1000)
+        cache.delete('b')
+        cache.set('c', b'x' * 1500)
+
+        self.assertEqual(cache.get_many('abc').keys(), {'a', 'c'})
+
+    def test_max_entries(self):
+        cache = self.make_cache(MAX_ENTRIES=2, CULL_FREQUENCY=2)
+
+        for key in 'abc':
+            cache.set(key, key)
+
+        self.assertEqual(cache.get_many('abc').keys(), {'b', 'c'})
+
+
+class RequeueStaleJobsTests(TestCase):
+
+    def create_job(self, started, heartbeat):
+        now = timezone.now()
+        return TilingJob.objects.create(
+            app_label='inscriptions', model_name='image', object_id=1, status=TilingJob.RUNNING,
+            started_at=now - timedelta(seconds=started), heartbeat_at=None if heartbeat is None else now - timedelta(seconds=heartbeat),
+        )
+
+    def test_missed_heartbeat(self):
+        long_running = self.create_job(started=7200, heartbeat=10)
+        lost = self.create_job(started=7200, heartbeat=600)
+        never_beaten = self.create_job(started=600, heartbeat=None)
+
+        self.assertEqual(requeue_stale_jobs(300), 2)
+
+        statuses = dict(TilingJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[long_running.id], TilingJob.RUNNING)
+        self.assertEqual(statuses[lost.id], TilingJob.PENDING)
+        self.assertEqual(statuses[never_beaten.id], TilingJob.PENDING)
+
+    def test_heartbeat_and_exclude(self):
+        beaten = self.create_job(started=7200, heartbeat=600)
+        excluded = self.create_job(started=7200, heartbeat=600)
+
+        self.assertEqual(beat_tiling_jobs([beaten.id]), 1)
+        self.assertEqual(requeue_stale_jobs(300, exclude=[excluded.id]), 0)
+
+
+@override_settings(DATABASE_REPLICAS={'inscriptions': ['inscriptions_replica_0']}, REPLICA_MAX_LAG=5)
+class RouterTests(SimpleTestCase):
+
+    model = SimpleNamespace(_meta=SimpleNamespace(app_label='inscriptions'))
+
+    def setUp(self):
+        self.router = AppRouter()
+        self.router.projects = ['inscriptions']
+
+        self.pool = ReplicaPool('inscriptions', ['inscriptions_replica_0'])
+        self.lag = 0.0
+
+        for patcher in (
+            mock.patch.dict(routers.REPLICA_POOLS, {'inscriptions': self.pool}),
+            mock.patch.object(self.pool, 'get_lag', lambda alias: self.lag),
+            mock.patch.object(routers, 'connections', {'inscriptions': SimpleNamespace(in_atomic_block=False)}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start_request(self, pinned=()):
+        token = routers.start_request(pinned)
+        self.addCleanup(routers.end_request, token)
+
+    def test_reads_outside_requests_from_primary(self):
+        self.assertEqual(self.router.db_for_read(self.model), 'inscriptions')
+
+    def test_reads_in_requests_from_replica(self):
+        self.start_request()
+
+        self.assertEqual(self.router.db_for_read(self.model), 'inscriptions_replica_0')
+        self.assertTrue(routers.is_reading_replica())
+
+    def test_lagging_replica_left_out(self):
+        self.lag = 60.0
+        self.start_request()
+
+        self.assertEqual(self.router.db_for_read(self.model), 'inscriptions')
+        self.assertFalse(routers.is_reading_replica())
+
+    def test_writes_pin_reads_to_primary(self):
+        self.start_request()
+
+        self.assertEqual(self.router.db_for_write(self.model), 'inscriptions')
+        self.assertEqual(self.router.db_for_read(self.model), 'inscriptions')
+
+    def test_pinned_apps_read_from_primary(self):
+        self.start_request(pinned=['inscriptions'])
+
+        self.assertEqual(self.router.db_for_read(self.model), 'inscriptions')
+
+    def test_migrate(self):
+        self.assertTrue(self.router.allow_migrate('inscriptions', 'inscriptions'))
+        self.assertFalse(self.router.allow_migrate('default', 'inscriptions'))
+        self.assertFalse(self.router.allow_migrate('inscriptions_replica_0', 'inscriptions'))
+        self.assertFalse(self.router.allow_migrate('inscriptions', 'rest_framework'))
+        self.assertIsNone(self.router.allow_migrate('default', 'rest_framework'))
+
+    def test_migrate_abstract(self):
+        router = DjangoRouter()
+
+        self.assertTrue(router.allow_migrate('default', 'abstract', 'tilingjob'))
+        self.assertFalse(router.allow_migrate('inscriptions', 'abstract', 'tilingjob'))
+        self.assertFalse(router.allow_migrate('inscriptions_replica_0', 'abstract', 'tilingjob'))
+
+
+@skipIf(renderers.orjson is None, "orjson is not installed")
+class ORJSONRendererTests(SimpleTestCase):
+
+    payload = {
+        'id': 1,
+        'title': "Софія Київська\u2028ΑΓΙΑ\u2029",
+        'ratio': 0.1,
+        'length': Decimal('1.50'),
+        'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'created_at': datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+        'date': date(2024, 1, 2),
+        'tags': ['graffito', None, True],
+        'years': {1037: 'consecration'},
+        'status': gettext_lazy("Done"),
+    }
+
+    def test_same_output_as_drf(self):
+        self.assertEqual(ORJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_large_integers(self):
+        self.assertEqual(ORJSONRenderer().render({'id': 2 ** 70}), JSONRenderer().render({'id': 2 ** 70}))
+
+    def test_non_finite_floats(self):
+        # Documented difference, DRF refuses them with STRICT_JSON
+        self.assertEqual(ORJSONRenderer().render({'value': float('nan')}), b'{"value":null}')
+
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({'value': float('nan')})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CacheInvalidationTests(SimpleTestCase):
+
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+    def test_filter_signature(self):
+        signature = caching.get_filter_signature(make_request({'status': ['failed', 'done'], 'limit': '10', 'attempts': '3'}))
+
+        self.assertEqual(signature, {'attempts': ['3'], 'status': ['done', 'failed']})
+        self.assertEqual(list(signature), ['attempts', 'status'])
+
+    def test_key_changes_with_writes(self):
+        key = caching.make_cache_key('count', TilingJob, {'status': ['done']})
+
+        self.assertEqual(caching.make_cache_key('count', TilingJob, {'status': ['done']}), key)
+        self.assertNotEqual(caching.make_cache_key('count', TilingJob, {'status': ['failed']}), key)
+
+        caching.bump_model_version(TilingJob)
+
+        self.assertNotEqual(caching.make_cache_key('count', TilingJob, {'status': ['done']}), key)
+
+    def test_lost_versions_never_repeat(self):
+        versions = caching.get_model_versions(TilingJob)
+
+        caching.get_version_cache().clear()
+
+        self.assertNotEqual(caching.get_model_versions(TilingJob), versions)
+
+    def test_get_or_set(self):
+        default = mock.Mock(return_value=3)
+
+        self.assertEqual(caching.get_or_set('count:test', TilingJob, default), 3)
+        self.assertEqual(caching.get_or_set('count:test', TilingJob, default), 3)
+        default.assert_called_once()
+
+    def test_replica_reads_after_writes_not_cached(self):
+        caching.bump_model_version(TilingJob)
+
+        with mock.patch.object(routers, 'is_reading_replica', return_value=True):
+            self.assertFalse(caching.is_cacheable_read(TilingJob))
+
+            with mock.patch.object(caching.time, 'time', return_value=caching.time.time() + 3600):
+                self.assertTrue(caching.is_cacheable_read(TilingJob))
+
+        self.assertTrue(caching.is_cacheable_read(TilingJob))
+
+
+@override_settings(CACHES=TEST_CACHES, API_CACHE_RESPONSES=True)
+class CachedResponseTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for object_id in range(5):
+            TilingJob.objects.create(app_label='inscriptions', model_name='image', object_id=object_id)
+
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+        self.factory = APIRequestFactory()
+        self.view = TilingJobViewSet.as_view({'get': 'list'})
+
+    def test_cached_until_write(self):
+        response = self.view(self.factory.get('/jobs/'))
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            cached = self.view(self.factory.get('/jobs/'))
+            not_modified = self.view(self.factory.get('/jobs/', HTTP_IF_NONE_MATCH=etag))
+
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+        TilingJob.objects.create(app_label='inscriptions', model_name='image', object_id=5)
+
+        response = self.view(self.factory.get('/jobs/'))
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['count'], 6)
+
+    def test_keyed_on_params(self):
+        self.view(self.factory.get('/jobs/', {'limit': 2}))
+
+        response = self.view(self.factory.get('/jobs/', {'limit': 3}))
+
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_keyset_pages(self):
+        ids = list(TilingJob.objects.order_by('id').values_list('id', flat=True))
+        request = self.factory.get('/jobs/', {'pagination': 'keyset', 'limit': 2})
+        pages = []
+
+        while request is not None:
+            response = self.view(request)
+            pages.append([job['id'] for job in response.data['results']])
+
+            self.assertNotIn('count', response.data)
+            request = self.factory.get(response.data['next']) if response.data['next'] else None
+
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+
+    def test_keyset_stable_while_inserting(self):
+        ids = list(TilingJob.objects.order_by('id').values_list('id', flat=True))
+
+        response = self.view(self.factory.get('/jobs/', {'pagination': 'keyset', 'limit': 2}))
+        cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+
+        TilingJob.objects.create(app_label='inscriptions', model_name='image', object_id=5)
+
+        response = self.view(self.factory.get('/jobs/', {'pagination': 'keyset', 'limit': 2, 'cursor': cursor}))
+        self.assertEqual([job['id'] for job in response.data['results']], ids[2:4])
+
+
+class StreamTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for object_id in range(5):
+            TilingJob.objects.create(app_label='inscriptions', model_name='image', object_id=object_id)
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = TilingJobGeoViewSet.as_view({'get': 'list'})
+
+    def test_stream(self):
+        response = self.view(self.factory.get('/jobs/', {'stream': 'true'}))
+        data = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual([job['id'] for job in data['features']], list(TilingJob.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_stream_filtered(self):
+        TilingJob.objects.filter(object_id__lt=2).update(status=TilingJob.DONE)
+
+        response = self.view(self.factory.get('/jobs/', {'stream': 'true', 'status': TilingJob.DONE}))
+        data = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(sorted(job['object_id'] for job in data['features']), [0, 1])
+
+    def test_stream_empty(self):
+        response = self.view(self.factory.get('/jobs/', {'stream': 'true', 'status': TilingJob.FAILED}))
+
+        self.assertEqual(b''.join(response.streaming_content), b'{"type":"FeatureCollection","features":[]}')
+
+    def test_stream_not_acceptable(self):
+        response = self.view(self.factory.get('/jobs/', {'stream': 'true', 'format': 'xml'}))
+
+        self.assertEqual(response.status_code, 406)
+
+
+@override_settings(MVT_BOUNDS=(0, 0, 1024, 1024))
+class TileBoundsTests(SimpleTestCase):
+
+    def test_world(self):
+        self.assertEqual(get_tile_bounds(0, 0, 0), (0, 0, 1024, 1024))
+
+    def test_origin_top_left(self):
+        self.assertEqual(get_tile_bounds(1, 0, 0), (0, 512, 512, 1024))
+        self.assertEqual(get_tile_bounds(1, 1, 1), (512, 0, 1024, 512))
+        self.assertEqual(get_tile_bounds(2, 1, 3), (256, 0, 512, 256))
+
+
+class PoolStatsTests(SimpleTestCase):
+
+    def test_stats_per_database(self):
+        stats = pooling.get_pool_stats()
+
+        self.assertIn('default', stats)
+        self.assertLessEqual({'connections_created', 'pooled'}, set(stats['default']))
+
+    def test_connections_counted(self):
+        created = pooling.connections_created['default']
+
+        pooling.count_connection(None, SimpleNamespace(alias='default'))
+
+        self.assertEqual(pooling.get_pool_stats()['default']['connections_created'], created + 1)
+
+
+class IngestCheckpointTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.directory = directory.name
+        self.checkpoint = os.path.join(self.directory, '.ingest_checkpoint.jsonl')
+
+    def test_missing_checkpoint(self):
+        self.assertEqual(IngestImagesCommand().read_checkpoint(self.checkpoint), (set(), {}))
+
+    def test_states(self):
+        command = IngestImagesCommand()
+
+        command.write_checkpoint(self.checkpoint, [('a.tif', '1', 'started'), ('b.tif', '2', 'started'), ('c.tif', '3', 'started'), ('d.tif', '4', 'started')])
+        append_checkpoint(self.checkpoint, [{'source': 'a.tif', 'uuid': '1', 'state': 'copied', 'file': 'original/a_x7.tif'}])
+        append_checkpoint(self.checkpoint, [{'source': 'b.tif', 'uuid': '2', 'state': 'copied', 'file': 'original/b.tif'}])
+        command.write_checkpoint(self.checkpoint, [('b.tif', '2', 'done'), ('c.tif', '3', 'removed')])
+
+        # Written by earlier versions without a state
+        append_checkpoint(self.checkpoint, [{'source': 'e.tif', 'uuid': '5'}])
+
+        done, interrupted = command.read_checkpoint(self.checkpoint)
+
+        self.assertEqual(done, {'b.tif', 'e.tif'})
+        self.assertEqual(interrupted, {
+            '1': {'source': 'a.tif', 'file': 'original/a_x7.tif', 'finished': False},
+            '4': {'source': 'd.tif', 'file': None, 'finished': False},
+        })
+
+    def test_retried_source(self):
+        command = IngestImagesCommand()
+
+        command.write_checkpoint(self.checkpoint, [('a.tif', '1', 'started'), ('a.tif', '1', 'removed'), ('a.tif', '2', 'started'), ('a.tif', '2', 'done')])
+
+        self.assertEqual(command.read_checkpoint(self.checkpoint), ({'a.tif'}, {}))
+
+    def test_scan(self):
+        for name in ('b.TIF', 'a.jpg', 'notes.txt', os.path.join('panel', 'c.png')):
+            os.makedirs(os.path.dirname(os.path.join(self.directory, name)), exist_ok=True)
+            open(os.path.join(self.directory, name), 'w').close()
+
+        sources = [os.path.relpath(source, self.directory) for source in IngestImagesCommand().scan(self.directory, ['.jpg', '.tif', '.png'])]
+
+        self.assertEqual(sources, ['a.jpg', 'b.TIF', os.path.join('panel', 'c.png')])
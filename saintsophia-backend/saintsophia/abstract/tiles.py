@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import Transform
+from django.contrib.gis.geos import Polygon
+from django.db import connections, models
+
+from typing import *
+
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+
+def get_tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """The bounds of a tile in the tile grid over MVT_BOUNDS, with the origin in the top left corner
+    like ST_TileEnvelope.
+
+    Args:
+        z (int): The zoom level
+        x (int): The column of the tile
+        y (int): The row of the tile
+
+    Returns:
+        Tuple[float, float, float, float]: The bounds as xmin, ymin, xmax, ymax in MVT_SRID
+    """
+
+    xmin, ymin, xmax, ymax = settings.MVT_BOUNDS
+    width = (xmax - xmin) / 2 ** z
+    height = (ymax - ymin) / 2 ** z
+
+    return (xmin + x * width, ymax - (y + 1) * height, xmin + (x + 1) * width, ymax - y * height)
+
+
+def render_tile(queryset: models.QuerySet, z: int, x: int, y: int, geometry_field: str = 'geometry', properties: Sequence[str] = ()) -> bytes:
+    """Renders the geometries of a queryset within a tile as a Mapbox Vector Tile with ST_AsMVT. Geometries
+    are found through the spatial index, simplified to the resolution of the zoom level and clipped to the tile.
+
+    Args:
+        queryset (models.QuerySet): The filtered queryset
+        z (int): The zoom level
+        x (int): The column of the tile
+        y (int): The row of the tile
+        geometry_field (str, optional): The geometry field to render. Defaults to 'geometry'.
+        properties (Sequence[str], optional): The fields to include as feature properties. Defaults to ().
+
+    Returns:
+        bytes: The tile, empty if no geometry intersects it
+    """
+
+    srid = settings.MVT_SRID
+    extent = settings.MVT_EXTENT
+    xmin, ymin, xmax, ymax = get_tile_bounds(z, x, y)
+
+    # Geometries within the buffer around the tile are drawn as well, so that lines and outlines continue across tiles
+    margin = (xmax - xmin) * settings.MVT_BUFFER / extent
+    envelope = Polygon.from_bbox((xmin - margin, ymin - margin, xmax + margin, ymax + margin))
+    envelope.srid = srid
+
+    geometry = models.F(geometry_field)
+    if queryset.model._meta.get_field(geometry_field).srid != srid:
+        geometry = Transform(geometry, srid)
+
+    # Details below a pixel of the tile at this zoom level are invisible
+    tolerance = (xmax - xmin) / extent * settings.MVT_SIMPLIFY_PIXELS
+    geometry = models.Func(geometry, models.Value(tolerance), function='ST_SimplifyPreserveTopology', output_field=GeometryField(srid=srid))
+
+    bounds = models.Func(*(models.Value(value) for value in (xmin, ymin, xmax, ymax)), models.Value(srid), function='ST_MakeEnvelope', output_field=GeometryField(srid=srid))
+    geometry = models.Func(
+        geometry, bounds, models.Value(extent), models.Value(settings.MVT_BUFFER), models.Value(True),
+        function='ST_AsMVTGeom',
+        output_field=GeometryField(srid=srid),
+    )
+
+    features = (
+        queryset
+        .filter(**{f"{geometry_field}__bboverlaps": envelope})
+        .order_by()
+        .values(*properties, mvt_id=models.F('pk'), mvt_geometry=geometry)
+    )
+    sql, params = features.query.get_compiler(using=queryset.db).as_sql()
+
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            f"SELECT ST_AsMVT(features, %s, %s, 'mvt_geometry', 'mvt_id') FROM ({sql}) AS features WHERE mvt_geometry IS NOT NULL",
+            [queryset.model._meta.model_name, extent, *params],
+        )
+        tile = cursor.fetchone()[0]
+
+    return bytes(tile) if tile is not None else b''
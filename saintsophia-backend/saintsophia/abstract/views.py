@@ -1,14 +1,23 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import get_all_model_fields
 from rest_framework import status
-from rest_framework import viewsets, pagination
+from rest_framework.exceptions import NotAcceptable, ValidationError
+from rest_framework import viewsets, pagination, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework_gis.filters import InBBoxFilter
 from rest_framework_gis.pagination import GeoJsonPagination
 from rest_framework import filters
+from collections import OrderedDict
+from typing import *
 
+from saintsophia.abstract.renderers import GeoJSONRenderer, ORJSONRenderer
 from saintsophia.abstract.schemas import SaintSophiaSchema
-from . import serializers
+from .filters import FullTextSearchFilter, SpatialFilter
+from . import caching, compiled, faceting, geometry, pooling, queries, serializers, tiles
 
 class CountModelMixin:
     """
@@ -24,23 +33,90 @@ class CountModelMixin:
         serializer = self.get_serializer(queryset.count())
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-class GenericPagination(pagination.LimitOffsetPagination):
+class KeysetPagination(pagination.CursorPagination):
     """
-    The pagination of choice is limit-offset pagination.
+    Keyset pagination, which seeks to the last row of the previous page on an indexed key
+    instead of scanning past an offset, and never counts the rows. The key is `id` unless the view 
+    sets `keyset_ordering`, which should be unique and indexed. Cursors are opaque, and pages 
+    stay stable while rows are inserted.
+    """
+    ordering = 'id'
+    page_size = 25
+    page_size_query_param = 'limit'
+    max_page_size = 2000
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+
+class GeoJsonKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination returning a GeoJSON FeatureCollection.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('type', 'FeatureCollection'),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('features', data['features']),
+        ]))
+
+class KeysetSwitchMixin:
+    """
+    Lets a client opt into keyset pagination with `?pagination=keyset`, or by following a `cursor`.
+    """
+    keyset_class = KeysetPagination
+    keyset = None
+
+    def use_keyset(self, request) -> bool:
+        return request.query_params.get('pagination') == 'keyset' or self.keyset_class.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': 'pagination',
+                'required': False,
+                'in': 'query',
+                'description': "Set to 'keyset' for cursor based pagination, which is faster for deep pages.",
+                'schema': {'type': 'string', 'enum': ['keyset']},
+            },
+            *self.keyset_class().get_schema_operation_parameters(view)[:1],
+        ]
+
+class GenericPagination(KeysetSwitchMixin, pagination.LimitOffsetPagination):
+    """
+    The pagination of choice is limit-offset pagination, with keyset pagination on request.
     """
     default_limit = 25
 
-class GeoJsonPagePagination(GeoJsonPagination):
+class GeoJsonPagePagination(KeysetSwitchMixin, GeoJsonPagination):
+    keyset_class = GeoJsonKeysetPagination
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 2000
 
-class GenericModelViewSet(viewsets.ReadOnlyModelViewSet):
+class GenericModelViewSet(caching.CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """
     The GenericModelViewSet allows the creation of a a model agnostic model view
     with elementary filtering support and pagination.
     """
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter]
     filterset_fields = '__all__'
     pagination_class = GenericPagination
     schema = SaintSophiaSchema()
@@ -53,32 +129,144 @@ class GenericModelViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             return self.serializer_class
 
+    # Serve lists through a compiled serialization plan where the serializer allows it
+    # None follows the FAST_SERIALIZATION setting
+    fast_serialization = None
+
+    def get_serialization_plan(self):
+        enabled = settings.FAST_SERIALIZATION if self.fast_serialization is None else self.fast_serialization
+
+        # Search results carry annotations the plan does not know of
+        if not enabled or self.action != 'list' or self.is_full_text_search():
+            return None
+
+        return compiled.compile_serializer(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        plan = self.get_serialization_plan()
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = plan.values(queryset)
+
+        page = self.paginate_queryset(rows)
+        data = plan.represent(rows if page is None else page, self.get_serializer_context(), queryset.db)
+
+        if page is not None:
+            return self.get_paginated_response(data)
+
+        return Response(data)
+
+    def is_full_text_search(self) -> bool:
+        return self.action == 'list' and FullTextSearchFilter in self.filter_backends and FullTextSearchFilter.get_search_query(self.request, self.queryset.model) is not None
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+
+        # Represent the rank and highlighted snippets of search results
+        if self.is_full_text_search():
+            serializer_class = serializers.get_search_serializer_class(serializer_class)
+
+        kwargs.setdefault('context', self.get_serializer_context())
+        return serializer_class(*args, **kwargs)
+
+    def get_depth(self) -> int:
+        """The nesting depth the serializer will represent objects with."""
+        return getattr(getattr(self.serializer_class, 'Meta', None), 'depth', 0)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        # Join and prefetch whatever the serializer will traverse, avoiding a query per object
+        if self.action in ('list', 'retrieve'):
+            queryset = queries.optimize_queryset(queryset, self.get_serializer_class(), self.get_depth())
+
+        return queryset
+
     @action(detail=False, methods=["get"])
     def count(self, request, pk=None, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
 
-        serializer = self.get_serializer(data={'count': queryset.count()})
+        # Estimates come from the planner statistics, exact counts are cached until the next write
+        estimate = request.query_params.get('estimate', '').lower() in ('true', '1')
+        count = caching.estimate_count(queryset) if estimate else caching.get_cached_count(queryset, request)
+
+        serializer = self.get_serializer(data={'count': count})
 
         if serializer.is_valid():        
-            return Response(serializer.validated_data, status=status.HTTP_200_OK)
+            return Response(serializer.validated_data, status=status.HTTP_200_OK, headers={'X-Count-Estimate': str(estimate).lower()})
+
+    # Field paths which may be counted by the facets action, None allows the fields of filterset_fields
+    facet_fields = None
+
+    def get_facet_fields(self):
+        if self.facet_fields is not None:
+            return self.facet_fields
+
+        if self.filterset_fields == '__all__':
+            return get_all_model_fields(self.queryset.model)
+
+        return list(self.filterset_fields or [])
+
+    @action(detail=False, methods=["get"])
+    def facets(self, request, *args, **kwargs):
+        facets = faceting.parse_facets(self.queryset.model, request.query_params.get('facets', ''), self.get_facet_fields(), settings.FACET_MAX_FIELDS)
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # Cached like counts per path, until the next write to a model along the facet paths
+        depth = faceting.get_depth(facets)
+        key = caching.make_cache_key('facets', queryset.model, request.path, caching.get_filter_signature(request), [facet.name for facet in facets], depth=depth)
+        data = caching.get_or_set(key, queryset.model, lambda: faceting.count_facets(queryset, facets, settings.FACET_MAX_VALUES), settings.COUNT_CACHE_TIMEOUT, depth)
+
+        return Response(data, status=status.HTTP_200_OK)
 
 class DynamicDepthViewSet(GenericModelViewSet):
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
+    def get_serializer_class(self):
+        serializer_class = super().get_serializer_class()
+
+        if self.action == 'count':
+            return serializer_class
+
+        # A cached class per depth and field subset, shared by all requests asking for them
+        return serializers.get_depth_serializer_class(serializer_class, self.get_depth(), self.get_requested_fields(serializer_class))
+
+    def get_requested_fields(self, serializer_class):
+        """The valid field names given in ?fields=, as a sorted tuple, or None for all fields."""
+
+        requested = self.request.query_params.get('fields')
+        if not requested:
+            return None
+
+        model = serializer_class.Meta.model
+        available = {field.name for field in model._meta.fields + model._meta.many_to_many} | set(serializer_class._declared_fields)
+
+        if isinstance(serializer_class.Meta.fields, (list, tuple)):
+            available &= set(serializer_class.Meta.fields)
+
+        fields = tuple(sorted(available & {name.strip() for name in requested.split(',')}))
+
+        return fields or None
+
+    def get_depth(self) -> int:
         depth = 0
         try:
             depth = int(self.request.query_params.get('depth', 0))
         except ValueError:
             pass # Ignore non-numeric parameters and keep default 0 depth
-        
-        context['depth'] = depth
+
+        return depth
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['depth'] = self.get_depth()
 
         return context
 
 class GeoViewSet(GenericModelViewSet):
 
-    filter_backends = [InBBoxFilter, DjangoFilterBackend, filters.SearchFilter]
+    filter_backends = [InBBoxFilter, DjangoFilterBackend, filters.SearchFilter, FullTextSearchFilter, SpatialFilter]
     # schema = schemas.AutoSchema()
     
     # GIS filters
@@ -87,4 +275,144 @@ class GeoViewSet(GenericModelViewSet):
 
     # Specialized pagination
     pagination_class = GeoJsonPagePagination
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+    # Fields included as properties of the vector tile features, besides the primary key as feature id
+    tile_properties = []
+
+    # Number of rows fetched per round trip of the server-side cursor of streamed exports
+    stream_chunk_size = 2000
+
+    # Zoom levels with precomputed simplified geometry columns, see SimplifiedGeometryColumns
+    simplified_zoom_bands = []
+
+    def get_geometry_parameters(self) -> Optional[Dict[str, Any]]:
+        """The validated ?simplify=, ?zoom= and ?precision= parameters, or None if none are given."""
+
+        params = self.request.query_params
+        if self.action not in ('list', 'retrieve') or not any(name in params for name in ('simplify', 'zoom', 'precision')):
+            return None
+
+        try:
+            parameters = {
+                'tolerance': float(params['simplify']) if 'simplify' in params else None,
+                'zoom': int(params['zoom']) if 'zoom' in params else None,
+                'precision': int(params['precision']) if 'precision' in params else None,
+            }
+        except ValueError:
+            raise ValidationError("simplify must be a number, zoom and precision integers.")
+
+        if (parameters['tolerance'] or 0) < 0 or not 0 <= (parameters['zoom'] or 0) <= settings.MVT_MAX_ZOOM or not 0 <= (parameters['precision'] or 0) <= 15:
+            raise ValidationError(f"simplify must be positive, zoom between 0 and {settings.MVT_MAX_ZOOM}, precision between 0 and 15.")
+
+        return parameters
+
+    def get_geo_field(self, serializer_class) -> str:
+        return getattr(getattr(serializer_class, 'Meta', None), 'geo_field', None) or self.bbox_filter_field
+
+    def get_serializer_class(self):
+        serializer_class = super().get_serializer_class()
+
+        # Geometries rendered by the database replace the geometry field
+        if self.get_geometry_parameters() is not None:
+            serializer_class = serializers.get_geojson_serializer_class(serializer_class, self.get_geo_field(serializer_class))
+
+        return serializer_class
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        parameters = self.get_geometry_parameters()
+        if parameters is not None:
+            expression = geometry.get_geojson_expression(
+                queryset.model,
+                self.get_geo_field(self.serializer_class),
+                zoom_bands=self.simplified_zoom_bands,
+                **parameters,
+            )
+            queryset = queryset.annotate(geojson_geometry=expression)
+
+        return queryset
+
+    def get_serialization_plan(self):
+        # The plan reads the geometry field itself
+        if self.get_geometry_parameters() is not None:
+            return None
+
+        return super().get_serialization_plan()
+
+    def get_renderers(self):
+        return [*super().get_renderers(), GeoJSONRenderer()]
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream', '').lower() in ('true', '1'):
+            return self.stream(request)
+
+        return super().list(request, *args, **kwargs)
+
+    def stream(self, request):
+        """Streams all filtered features as one GeoJSON FeatureCollection, without pagination. Rows are
+        read through a server-side cursor and sent a chunk at a time, so memory stays flat for any layer size.
+        Only JSON formats can be streamed, others are not acceptable."""
+
+        # Any JSON renderer, e.g. the GeoJSONRenderer for ?format=geojson
+        if not isinstance(request.accepted_renderer, ORJSONRenderer):
+            raise NotAcceptable(f"Streamed exports are only available as GeoJSON, not {request.accepted_renderer.format}.")
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # The content is read after the request is done, bind it to the database chosen for the request
+        queryset = queryset.using(queryset.db)
+
+        serializer = self.get_serializer()
+        renderer = GeoJSONRenderer()
+
+        def content():
+            yield b'{"type":"FeatureCollection","features":['
+
+            separator = b''
+            features = []
+
+            for obj in queryset.iterator(chunk_size=self.stream_chunk_size):
+                features.append(renderer.render(serializer.to_representation(obj)))
+
+                if len(features) == self.stream_chunk_size:
+                    yield separator + b','.join(features)
+                    separator = b','
+                    features = []
+
+            if features:
+                yield separator + b','.join(features)
+
+            yield b']}'
+
+        return StreamingHttpResponse(content(), content_type=request.accepted_renderer.media_type)
+
+    @action(detail=False, methods=["get"], url_path=r'tiles/(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\.pbf')
+    def tiles(self, request, z, x, y, *args, **kwargs):
+        z, x, y = int(z), int(x), int(y)
+        if z > settings.MVT_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            raise Http404("No such tile.")
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # Cached per path, which holds the tile coordinates, and filter signature until the next write to the involved models
+        key = caching.make_cache_key('tile', queryset.model, request.path, caching.get_filter_signature(request))
+        tile = caching.get_or_set(
+            key,
+            queryset.model,
+            lambda: tiles.render_tile(queryset, z, x, y, self.bbox_filter_field, self.tile_properties),
+            settings.MVT_CACHE_TIMEOUT,
+        )
+
+        return HttpResponse(tile, content_type=tiles.MVT_CONTENT_TYPE)
+
+
+class DatabasePoolStatsView(APIView):
+    """
+    Connection pool metrics of the worker process serving the request, for staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(pooling.get_pool_stats())
@@ -1,11 +1,151 @@
 from django.conf import settings
+from django.db import DatabaseError, connections
+
+from collections import Counter
+from contextvars import ContextVar
+from typing import *
+import itertools
+import threading
+import time
+
+# Replicas chosen for the current request and the apps it must read from the primary, see ReplicaRoutingMiddleware
+_request_state = ContextVar('request_state', default=None)
+
+
+def start_request(pinned: Iterable[str] = ()):
+    """Starts routing the reads of a request to replicas.
+
+    Args:
+        pinned (Iterable[str], optional): Apps to read from the primary, e.g. written by a previous request. Defaults to ().
+
+    Returns:
+        Token: The token to pass to end_request
+    """
+
+    return _request_state.set({'replicas': {}, 'pinned': set(pinned), 'written': set()})
+
+
+def end_request(token) -> Set[str]:
+    """Releases the replicas chosen for a request.
+
+    Args:
+        token (Token): The token returned by start_request
+
+    Returns:
+        Set[str]: The apps the request wrote to
+    """
+
+    state = _request_state.get()
+    for app_label, alias in state['replicas'].items():
+        REPLICA_POOLS[app_label].release(alias)
+
+    _request_state.reset(token)
+
+    return state['written']
+
+
+def is_replica(alias: str) -> bool:
+    """Whether a database alias is one of the read replicas of an app, which follow their primary."""
+
+    return any(alias in aliases for aliases in settings.DATABASE_REPLICAS.values())
+
+
+def is_reading_replica() -> bool:
+    """Whether the current request read from a replica, which may lag behind the recent writes."""
+
+    state = _request_state.get()
+
+    return state is not None and any(alias != app_label for app_label, alias in state['replicas'].items())
+
+
+class ReplicaPool:
+    """
+    The read replicas of an app, with their replication lag and the number of requests reading from them
+    in this process. Replicas lagging by more than REPLICA_MAX_LAG seconds, not answering, or not streaming
+    from the primary, are left out.
+    """
+
+    def __init__(self, primary: str, aliases: List[str]):
+        self.primary = primary
+        self.aliases = aliases
+        self.cycle = itertools.cycle(aliases)
+        self.active = Counter()
+        self.available = {}
+        self.checked_at = {}
+        self.lock = threading.Lock()
+
+    def get_lag(self, alias: str) -> Optional[float]:
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0.0
+
+        try:
+            with connection.cursor() as cursor:
+                # A replica which replayed everything it received is not lagging, however old its last transaction,
+                # as long as it is still receiving. One whose WAL receiver disconnected falls behind unnoticed
+                cursor.execute(
+                    "SELECT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'), "
+                    "CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                )
+                streaming, lag = cursor.fetchone()
+        except DatabaseError:
+            return None
+
+        if not streaming:
+            return None
+
+        return float(lag or 0)
+
+    def is_available(self, alias: str) -> bool:
+        now = time.monotonic()
+
+        with self.lock:
+            checked_at = self.checked_at.get(alias)
+            if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+                return self.available.get(alias, False)
+
+            # Other threads keep the previous result while this one checks
+            self.checked_at[alias] = now
+
+        lag = self.get_lag(alias)
+        self.available[alias] = lag is not None and lag <= settings.REPLICA_MAX_LAG
+
+        return self.available[alias]
+
+    def acquire(self) -> str:
+        candidates = [alias for alias in self.aliases if self.is_available(alias)]
+        if not candidates:
+            return self.primary
+
+        with self.lock:
+            if settings.REPLICA_SELECTION == 'least_connections':
+                alias = min(candidates, key=lambda alias: self.active[alias])
+            else:
+                alias = next(alias for alias in self.cycle if alias in candidates)
+
+            self.active[alias] += 1
+
+        return alias
+
+    def release(self, alias: str) -> None:
+        if alias == self.primary:
+            return
+
+        with self.lock:
+            self.active[alias] -= 1
+
+
+REPLICA_POOLS = {app_label: ReplicaPool(app_label, aliases) for app_label, aliases in settings.DATABASE_REPLICAS.items()}
+
 
 class DjangoRouter:
     """
     A router to control all database operations on built-in models
     """
 
-    route_app_labels = {'admin', 'auth', 'contenttypes', 'sessions'}
+    # The abstract app holds the TilingJob queue, shared by all apps in the default database
+    route_app_labels = {'admin', 'auth', 'contenttypes', 'sessions', 'abstract'}
 
     def db_for_read(self, model, **hints):        
         if model._meta.app_label in self.route_app_labels:
@@ -33,18 +173,39 @@ class DjangoRouter:
 class AppRouter:
     """
     A router to control all database operations on projects.
-    Routes to a database with same name as app_label
+    Routes to a database with same name as app_label. Reads within a request go to one of the
+    read replicas of the app, if any, until the request writes to it or opens a transaction on it
     """
     projects = settings.NON_MANAGED_APPS
     # projects.remove('default') # Ensure the default databases is treated differently
 
     def db_for_read(self, model, **hints):
-        if model._meta.app_label in self.projects:
-            return model._meta.app_label
-        return None
+        app_label = model._meta.app_label
+        if app_label not in self.projects:
+            return None
+
+        # Outside of requests, e.g. in management commands and workers, everything reads from the primary
+        state = _request_state.get()
+        if (
+            state is None
+            or app_label not in REPLICA_POOLS
+            or app_label in state['pinned']
+            or app_label in state['written']
+            or connections[app_label].in_atomic_block
+        ):
+            return app_label
+
+        if app_label not in state['replicas']:
+            state['replicas'][app_label] = REPLICA_POOLS[app_label].acquire()
+
+        return state['replicas'][app_label]
 
     def db_for_write(self, model, **hints):
         if model._meta.app_label in self.projects:
+            state = _request_state.get()
+            if state is not None:
+                state['written'].add(model._meta.app_label)
+
             return model._meta.app_label
         return None
 
@@ -60,6 +221,7 @@ class AppRouter:
 
     def allow_migrate(self, db, app_label, model_name=None, **hints):
 
-        if app_label in self.projects:
+        # Apps migrate their own database only, and the databases of apps and their replicas hold nothing else
+        if app_label in self.projects or db in self.projects or is_replica(db):
             return app_label == db
         return None
\ No newline at end of file
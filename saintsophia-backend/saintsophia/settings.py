@@ -13,8 +13,9 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 
 import os
+from importlib.util import find_spec
 from django.utils.translation import gettext_lazy as _
-from .utils import read_json
+from .utils import read_json, get_database_config
 from .settings_local import *
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -97,7 +98,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    
+    'saintsophia.abstract.middleware.QueryCountMiddleware',
+    'saintsophia.abstract.middleware.ReplicaRoutingMiddleware',
+    'saintsophia.abstract.middleware.FuzzySearchResetMiddleware',
 ]
 
 ROOT_URLCONF = "saintsophia.urls"
@@ -133,7 +136,29 @@ SILENCED_SYSTEM_CHECKS = ["security.W019"]
 DATABASE_ROUTERS = ['saintsophia.routers.DjangoRouter', 'saintsophia.routers.AppRouter']
 
 
-DATABASES = {name: read_json(os.path.join(str(BASE_DIR), 'configs', name, 'db.json')) for name in APPS+NON_MANAGED_APPS}
+# Connection pooling is configured per database with the 'POOL' key of db.json, see get_database_config
+DATABASES = {name: get_database_config(read_json(os.path.join(str(BASE_DIR), 'configs', name, 'db.json'))) for name in APPS+NON_MANAGED_APPS}
+
+# Read replicas of an app, listed in configs/<app>/replicas.json with the same keys as db.json
+DATABASE_REPLICAS = {}
+
+for name in NON_MANAGED_APPS:
+    replicas_path = os.path.join(str(BASE_DIR), 'configs', name, 'replicas.json')
+    if not os.path.exists(replicas_path):
+        continue
+
+    DATABASE_REPLICAS[name] = []
+    for index, replica in enumerate(read_json(replicas_path)):
+        alias = f"{name}_replica_{index}"
+        DATABASES[alias] = {**get_database_config(replica), 'TEST': {'MIRROR': name}}
+        DATABASE_REPLICAS[name].append(alias)
+
+# Selection of the replica serving the reads of a request, 'round_robin' or 'least_connections'
+REPLICA_SELECTION = 'round_robin'
+
+# Replicas lagging behind the primary by more seconds are left out, checked at most once per interval
+REPLICA_MAX_LAG = 5
+REPLICA_LAG_CHECK_INTERVAL = 10
 
 
 
@@ -205,7 +230,128 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
     # 'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     # 'DEFAULT_SCHEMA_CLASS': 'saintsophia.abstract.schemas.SaintSophiaSchema',
-    'DEFAULT_PARSER_CLASSES': ['rest_framework_xml.parsers.XMLParser',],
-    'DEFAULT_RENDERER_CLASSES': ['rest_framework_xml.renderers.XMLRenderer',],
+    # JSON is the default, XML and MessagePack are chosen through the Accept header or ?format=
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework_xml.parsers.XMLParser',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'saintsophia.abstract.renderers.ORJSONRenderer',
+        'rest_framework_xml.renderers.XMLRenderer',
+        # MessagePack is only offered when the optional msgpack package is installed
+        *(['saintsophia.abstract.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    ],
 
-}
\ No newline at end of file
+}
+
+# Pyramid generation
+# Memory ceiling in bytes for a single conversion, and for the libvips operation cache
+PYRAMID_MAX_MEMORY = 512 * 1024 * 1024
+
+# Number of operations kept in the libvips cache, and threads per conversion (0 keeps the libvips default)
+PYRAMID_VIPS_CACHE_MAX = 10
+PYRAMID_VIPS_CONCURRENCY = 0
+
+# Encoding profile of the pyramids, see TIFF_PROFILES in saintsophia.abstract.models
+DEFAULT_TIFF_PROFILE = 'jpeg-256'
+
+# Uncompressed size in bytes above which pyramids are written as BigTIFF
+TIFF_BIGTIFF_THRESHOLD = 3 * 1024 * 1024 * 1024
+
+# Generate pyramids in the process_tiling_jobs workers instead of during the request
+TILING_ASYNC = False
+
+# Built-in IIIF Image API 3.0 server, serving the pyramids under IIIF_SERVER_PREFIX
+# Its endpoints decode images on request, enable it in the local settings of deployments without an external IIIF server
+IIIF_SERVER_ENABLED = globals().get('IIIF_SERVER_ENABLED', False)
+IIIF_SERVER_PREFIX = '/iiif/'
+
+# Number of pyramids kept open, and size in bytes of the cache of encoded responses
+IIIF_HANDLE_CACHE_SIZE = 64
+IIIF_RESPONSE_CACHE_SIZE = 256 * 1024 * 1024
+
+IIIF_CACHE_MAX_AGE = 24 * 60 * 60
+IIIF_MAX_AREA = 4096 * 4096
+IIIF_JPEG_QUALITY = 80
+
+# Static downscaled copies generated with every pyramid, by longest edge in pixels
+# The format is either 'webp' or 'jpg'
+DERIVATIVE_SIZES = [150, 400, 1200]
+DERIVATIVE_FORMAT = 'webp'
+DERIVATIVE_QUALITY = 80
+DERIVATIVES_URL = MEDIA_URL
+
+# Caches of the cached counts and API responses ('api'), and of the model version counters invalidating them ('api_versions').
+# Entries are keyed on the versions, so each process may keep its own entries in a bounded LRU cache, as long as the versions
+# are shared by all processes of the host, so that writes of any worker or management command invalidate the entries of
+# all workers. The version counters are kept apart, as they must never be culled together with the entries. Local settings
+# may configure their own caches, e.g. Redis or Memcached shared by several hosts, overriding these per alias
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'saintsophia.abstract.caching.BoundedLocMemCache',
+        'LOCATION': 'api',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'MAX_BYTES': 128 * 1024 * 1024,
+        },
+    },
+    'api_versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(str(BASE_DIR), 'cache', 'api_versions'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000000,
+        },
+    },
+    **globals().get('CACHES', {}),
+}
+
+API_CACHE_ALIAS = 'api'
+API_VERSION_CACHE_ALIAS = 'api_versions'
+COUNT_CACHE_TIMEOUT = 10 * 60
+
+# Maximal number of fields counted by one request to the facets action
+FACET_MAX_FIELDS = 10
+
+# Maximal number of values returned per facet, the most frequent first
+FACET_MAX_VALUES = 100
+
+# Vector tiles of the GeoViewSet tiles action, on a tile grid over MVT_BOUNDS in MVT_SRID
+# The defaults are the web mercator grid of web maps, local coordinate systems need their own bounds
+MVT_SRID = 3857
+MVT_BOUNDS = (-20037508.342789244, -20037508.342789244, 20037508.342789244, 20037508.342789244)
+MVT_MAX_ZOOM = 24
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MVT_SIMPLIFY_PIXELS = 1
+MVT_CACHE_TIMEOUT = 60 * 60
+
+# Simplification of GeoJSON geometries for ?zoom=, one pixel of a 256 pixel tile at zoom level 0
+# in the units of the geometries, e.g. 360 / 256 degrees for WGS 84
+SIMPLIFY_ZOOM0_TOLERANCE = 360 / 256
+
+# Default decimal digits of coordinates of geometries rendered by the database, as with ?precision=
+GEOJSON_PRECISION = 8
+
+# Cache rendered responses of anonymous reads, up to a size in bytes per response
+API_CACHE_RESPONSES = True
+API_CACHE_MAX_RESPONSE_SIZE = 5 * 1024 * 1024
+
+# Text search configurations of the text_vector triggers and the ?q= full-text search, see SearchVectorTrigger
+# PostgreSQL ships no stemmers for Old East Slavic and Ukrainian, 'simple' matches their word forms as written.
+# Add e.g. 'ukrainian' once such a configuration is installed, both in the migrations and here
+SEARCH_CONFIGS = ['simple', 'english', 'greek']
+SEARCH_HEADLINE_FRAGMENTS = 3
+
+# Default minimal word similarity of ?fuzzy= search matches, see FuzzySearchFilter
+FUZZY_SIMILARITY_THRESHOLD = 0.3
+
+# Report the number of database queries per request in the X-Query-Count header
+QUERY_COUNT_HEADER = DEBUG
+
+# Serve list endpoints through compiled serialization plans, see saintsophia.abstract.compiled
+FAST_SERIALIZATION = False
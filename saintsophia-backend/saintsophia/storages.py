@@ -1,6 +1,9 @@
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 
+import os
+import tempfile
+
 class OriginalFileStorage(FileSystemStorage):
     def __init__(self,) -> None:
 
@@ -9,10 +12,66 @@ class OriginalFileStorage(FileSystemStorage):
 
         super().__init__(location, base_url)
 
-class IIIFFileStorage(FileSystemStorage):
+class AtomicFileSystemStorage(FileSystemStorage):
+    """
+    A file system storage which can also take over files written elsewhere by the caller,
+    moving them into place atomically.
+    """
+
+    def get_temporary_path(self, name: str) -> str:
+        """Creates an empty temporary file next to the final path of `name`. Since it is on the same
+        file system, the file can later be moved into place with an atomic rename.
+
+        Args:
+            name (str): The name of the final file in the storage
+
+        Returns:
+            str: The absolute path of the temporary file
+        """
+
+        directory, filename = os.path.split(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+
+        # Hidden, so that it is never mistaken for a finished file
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{filename}.", suffix=".tmp", dir=directory)
+        os.close(fd)
+
+        return tmp_path
+
+    def save_from_path(self, name: str, tmp_path: str) -> str:
+        """Moves an already written file to `name` by an atomic rename, replacing any previous version.
+        Readers see either the previous file or the complete new one, never a missing or partial file.
+
+        Args:
+            name (str): The name of the final file in the storage
+            tmp_path (str): The absolute path of the written file, usually from get_temporary_path
+
+        Returns:
+            str: The name of the saved file
+        """
+
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if self.file_permissions_mode is not None:
+            os.chmod(tmp_path, self.file_permissions_mode)
+
+        os.replace(tmp_path, path)
+
+        return name
+
+class IIIFFileStorage(AtomicFileSystemStorage):
     def __init__(self,) -> None:
 
         location = settings.MEDIA_ROOT
         base_url = settings.IIIF_URL
 
-        super().__init__(location, base_url)
\ No newline at end of file
+        super().__init__(location, base_url)
+
+class DerivativeFileStorage(AtomicFileSystemStorage):
+    def __init__(self,) -> None:
+
+        location = settings.MEDIA_ROOT
+        base_url = settings.DERIVATIVES_URL
+
+        super().__init__(location, base_url)
@@ -23,8 +23,11 @@ from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.conf.urls.static import static
 from django.conf import settings
 
+from saintsophia.abstract.views import DatabasePoolStatsView
+
 urlpatterns = [
     path("i18n/", include("django.conf.urls.i18n")),
+    path("api/database/pools/", DatabasePoolStatsView.as_view(), name="database-pools"),
 ]
 
 apps = [path('', include(f"apps.{app['name']}.urls")) for app in settings.APPS_LOCAL]
@@ -37,6 +40,10 @@ urlpatterns += i18n_patterns(
     *apps,
     prefix_default_language=False
 )
+# Built-in IIIF Image API server for the pyramid TIFFs
+if settings.IIIF_SERVER_ENABLED:
+    urlpatterns += [path(settings.IIIF_SERVER_PREFIX.strip('/') + '/', include("saintsophia.abstract.iiif"))]
+
 urlpatterns += staticfiles_urlpatterns()
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
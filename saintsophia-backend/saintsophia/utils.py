@@ -1,9 +1,13 @@
+import django
 import json
+from importlib.util import find_spec
 from typing import *
 from django.apps import apps
 from django.urls import URLPattern, re_path
 from saintsophia.abstract import views
+from saintsophia.abstract.serializers import DerivativesField
 from rest_framework import serializers
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models
 
 from django.urls import path, include, re_path
@@ -16,6 +20,12 @@ DEFAULT_FIELDS = ['created_at', 'updated_at', 'id']
 
 DEFAULT_EXCLUDE = ['polymorphic_ctype']
 
+# Connection pool of each gunicorn worker, per database, unless overridden by 'POOL' in db.json
+DEFAULT_POOL_OPTIONS = {'min_size': 1, 'max_size': 4, 'timeout': 10, 'max_idle': 300}
+
+# Lifetime in seconds of persistent connections, if pooling is not available
+DEFAULT_CONN_MAX_AGE = 60
+
 
 
 def get_fields(model: models.Model, exclude: List[str] = DEFAULT_EXCLUDE) -> List[str]:
@@ -61,6 +71,54 @@ def read_json(path: str, encoding='utf-8', **kwargs) -> Dict:
         return json.load(f, **kwargs)
 
 
+def get_database_config(config: Dict) -> Dict:
+    """Applies the connection pooling options of a database configuration from a db.json file.
+    The optional 'POOL' key holds the options of the psycopg connection pool, e.g. min_size, max_size
+    and timeout, true for the default options, or false to disable pooling. Without psycopg 3 and psycopg_pool, or on other engines,
+    persistent connections with health checks are used instead.
+
+    Args:
+        config (Dict): The database configuration
+
+    Raises:
+        ImproperlyConfigured: If 'POOL' is neither a boolean nor an object of options
+
+    Returns:
+        Dict: The database configuration for the DATABASES setting
+    """
+
+    config = dict(config)
+    pool = config.pop('POOL', {})
+
+    if pool is True:
+        pool = {}
+    elif pool is not False and not isinstance(pool, dict):
+        raise ImproperlyConfigured(f"POOL of database {config.get('NAME')} must be true, false or an object of connection pool options, not {pool!r}.")
+
+    # The PostGIS backend is based on the PostgreSQL one
+    postgresql = config['ENGINE'].endswith(('postgresql', 'postgis'))
+
+    if pool is not False and postgresql and django.VERSION >= (5, 1) and find_spec('psycopg') and find_spec('psycopg_pool'):
+        from psycopg_pool import ConnectionPool
+
+        pool = {**DEFAULT_POOL_OPTIONS, **pool}
+
+        # Check connections when they are taken from the pool, like CONN_HEALTH_CHECKS
+        if hasattr(ConnectionPool, 'check_connection'):
+            pool.setdefault('check', ConnectionPool.check_connection)
+
+        config['OPTIONS'] = {**config.get('OPTIONS', {}), 'pool': pool}
+
+        # Pooled connections are returned to the pool after each request
+        config['CONN_MAX_AGE'] = 0
+        return config
+
+    config.setdefault('CONN_MAX_AGE', DEFAULT_CONN_MAX_AGE)
+    config.setdefault('CONN_HEALTH_CHECKS', True)
+
+    return config
+
+
 def get_serializer(model: models.Model, fields: Callable[[models.Model], List[str]] = get_fields, depth: int = 0) -> serializers.ModelSerializer:
     """Generates a BaseSerializer class dynamically for a given model. This method avoids threading
     inconsistencies since the generated serialzer class always have different references.
@@ -81,6 +139,14 @@ def get_serializer(model: models.Model, fields: Callable[[models.Model], List[st
 
     BaseSerializer.Meta.model = model
     BaseSerializer.Meta.fields = fields(model)
+
+    # Image models also expose the URLs of their thumbnails and previews
+    # The models module is imported here, since this module is loaded by the settings
+    from saintsophia.abstract.models import AbstractImageModel
+
+    if issubclass(model, AbstractImageModel):
+        BaseSerializer._declared_fields['derivatives'] = DerivativesField()
+        BaseSerializer.Meta.fields = [*BaseSerializer.Meta.fields, 'derivatives']
     BaseSerializer.Meta.depth  = depth
     BaseSerializer.Meta.ref_name = model._meta.model_name
 
@@ -110,6 +176,7 @@ def get_model_urls(app_label: str, base_url: str, exclude: List[str]) -> List[UR
             'list': rf'{base_url}/{model_name}/?$',
             'retrieve': rf'{base_url}/{model_name}/(?P<pk>[0-9]+)/',
             'count': rf'{base_url}/{model_name}/count/?$',
+            'facets': rf'{base_url}/{model_name}/facets/?$',
         }
 
         for action, url in urls.items():